@@ -1,13 +1,22 @@
-from fastapi import APIRouter
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, Request
+from pydantic import BaseModel, Field, ValidationError
+from typing import Optional
+import asyncio
 import time
-from threat_engine import calculate_threat_score_with_ml, correlate_events, auto_respond, INCIDENTS, get_ml_stats
+import pipeline
+from batch_io import read_json_records
+from models import MAX_TIMESTAMP
+from pipeline import PipelineFull, get_pipeline_stats
+from config import INGEST_RETRY_AFTER
+from event_store import query_events
+from threat_engine import auto_respond, INCIDENTS, get_ml_stats
 
 router = APIRouter(prefix="/agent")
 
 # Org-isolated data stores
 AGENTS_BY_ORG = {}
-EVENTS_BY_ORG = {}
+
+MAX_BATCH_EVENTS = 1000
 
 class Registration(BaseModel):
     agent_id: str
@@ -20,11 +29,12 @@ class Registration(BaseModel):
 class Heartbeat(BaseModel):
     agent_id: str
     org_id: str
+    stats: Optional[dict] = None  # agent self-reported runtime stats (poll interval, CPU budget use)
 
 class Event(BaseModel):
     agent_id: str
     event_type: str
-    timestamp: int
+    timestamp: int = Field(ge=0, le=MAX_TIMESTAMP)  # segment files are named by day
     details: dict
     org_id: str
 
@@ -50,38 +60,68 @@ def agent_heartbeat(hb: Heartbeat):
     if org_id in AGENTS_BY_ORG and hb.agent_id in AGENTS_BY_ORG[org_id]:
         AGENTS_BY_ORG[org_id][hb.agent_id]["last_seen"] = int(time.time())
         AGENTS_BY_ORG[org_id][hb.agent_id]["status"] = "online"
+        if hb.stats is not None:
+            AGENTS_BY_ORG[org_id][hb.agent_id]["stats"] = hb.stats
         return {"msg": "Heartbeat OK"}
     return {"error": "Unknown agent"}, 404
 
-@router.post("/event")
-def receive_event(event: Event):
+def enqueue_events(evt_dicts):
+    """Hand events to the ingest pipeline, or signal backpressure"""
+    try:
+        return pipeline.submit(evt_dicts)
+    except PipelineFull:
+        raise HTTPException(
+            status_code=429,
+            detail="Ingest queue full, retry later",
+            headers={"Retry-After": str(INGEST_RETRY_AFTER)}
+        )
+
+@router.post("/event", status_code=202)
+async def receive_event(event: Event, wait: bool = False):
+    """Accept an event for scoring; pass wait=true to get its threat score back"""
     org_id = event.org_id
-    if org_id not in EVENTS_BY_ORG:
-        EVENTS_BY_ORG[org_id] = []
-    
-    evt_dict = event.dict()
-    threat_score = calculate_threat_score_with_ml(evt_dict)  # CHANGED THIS LINE
-    evt_dict["threat_score"] = threat_score
+    future = enqueue_events([event.dict()])
+    if not wait:
+        return {"msg": "Event accepted", "org_id": org_id}
     
-    EVENTS_BY_ORG[org_id].append(evt_dict)
-    
-    # Auto-trigger response if high severity
-    if threat_score > 60:
-        print(f"⚠️ HIGH THREAT for org {org_id}: Triggering auto-response")
-        new_incidents = correlate_events(EVENTS_BY_ORG[org_id])
-        for inc in new_incidents:
-            print(f"🚨 AUTO-RESPONSE INITIATED: {inc}")
+    threat_score = (await asyncio.wrap_future(future))[0]
+    return {"msg": "Event logged", "threat_score": threat_score, "org_id": org_id}
+
+@router.post("/events/batch", status_code=202)
+async def receive_event_batch(request: Request, wait: bool = False):
+    """Ingest many events per call (JSON array or NDJSON, optionally gzip'd)"""
+    try:
+        # Oversized batches are refused with 413 while reading, before validation
+        items = await read_json_records(request, max_records=MAX_BATCH_EVENTS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid event batch: {e}")
+    try:
+        events = [Event(**item) for item in items]
+    except (TypeError, ValidationError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid event batch: {e}")
     
-    if len(EVENTS_BY_ORG[org_id]) > 1000:
-        EVENTS_BY_ORG[org_id].pop(0)
+    evt_dicts = [e.dict() for e in events]
+    future = enqueue_events(evt_dicts)
+    if not wait:
+        return {"msg": "Events accepted", "count": len(evt_dicts)}
     
-    return {"msg": "Event logged", "threat_score": threat_score, "org_id": org_id}
+    scores = await asyncio.wrap_future(future)
+    results = [
+        {"agent_id": e["agent_id"], "org_id": e["org_id"], "threat_score": score}
+        for e, score in zip(evt_dicts, scores)
+    ]
+    return {"msg": "Events logged", "count": len(results), "results": results}
+
+@router.get("/pipeline/stats")
+def get_ingest_pipeline_stats():
+    """Queue depths and throughput counters for the ingest pipeline"""
+    return get_pipeline_stats()
 
 @router.get("/events")
-def get_events(org_id: str, limit: int = 25):
-    if org_id not in EVENTS_BY_ORG:
-        return []
-    return list(EVENTS_BY_ORG[org_id])[-limit:]
+def get_events(org_id: str, limit: int = 25, since: Optional[int] = None,
+               until: Optional[int] = None, agent_id: Optional[str] = None):
+    """Recent events from memory, falling back to on-disk segments for older ones"""
+    return query_events(org_id, limit=limit, since=since, until=until, agent_id=agent_id)
 
 @router.get("/incidents")
 def get_incidents():
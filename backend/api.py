@@ -1,4 +1,4 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from agent import router as agent_router
 from auth import router as auth_router
@@ -7,8 +7,13 @@ from integrations import router as integrations_router
 from baseline import router as baseline_router
 from forensics import router as forensics_router
 from saas import router as saas_router
-from ml_engine import detector
-import json
+from retention import router as retention_router, RETENTION
+from search_index import router as search_router, SEARCH
+import forensics
+from ml_engine import registry, retrainer, model_key
+import pipeline
+import event_store
+from typing import Optional
 from fastapi.staticfiles import StaticFiles
 
 app = FastAPI(title="REFLEX - Autonomous SOC Platform v4.0 (ML + SaaS)")
@@ -48,6 +53,17 @@ def startup_event():
         "renewal_date": 1704033200
     }
     print("✅ Default organization initialized")
+    
+    registry.warm_start()
+    pipeline.start()
+    RETENTION.start()
+    # Live indexing starts now; older events and audit incidents are indexed in the background
+    SEARCH.backfill([event_store.cold_event_docs, forensics.audit_incident_docs])
+
+@app.on_event("shutdown")
+def shutdown_event():
+    """Spill in-memory events to the cold tier so they survive a restart"""
+    event_store.flush_all()
 
 # Include all routers
 app.include_router(auth_router)
@@ -57,6 +73,57 @@ app.include_router(integrations_router)
 app.include_router(baseline_router)
 app.include_router(forensics_router)
 app.include_router(saas_router)
+app.include_router(retention_router)
+app.include_router(search_router)
+
+@app.get("/ml/stats")
+def get_ml_stats(org_id: Optional[str] = None):
+    """Get ML detection statistics, platform-wide or for one org"""
+    return registry.get_detection_stats(org_id)
+
+@app.get("/ml/retrain")
+def get_retrain_status():
+    """Get background retraining status"""
+    return retrainer.get_status()
+
+@app.get("/ml/models")
+def list_models():
+    """List stored model versions per tenant"""
+    return registry.list_models()
+
+@app.get("/ml/models/{org_id}")
+def get_model_versions(org_id: str, agent_group: Optional[str] = None):
+    """Get stored versions, active and pinned version for one model"""
+    manifest = registry.store.read_manifest(model_key(org_id, agent_group))
+    if not manifest["versions"]:
+        raise HTTPException(status_code=404, detail="No stored models")
+    return manifest
+
+@app.post("/ml/models/{org_id}/pin")
+def pin_model(org_id: str, version: int, agent_group: Optional[str] = None):
+    """Pin a model version so retraining does not replace it"""
+    try:
+        return registry.pin(model_key(org_id, agent_group), version)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@app.post("/ml/models/{org_id}/unpin")
+def unpin_model(org_id: str, agent_group: Optional[str] = None):
+    """Return to the newest trained model version"""
+    try:
+        return registry.unpin(model_key(org_id, agent_group))
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@app.post("/ml/models/{org_id}/rollback")
+def rollback_model(org_id: str, version: Optional[int] = None, agent_group: Optional[str] = None):
+    """Roll back to (and pin) the previous or given model version"""
+    try:
+        return registry.rollback(model_key(org_id, agent_group), version)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+# Static dashboard is mounted after the API routes so it does not shadow them
 app.mount("/", StaticFiles(directory="../frontend", html=True), name="static")
 
 @app.get("/")
@@ -71,10 +138,5 @@ def root():
             "ml_detection",
             "saas_billing"
         ],
-        "ml_status": detector.get_detection_stats()
+        "ml_status": registry.get_detection_stats()
     }
-
-@app.get("/ml/stats")
-def get_ml_stats():
-    """Get ML detection statistics"""
-    return detector.get_detection_stats()
@@ -1,10 +1,26 @@
-from fastapi import APIRouter, HTTPException, Body
+from fastapi import APIRouter, HTTPException, Body, Request, Response
+from pydantic import ValidationError
+from typing import Dict
+import hashlib
+import json
 from models import Baseline, BaselineEntry, Policy
+from threat_engine import THREAT_RULESET, set_threat_rules
+from batch_io import read_json_records
+from config import BASELINE_RETENTION_ITEMS, RETENTION_STORE_BYTES
+from retention import RETENTION
 
 router = APIRouter(prefix="/baseline")
 
 BASELINE = Baseline(entries=[])
 POLICY = Policy(allow=["python", "flask"], block=["bash", "sleep", "socat"])
+POLICY_VERSION = 1
+RETENTION.register("baseline_entries", lambda: BASELINE.entries, max_items=BASELINE_RETENTION_ITEMS,
+                   max_bytes=RETENTION_STORE_BYTES)
+
+def policy_etag():
+    # Content-derived, so agents revalidate correctly across backend restarts
+    digest = hashlib.sha256(json.dumps(POLICY.dict(), sort_keys=True).encode()).hexdigest()
+    return f'"{digest[:16]}"'
 
 @router.get("/")
 def get_baseline():
@@ -15,15 +31,32 @@ def add_entry(entry: BaselineEntry):
     BASELINE.entries.append(entry)
     return {"msg": "Entry added", "baseline_size": len(BASELINE.entries)}
 
+@router.post("/entries/batch")
+async def add_entry_batch(request: Request):
+    """Bulk baseline upload from agents in learn mode"""
+    try:
+        entries = [BaselineEntry(**item) for item in await read_json_records(request)]
+    except (ValueError, ValidationError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid baseline batch: {e}")
+    BASELINE.entries.extend(entries)
+    return {"msg": "Entries added", "count": len(entries), "baseline_size": len(BASELINE.entries)}
+
 @router.get("/policy")
-def get_policy():
+def get_policy(request: Request, response: Response):
+    """Current policy; honours If-None-Match so agents can poll cheaply"""
+    etag = policy_etag()
+    headers = {"ETag": etag, "X-Policy-Version": str(POLICY_VERSION), "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
     return POLICY
 
 @router.post("/policy", response_model=dict)
 def set_policy(policy: Policy = Body(...)):
-    global POLICY
+    global POLICY, POLICY_VERSION
     POLICY = policy
-    return {"msg": "Policy updated"}
+    POLICY_VERSION += 1
+    return {"msg": "Policy updated", "version": POLICY_VERSION, "etag": policy_etag()}
 
 @router.get("/allowlist")
 def get_allowlist():
@@ -32,3 +65,12 @@ def get_allowlist():
 @router.get("/blocklist")
 def get_blocklist():
     return {"block": POLICY.block}
+
+@router.get("/rules")
+def get_threat_rules():
+    return {"rules": THREAT_RULESET.rules, "version": THREAT_RULESET.version}
+
+@router.post("/rules", response_model=dict)
+def update_threat_rules(rules: Dict[str, int] = Body(...)):
+    version = set_threat_rules(rules)
+    return {"msg": "Threat rules updated", "rule_count": len(rules), "version": version}
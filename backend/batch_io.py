@@ -0,0 +1,66 @@
+import json
+import zlib
+from fastapi import HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+from config import INGEST_MAX_BODY_BYTES, INGEST_MAX_DECODED_BYTES
+
+DEFAULT_MAX_RECORDS = 1000
+
+def too_large(detail: str) -> HTTPException:
+    return HTTPException(status_code=413, detail=detail)
+
+def gunzip(body: bytes, limit: int = INGEST_MAX_DECODED_BYTES) -> bytes:
+    """Decompress a (possibly multi-member) gzip body, refusing to inflate past limit"""
+    parts = []
+    size = 0
+    while body:
+        inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            part = inflater.decompress(body, limit - size + 1)
+        except zlib.error as e:
+            raise ValueError(f"Bad gzip body: {e}")
+        size += len(part)
+        if size > limit:
+            raise too_large(f"Decompressed body exceeds {limit} bytes")
+        if not inflater.eof:
+            raise ValueError("Bad gzip body: truncated")
+        parts.append(part)
+        body = inflater.unused_data.lstrip(b"\x00")
+    return b"".join(parts)
+
+def parse_json_records(body: bytes, content_encoding: str = None, max_records: int = DEFAULT_MAX_RECORDS):
+    """Parse a JSON array or NDJSON body (optionally gzip'd) into a list of dicts"""
+    if content_encoding == "gzip":
+        body = gunzip(body)
+    text = body.decode("utf-8").strip()
+    if not text:
+        return []
+    if text.startswith("["):
+        items = json.loads(text)
+        if len(items) > max_records:
+            raise too_large(f"Batch exceeds {max_records} records")
+    else:
+        items = []
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            if len(items) == max_records:
+                raise too_large(f"Batch exceeds {max_records} records")
+            items.append(json.loads(line))
+    if not all(isinstance(item, dict) for item in items):
+        raise ValueError("Each record must be a JSON object")
+    return items
+
+async def read_json_records(request: Request, max_records: int = DEFAULT_MAX_RECORDS):
+    """Read and parse a batch body; 413 past INGEST_MAX_BODY_BYTES, the inflated cap or max_records"""
+    declared = request.headers.get("content-length")
+    if declared is not None and declared.isdigit() and int(declared) > INGEST_MAX_BODY_BYTES:
+        raise too_large(f"Body exceeds {INGEST_MAX_BODY_BYTES} bytes")
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > INGEST_MAX_BODY_BYTES:
+            raise too_large(f"Body exceeds {INGEST_MAX_BODY_BYTES} bytes")
+    # Inflating and parsing are CPU-bound; keep them off the event loop
+    return await run_in_threadpool(parse_json_records, bytes(body),
+                                   request.headers.get("content-encoding"), max_records)
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# Fork-storm benchmark for reflex_agent: spawns a configurable mix of allowed/blocked,
+# short/long-lived children under a monitored parent, runs the agent with --contain
+# against an in-process stub backend, and reports detection/kill latency and misses.
+import argparse
+import gzip
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+POLICY = {"allow": ["true", "tail"], "block": ["sleep"]}
+
+# kind -> argv; "sleep" is blocked by POLICY, the rest are allowed
+WORKLOADS = {
+    "allow_short": ["true"],
+    "allow_long": ["tail", "-f", "/dev/null"],
+    "block_short": ["sleep", "0.05"],
+    "block_long": ["sleep", "30"]
+}
+
+# ----- stub backend -----
+
+class StubBackend:
+    """Minimal stand-in for the REFLEX API: serves POLICY and records incidents"""
+
+    def __init__(self, port=0):
+        self.incidents = []
+        self.heartbeats = []
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, code, body=None):
+                data = json.dumps(body or {}).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path.startswith("/baseline/policy"):
+                    return self._reply(200, POLICY)
+                self._reply(404)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+                received = time.time()
+                if self.path == "/forensics/incidents/batch":
+                    records = [json.loads(line) for line in body.decode().splitlines() if line.strip()]
+                    with stub.lock:
+                        stub.incidents.extend((received, r) for r in records)
+                elif self.path == "/agent/heartbeat":
+                    with stub.lock:
+                        stub.heartbeats.append(json.loads(body))
+                self._reply(200, {"msg": "ok"})
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+
+# ----- spawner (the monitored parent) -----
+
+def run_spawner(rate, duration, block_ratio, long_ratio, seed):
+    """Child-process mode: wait for 'go' on stdin, fork the storm, report each child as JSON"""
+    rng = random.Random(seed)
+    children = {}
+    unclaimed = {}  # pid -> (exited_at, signal) for exits seen before the pid was recorded
+    lock = threading.Lock()
+    finished = threading.Event()
+
+    def reap():
+        while True:
+            try:
+                # Wait without reaping: the exited child stays a zombie, so its pid cannot
+                # be recycled (and signalled by mistake) until it is reaped under the lock
+                pid = os.waitid(os.P_ALL, 0, os.WEXITED | os.WNOWAIT).si_pid
+            except ChildProcessError:
+                if finished.is_set():
+                    return
+                time.sleep(0.01)
+                continue
+            with lock:
+                _, status = os.waitpid(pid, 0)
+                exited = (time.time(), os.WTERMSIG(status) if os.WIFSIGNALED(status) else 0)
+                child = children.get(pid)
+                if child is None:
+                    unclaimed[pid] = exited
+                else:
+                    child["exited_at"], child["signal"] = exited
+
+    sys.stdin.readline()
+    reaper = threading.Thread(target=reap, daemon=True)
+    reaper.start()
+    start = time.time()
+    n = 0
+    while time.time() - start < duration:
+        due = start + n / rate
+        if due > time.time():
+            time.sleep(due - time.time())
+        blocked = rng.random() < block_ratio
+        long_lived = rng.random() < long_ratio
+        kind = f"{'block' if blocked else 'allow'}_{'long' if long_lived else 'short'}"
+        spawned_at = time.time()
+        # Held across spawn and insert so the reaper always finds the child recorded
+        with lock:
+            pid = os.posix_spawnp(WORKLOADS[kind][0], WORKLOADS[kind], os.environ)
+            child = children[pid] = {"pid": pid, "kind": kind, "spawned_at": spawned_at}
+            if pid in unclaimed:
+                child["exited_at"], child["signal"] = unclaimed.pop(pid)
+        n += 1
+    # Let the agent catch up, then clean up whatever is still running
+    sys.stdin.readline()
+    finished.set()
+    # Under the lock no survivor can be reaped meanwhile, so each pid is still ours
+    with lock:
+        survivors = [c["pid"] for c in children.values() if "exited_at" not in c]
+        for pid in survivors:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    deadline = time.time() + 5
+    while time.time() < deadline and any("exited_at" not in c for c in children.values()):
+        time.sleep(0.05)
+    survivors = set(survivors)
+    for child in children.values():
+        child["survived"] = child["pid"] in survivors
+        print(json.dumps(child))
+    sys.stdout.flush()
+
+# ----- harness -----
+
+def percentiles(values):
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+    pick = lambda p: values[min(len(values) - 1, int(p / 100 * len(values)))]
+    return {
+        "count": len(values),
+        "p50_ms": round(pick(50) * 1000, 2),
+        "p90_ms": round(pick(90) * 1000, 2),
+        "p99_ms": round(pick(99) * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2)
+    }
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+def run_benchmark(args):
+    stub = StubBackend()
+    workdir = tempfile.mkdtemp(prefix="reflex-bench-")
+    spawner = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--spawner",
+         "--rate", str(args.rate), "--duration", str(args.duration),
+         "--block-ratio", str(args.block_ratio), "--long-ratio", str(args.long_ratio),
+         "--seed", str(args.seed)],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+    )
+    agent = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, "reflex_agent.py"),
+         "--monitor-pid", str(spawner.pid), "--contain", "--mode", args.mode,
+         "--interval", str(args.interval), "--api-base", stub.url,
+         "--spool", os.path.join(workdir, "spool.ndjson")],
+        cwd=workdir, stdout=subprocess.DEVNULL if not args.verbose else None
+    )
+    try:
+        time.sleep(args.warmup)
+        cpu_start, wall_start = cpu_seconds(agent.pid), time.time()
+        spawner.stdin.write("go\n")
+        spawner.stdin.flush()
+        time.sleep(args.duration + args.drain)
+        cpu_used = cpu_seconds(agent.pid) - cpu_start
+        wall = time.time() - wall_start
+        spawner.stdin.write("done\n")
+        spawner.stdin.flush()
+        children = [json.loads(line) for line in spawner.stdout]
+        spawner.wait()
+    finally:
+        agent.terminate()
+        agent.wait()
+        stub.close()
+
+    with stub.lock:
+        incidents = {}
+        for received, record in stub.incidents:
+            incidents.setdefault(record["pid"], (received, record))
+
+    detect, kill, report = [], [], []
+    missed = {kind: 0 for kind in WORKLOADS}
+    unkilled = 0
+    for child in children:
+        seen = incidents.get(child["pid"])
+        if seen is None:
+            missed[child["kind"]] += 1
+            if child["kind"] == "block_long":
+                unkilled += 1
+            continue
+        received, record = seen
+        details = record.get("details", {})
+        if "detected_at" in details:
+            detect.append(details["detected_at"] - child["spawned_at"])
+        report.append(received - child["spawned_at"])
+        if child["kind"].startswith("block"):
+            if child.get("signal") == signal.SIGKILL:
+                kill.append(child["exited_at"] - child["spawned_at"])
+            elif child["kind"] == "block_long":
+                unkilled += 1
+
+    return {
+        "config": {
+            "mode": args.mode, "rate": args.rate, "duration": args.duration,
+            "block_ratio": args.block_ratio, "long_ratio": args.long_ratio, "interval": args.interval
+        },
+        "spawned": len(children),
+        "spawned_by_kind": {kind: sum(c["kind"] == kind for c in children) for kind in WORKLOADS},
+        "spawn_to_detect": percentiles(detect),
+        "spawn_to_kill": percentiles(kill),
+        "spawn_to_report": percentiles(report),
+        "missed_by_kind": missed,
+        "blocked_long_not_killed": unkilled,
+        "agent_cpu": {"seconds": round(cpu_used, 3), "cores": round(cpu_used / wall, 4)}
+    }
+
+def print_report(result):
+    cfg = result["config"]
+    print(f"Fork storm: {cfg['rate']}/s for {cfg['duration']}s, mode={cfg['mode']}, "
+          f"{result['spawned']} children {result['spawned_by_kind']}")
+    for name in ("spawn_to_detect", "spawn_to_kill", "spawn_to_report"):
+        p = result[name]
+        if p["count"]:
+            print(f"  {name:16} n={p['count']:<6} p50={p['p50_ms']}ms p90={p['p90_ms']}ms "
+                  f"p99={p['p99_ms']}ms max={p['max_ms']}ms")
+        else:
+            print(f"  {name:16} n=0")
+    print(f"  missed           {result['missed_by_kind']}")
+    print(f"  long-lived blocked children not killed: {result['blocked_long_not_killed']}")
+    print(f"  agent CPU        {result['agent_cpu']['seconds']}s "
+          f"({result['agent_cpu']['cores'] * 100:.2f}% of a core)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fork-storm benchmark for reflex_agent containment")
+    parser.add_argument('--rate', type=float, default=50, help='Children spawned per second')
+    parser.add_argument('--duration', type=float, default=10, help='Storm length (seconds)')
+    parser.add_argument('--block-ratio', type=float, default=0.3, help='Fraction of blocked commands')
+    parser.add_argument('--long-ratio', type=float, default=0.5, help='Fraction of long-lived children')
+    parser.add_argument('--mode', choices=['auto', 'netlink', 'poll'], default='auto',
+                        help='Agent process event source')
+    parser.add_argument('--interval', type=float, default=0.1, help='Agent initial polling interval')
+    parser.add_argument('--warmup', type=float, default=2.0, help='Seconds to let the agent attach')
+    parser.add_argument('--drain', type=float, default=3.0, help='Seconds to wait after the storm')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='Also write the results to this file')
+    parser.add_argument('--verbose', action='store_true', help='Show agent output')
+    parser.add_argument('--spawner', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.spawner:
+        run_spawner(args.rate, args.duration, args.block_ratio, args.long_ratio, args.seed)
+        sys.exit(0)
+    result = run_benchmark(args)
+    print_report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
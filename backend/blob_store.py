@@ -0,0 +1,166 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, Iterable, List, Optional
+from config import BLOB_STORE_DIR
+
+DIGEST_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+def digest_of(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+def is_digest(value: str) -> bool:
+    return DIGEST_PATTERN.fullmatch(value) is not None
+
+class BlobStore:
+    """Content-addressed, zlib-compressed, refcounted artifact store on local disk.
+
+    Blobs live at <root>/<d[:2]>/<d[2:4]>/<digest>; sizes and refcounts are kept
+    in a small SQLite index next to them. A reference may be recorded before the
+    blob arrives (the agent uploads lazily); such a digest still reads as missing.
+    """
+
+    def __init__(self, root: str = BLOB_STORE_DIR):
+        self.root = root
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def _db(self):
+        if self.conn is None:
+            os.makedirs(self.root, exist_ok=True)
+            self.conn = sqlite3.connect(os.path.join(self.root, "index.db"), check_same_thread=False)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS blobs (
+                    digest TEXT PRIMARY KEY,
+                    size INTEGER,
+                    stored_size INTEGER,
+                    refcount INTEGER NOT NULL DEFAULT 0,
+                    created REAL
+                )
+            ''')
+        return self.conn
+
+    def _path(self, digest: str) -> str:
+        # Digests end up in file paths; anything but a SHA-256 hex string could traverse
+        if not is_digest(digest):
+            raise ValueError(f"Invalid digest: {digest!r}")
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def put(self, content: bytes, digest: Optional[str] = None) -> bool:
+        """Store content under its SHA-256; False if it was already present"""
+        actual = digest_of(content)
+        if digest is not None and digest != actual:
+            raise ValueError(f"Digest mismatch: expected {digest}, got {actual}")
+        with self.lock:
+            conn = self._db()
+            row = conn.execute('SELECT size FROM blobs WHERE digest = ?', (actual,)).fetchone()
+            if row is not None and row[0] is not None:
+                return False
+            path = self._path(actual)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            data = zlib.compress(content)
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            with conn:
+                conn.execute('''
+                    INSERT INTO blobs (digest, size, stored_size, refcount, created) VALUES (?, ?, ?, 0, ?)
+                    ON CONFLICT(digest) DO UPDATE SET size = excluded.size,
+                        stored_size = excluded.stored_size, created = excluded.created
+                ''', (actual, len(content), len(data), time.time()))
+            return True
+
+    def get(self, digest: str) -> Optional[bytes]:
+        try:
+            with open(self._path(digest), "rb") as f:
+                return zlib.decompress(f.read())
+        except FileNotFoundError:
+            return None
+
+    def missing(self, digests: Iterable[str]) -> List[str]:
+        """Which of these digests have no stored content yet"""
+        digests = list(dict.fromkeys(digests))
+        if not digests:
+            return []
+        with self.lock:
+            conn = self._db()
+            present = set()
+            for i in range(0, len(digests), 500):
+                chunk = digests[i:i + 500]
+                marks = ",".join("?" * len(chunk))
+                present.update(d for (d,) in conn.execute(
+                    f'SELECT digest FROM blobs WHERE size IS NOT NULL AND digest IN ({marks})', chunk))
+        return [d for d in digests if d not in present]
+
+    def add_refs(self, digests: Iterable[str]):
+        self._adjust(digests, 1)
+
+    def release(self, digests: Iterable[str]):
+        self._adjust(digests, -1)
+
+    def _adjust(self, digests, delta):
+        counts = {}
+        for d in digests:
+            if is_digest(d):
+                counts[d] = counts.get(d, 0) + delta
+        if not counts:
+            return
+        with self.lock:
+            conn = self._db()
+            with conn:
+                conn.executemany('''
+                    INSERT INTO blobs (digest, refcount) VALUES (?, MAX(?, 0))
+                    ON CONFLICT(digest) DO UPDATE SET refcount = MAX(refcount + ?, 0)
+                ''', [(d, n, n) for d, n in counts.items()])
+
+    def gc(self, min_age: float = 3600) -> int:
+        """Delete unreferenced blobs older than min_age; returns how many were removed"""
+        # The age guard covers blobs uploaded just ahead of the incident that references them
+        cutoff = time.time() - min_age
+        with self.lock:
+            conn = self._db()
+            victims = [d for (d,) in conn.execute(
+                'SELECT digest FROM blobs WHERE refcount = 0 AND (created IS NULL OR created < ?)', (cutoff,))]
+            for digest in victims:
+                if not is_digest(digest):
+                    continue  # index row without a file; only the row is dropped
+                try:
+                    os.remove(self._path(digest))
+                except FileNotFoundError:
+                    pass
+            with conn:
+                conn.executemany('DELETE FROM blobs WHERE digest = ?', [(d,) for d in victims])
+        return len(victims)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            count, size, stored, refs = self._db().execute('''
+                SELECT COUNT(size), COALESCE(SUM(size), 0), COALESCE(SUM(stored_size), 0),
+                       COALESCE(SUM(refcount), 0) FROM blobs
+            ''').fetchone()
+        return {"blobs": count, "bytes": size, "stored_bytes": stored, "references": refs}
+
+BLOBS = BlobStore()
+
+def incident_digests(record: Dict, strict: bool = False) -> List[str]:
+    """Artifact digests an incident refers to (details.forensics.artifacts).
+
+    Values that are not SHA-256 hex digests are skipped, or raise ValueError if strict.
+    """
+    forensics = (record.get("details") or {}).get("forensics") or {}
+    artifacts = forensics.get("artifacts") if isinstance(forensics, dict) else None
+    if not isinstance(artifacts, dict):
+        return []
+    digests = []
+    for field, value in artifacts.items():
+        if isinstance(value, str) and is_digest(value):
+            digests.append(value)
+        elif strict:
+            raise ValueError(f"Artifact {field!r} is not a SHA-256 hex digest")
+    return digests
@@ -3,3 +3,71 @@ import os
 BASENAME = os.environ.get("REFLEX_BASENAME", "REFLEX")
 SAFE_MODE = bool(os.environ.get("REFLEX_SAFE_MODE", "0") == "1")
 ML_API = os.environ.get("REFLEX_ML_API", "http://localhost:8000/ml/score")
+
+# Ingest pipeline
+INGEST_QUEUE_EVENTS = int(os.environ.get("REFLEX_INGEST_QUEUE_EVENTS", "20000"))
+CORRELATION_QUEUE_SIZE = int(os.environ.get("REFLEX_CORRELATION_QUEUE_SIZE", "256"))
+SCORING_BATCH_EVENTS = int(os.environ.get("REFLEX_SCORING_BATCH_EVENTS", "2000"))
+INGEST_RETRY_AFTER = int(os.environ.get("REFLEX_INGEST_RETRY_AFTER", "1"))
+# Batch upload bodies: raw size, and size after gzip inflation
+INGEST_MAX_BODY_BYTES = int(os.environ.get("REFLEX_INGEST_MAX_BODY_BYTES", str(16 * 1024 * 1024)))
+INGEST_MAX_DECODED_BYTES = int(os.environ.get("REFLEX_INGEST_MAX_DECODED_BYTES", str(64 * 1024 * 1024)))
+
+# Sliding-window correlation
+CORRELATION_WINDOW_SECONDS = int(os.environ.get("REFLEX_CORRELATION_WINDOW_SECONDS", "300"))
+CORRELATION_SCORE_THRESHOLD = int(os.environ.get("REFLEX_CORRELATION_SCORE_THRESHOLD", "60"))
+CORRELATION_MIN_EVENTS = int(os.environ.get("REFLEX_CORRELATION_MIN_EVENTS", "2"))
+INCIDENT_MAX_EVENTS = int(os.environ.get("REFLEX_INCIDENT_MAX_EVENTS", "50"))
+
+# Background model retraining
+ML_RETRAIN_INTERVAL_SECONDS = float(os.environ.get("REFLEX_ML_RETRAIN_INTERVAL_SECONDS", "300"))
+ML_RETRAIN_EVERY_EVENTS = int(os.environ.get("REFLEX_ML_RETRAIN_EVERY_EVENTS", "500"))
+ML_TRAIN_SAMPLES = int(os.environ.get("REFLEX_ML_TRAIN_SAMPLES", "1000"))
+
+# Per-tenant model cache
+ML_MODEL_CACHE_BYTES = int(os.environ.get("REFLEX_ML_MODEL_CACHE_BYTES", str(256 * 1024 * 1024)))
+# Floor charged per resident detector, so untrained ones still count against the budget
+ML_MODEL_MIN_BYTES = int(os.environ.get("REFLEX_ML_MODEL_MIN_BYTES", str(64 * 1024)))
+
+# Versioned model store (also where evicted tenant models are reloaded from)
+ML_MODEL_STORE_DIR = os.environ.get("REFLEX_ML_MODEL_STORE_DIR", "model_store")
+ML_MODEL_KEEP_VERSIONS = int(os.environ.get("REFLEX_ML_MODEL_KEEP_VERSIONS", "5"))
+
+# Audit database (SQLite, WAL mode, single batched writer)
+AUDIT_DB_PATH = os.environ.get("REFLEX_AUDIT_DB_PATH", "reflex_audit.db")
+AUDIT_WRITE_BATCH = int(os.environ.get("REFLEX_AUDIT_WRITE_BATCH", "1000"))
+AUDIT_READ_POOL_SIZE = int(os.environ.get("REFLEX_AUDIT_READ_POOL_SIZE", "4"))
+
+# Cold event tier: events aged out of the in-memory ring buffers
+EVENT_SEGMENT_DIR = os.environ.get("REFLEX_EVENT_SEGMENT_DIR", "event_segments")
+EVENT_SEGMENT_EVENTS = int(os.environ.get("REFLEX_EVENT_SEGMENT_EVENTS", "10000"))
+EVENT_SEGMENT_RETRY_SECONDS = float(os.environ.get("REFLEX_EVENT_SEGMENT_RETRY_SECONDS", "5"))
+
+# Content-addressed forensic artifact store
+BLOB_STORE_DIR = os.environ.get("REFLEX_BLOB_STORE_DIR", "blob_store")
+
+# Retention of in-process stores (0 = no limit); evicted items spill to disk
+RETENTION_INTERVAL_SECONDS = float(os.environ.get("REFLEX_RETENTION_INTERVAL_SECONDS", "60"))
+RETENTION_SPILL_DIR = os.environ.get("REFLEX_RETENTION_SPILL_DIR", "retention_spill")
+RETENTION_SAMPLE_ITEMS = int(os.environ.get("REFLEX_RETENTION_SAMPLE_ITEMS", "32"))
+RETENTION_STORE_BYTES = int(os.environ.get("REFLEX_RETENTION_STORE_BYTES", str(64 * 1024 * 1024)))
+INCIDENT_RETENTION_ITEMS = int(os.environ.get("REFLEX_INCIDENT_RETENTION_ITEMS", "1000"))
+INCIDENT_RETENTION_SECONDS = float(os.environ.get("REFLEX_INCIDENT_RETENTION_SECONDS", str(7 * 86400)))
+LOG_RETENTION_ITEMS = int(os.environ.get("REFLEX_LOG_RETENTION_ITEMS", "10000"))
+LOG_RETENTION_SECONDS = float(os.environ.get("REFLEX_LOG_RETENTION_SECONDS", str(30 * 86400)))
+EVIDENCE_RETENTION_ITEMS = int(os.environ.get("REFLEX_EVIDENCE_RETENTION_ITEMS", "10000"))
+BASELINE_RETENTION_ITEMS = int(os.environ.get("REFLEX_BASELINE_RETENTION_ITEMS", "100000"))
+PLAYBOOK_RETENTION_ITEMS = int(os.environ.get("REFLEX_PLAYBOOK_RETENTION_ITEMS", "1000"))
+# Agent-reported incidents in the audit DB (0 = keep forever); purging releases their artifacts
+AUDIT_RETENTION_SECONDS = float(os.environ.get("REFLEX_AUDIT_RETENTION_SECONDS", "0"))
+BLOB_GC_MIN_AGE_SECONDS = float(os.environ.get("REFLEX_BLOB_GC_MIN_AGE_SECONDS", "3600"))
+
+# Inverted search index over events and incidents
+SEARCH_MAX_TOKENS_PER_FIELD = int(os.environ.get("REFLEX_SEARCH_MAX_TOKENS_PER_FIELD", "64"))
+SEARCH_MAX_TOKEN_LENGTH = int(os.environ.get("REFLEX_SEARCH_MAX_TOKEN_LENGTH", "256"))
+SEARCH_MAX_RESULTS = int(os.environ.get("REFLEX_SEARCH_MAX_RESULTS", "1000"))
+# Oldest docs beyond these budgets are compacted out on each retention pass (0 = no limit)
+SEARCH_MAX_DOCS = int(os.environ.get("REFLEX_SEARCH_MAX_DOCS", "2000000"))
+SEARCH_MAX_AGE_SECONDS = float(os.environ.get("REFLEX_SEARCH_MAX_AGE_SECONDS", str(30 * 86400)))
+# Posting lists trimmed per index-lock acquisition during compaction
+SEARCH_COMPACT_CHUNK_TERMS = int(os.environ.get("REFLEX_SEARCH_COMPACT_CHUNK_TERMS", "5000"))
@@ -1,9 +1,26 @@
+import atexit
+import json
+import queue
 import sqlite3
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from config import AUDIT_DB_PATH, AUDIT_WRITE_BATCH, AUDIT_READ_POOL_SIZE
 
-DB_PATH = "reflex_audit.db"
+DB_PATH = AUDIT_DB_PATH
+
+INSERT_INCIDENT = 'INSERT INTO incidents (pid, timestamp, action, command_line, user, details) VALUES (?, ?, ?, ?, ?, ?)'
+
+def connect(read_only=False):
+    conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
+    # WAL lets readers run alongside the writer; the mode is persistent in the file
+    conn.execute('PRAGMA journal_mode=WAL')
+    if read_only:
+        conn.execute('PRAGMA query_only=ON')
+    return conn
 
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect()
     c = conn.cursor()
     c.execute('''
         CREATE TABLE IF NOT EXISTS incidents (
@@ -16,24 +33,226 @@ def init_db():
             details TEXT
         )
     ''')
+    # Every filter index ends in (timestamp, id) so keyset pages stay index-ordered
+    c.execute('CREATE INDEX IF NOT EXISTS idx_incidents_time ON incidents (timestamp, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_incidents_action ON incidents (action, timestamp, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_incidents_user ON incidents (user, timestamp, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_incidents_pid ON incidents (pid, timestamp, id)')
     conn.commit()
     conn.close()
 
+def incident_row(record):
+    return (record["pid"], record["timestamp"], record["action"], record["command_line"],
+            record["user"], json.dumps(record.get("details") or {}, default=str))
+
+class IncidentWriter:
+    """Single long-lived connection that group-commits queued inserts"""
+
+    def __init__(self, batch_size=AUDIT_WRITE_BATCH):
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.stats = {"written": 0, "commits": 0, "errors": 0}
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+                self.thread.start()
+                atexit.register(self.close)
+
+    def submit(self, rows):
+        """Queue rows for insert; the Future resolves to their row ids once committed"""
+        self.start()
+        future = Future()
+        self.queue.put((rows, future))
+        return future
+
+    def close(self):
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout=10)
+
+    def _run(self):
+        conn = connect()
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            pending = [item]
+            count = len(item[0])
+            # Coalesce everything already queued into one transaction
+            while count < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.queue.put(None)
+                    break
+                pending.append(item)
+                count += len(item[0])
+            try:
+                self._commit(conn, pending)
+            except Exception as e:
+                if len(pending) == 1:
+                    self._fail(pending[0], e)
+                    continue
+                # The transaction rolled back; retry each submission alone so one bad row
+                # fails only the request that sent it
+                for item in pending:
+                    try:
+                        self._commit(conn, [item])
+                    except Exception as e:
+                        self._fail(item, e)
+        conn.close()
+
+    def _commit(self, conn, pending):
+        count = sum(len(rows) for rows, _ in pending)
+        with conn:
+            conn.executemany(INSERT_INCIDENT, [row for rows, _ in pending for row in rows])
+            last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+        self.stats["written"] += count
+        self.stats["commits"] += 1
+        # The single writer inserts each transaction's rows with consecutive ids
+        next_id = last_id - count + 1
+        for rows, future in pending:
+            future.set_result(range(next_id, next_id + len(rows)))
+            next_id += len(rows)
+
+    def _fail(self, item, e):
+        rows, future = item
+        self.stats["errors"] += 1
+        print(f"❌ Audit write failed ({len(rows)} incidents): {e}")
+        future.set_exception(e)
+
+class ReaderPool:
+    """Small pool of read-only connections; WAL readers never block the writer"""
+
+    def __init__(self, size=AUDIT_READ_POOL_SIZE):
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                grow = self.created < self.size
+                if grow:
+                    self.created += 1
+            conn = connect(read_only=True) if grow else self.idle.get()
+        try:
+            yield conn
+        finally:
+            self.idle.put(conn)
+
+WRITER = IncidentWriter()
+READERS = ReaderPool()
+
 def add_incident(record):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('INSERT INTO incidents (pid, timestamp, action, command_line, user, details) VALUES (?, ?, ?, ?, ?, ?)',
-        (record["pid"], record["timestamp"], record["action"], record["command_line"], record["user"], str(record["details"])))
-    conn.commit()
-    conn.close()
+    return WRITER.submit([incident_row(record)])
 
-def get_all_incidents():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('SELECT * FROM incidents')
-    rows = c.fetchall()
-    conn.close()
-    return rows
+def add_incidents(records):
+    return WRITER.submit([incident_row(r) for r in records])
 
-init_db()
+INCIDENT_COLUMNS = ("id", "pid", "timestamp", "action", "command_line", "user", "details")
+MAX_PAGE_SIZE = 1000
+
+def incident_dict(row):
+    incident = dict(zip(INCIDENT_COLUMNS, row))
+    try:
+        incident["details"] = json.loads(incident["details"])
+    except (TypeError, ValueError):
+        pass  # rows written before details were stored as JSON
+    return incident
+
+def encode_cursor(incident):
+    return f"{incident['timestamp']!r}:{incident['id']}"
 
+def decode_cursor(cursor):
+    try:
+        timestamp, row_id = cursor.rsplit(":", 1)
+        return float(timestamp), int(row_id)
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+def query_incidents(since=None, until=None, action=None, user=None, pid=None, command=None,
+                    cursor=None, limit=100, order="desc"):
+    """One keyset page of incidents ordered by (timestamp, id); returns (incidents, next_cursor)"""
+    if order not in ("asc", "desc"):
+        raise ValueError("order must be 'asc' or 'desc'")
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    clauses, params = [], []
+    for column, value in (("action", action), ("user", user), ("pid", pid)):
+        if value is not None:
+            clauses.append(f"{column} = ?")
+            params.append(value)
+    if since is not None:
+        clauses.append("timestamp >= ?")
+        params.append(since)
+    if until is not None:
+        clauses.append("timestamp < ?")
+        params.append(until)
+    if command:
+        clauses.append("instr(command_line, ?) > 0")
+        params.append(command)
+    if cursor:
+        clauses.append(f"(timestamp, id) {'<' if order == 'desc' else '>'} (?, ?)")
+        params.extend(decode_cursor(cursor))
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    direction = order.upper()
+    sql = (f"SELECT {', '.join(INCIDENT_COLUMNS)} FROM incidents {where} "
+           f"ORDER BY timestamp {direction}, id {direction} LIMIT ?")
+    with READERS.connection() as conn:
+        rows = conn.execute(sql, params + [limit + 1]).fetchall()
+    incidents = [incident_dict(row) for row in rows[:limit]]
+    next_cursor = encode_cursor(incidents[-1]) if len(rows) > limit else None
+    return incidents, next_cursor
+
+def get_incidents(ids):
+    """Incidents by row id, in no particular order"""
+    ids = list(ids)
+    incidents = []
+    with READERS.connection() as conn:
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            rows = conn.execute(f"SELECT {', '.join(INCIDENT_COLUMNS)} FROM incidents WHERE id IN ({marks})", chunk)
+            incidents.extend(incident_dict(row) for row in rows)
+    return incidents
+
+def purge_incidents(before, batch_size=AUDIT_WRITE_BATCH):
+    """Delete incidents older than `before`, oldest first; yields each deleted batch once committed"""
+    conn = connect()
+    try:
+        while True:
+            with conn:
+                rows = conn.execute(f"SELECT {', '.join(INCIDENT_COLUMNS)} FROM incidents "
+                                    "WHERE timestamp < ? ORDER BY timestamp, id LIMIT ?",
+                                    (before, batch_size)).fetchall()
+                conn.executemany('DELETE FROM incidents WHERE id = ?', [(row[0],) for row in rows])
+            if not rows:
+                return
+            yield [incident_dict(row) for row in rows]
+    finally:
+        conn.close()
+
+def max_incident_id():
+    with READERS.connection() as conn:
+        return conn.execute('SELECT COALESCE(MAX(id), 0) FROM incidents').fetchone()[0]
+
+def iter_incidents(page_size=500, **filters):
+    """Every matching incident, fetched page by page so memory stays bounded"""
+    cursor = filters.pop("cursor", None)
+    while True:
+        incidents, cursor = query_incidents(cursor=cursor, limit=page_size, **filters)
+        yield from incidents
+        if cursor is None:
+            return
+
+init_db()
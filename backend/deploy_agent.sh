@@ -1,4 +1,16 @@
 #!/bin/bash
+# Install the REFLEX agent on a host. The agent is reflex_agent.py plus the
+# modules it imports; all of them must be shipped together.
+#   AGENT_SOURCE=http://your-backend-host/agent ./deploy_agent.sh <pid> [agent options...]
+set -e
+AGENT_SOURCE=${AGENT_SOURCE:-http://your-backend-host/agent}
+AGENT_DIR=${AGENT_DIR:-/opt/reflex-agent}
+AGENT_FILES="reflex_agent.py rule_matcher.py proc_connector.py uploader.py"
+
 pip install requests
-wget http://your-backend-host/agent.py -O agent.py
-python agent.py --register --config agent_config.json
+mkdir -p "$AGENT_DIR"
+for f in $AGENT_FILES; do
+    wget -q "$AGENT_SOURCE/$f" -O "$AGENT_DIR/$f"
+done
+cd "$AGENT_DIR"
+python3 reflex_agent.py --monitor-pid "$@"
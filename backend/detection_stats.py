@@ -0,0 +1,111 @@
+import threading
+import time
+import numpy as np
+from typing import Dict, Optional
+
+HISTOGRAM_BUCKETS = 20  # fixed-width buckets over anomaly scores in [0, 1]
+
+# name -> (bucket width in seconds, number of buckets)
+ROLLING_WINDOWS = {
+    "1m": (1, 60),
+    "1h": (60, 60),
+    "24h": (3600, 24)
+}
+
+def _summary(count: int, anomalies: int, total: float, total_sq: float, histogram: np.ndarray) -> Dict:
+    if count == 0:
+        return {"total": 0, "anomalies": 0, "detection_rate": 0.0}
+    mean = total / count
+    variance = max(total_sq / count - mean * mean, 0.0)
+    return {
+        "total_events_analyzed": int(count),
+        "anomalies_detected": int(anomalies),
+        "detection_rate": round(anomalies / count * 100, 2),
+        "avg_anomaly_score": round(float(mean), 3),
+        "anomaly_score_stddev": round(float(np.sqrt(variance)), 3),
+        "score_histogram": histogram.tolist()
+    }
+
+class RollingWindow:
+    """Time-bucketed aggregates; old buckets are reset lazily as time moves on"""
+
+    def __init__(self, bucket_seconds: int, n_buckets: int):
+        self.bucket_seconds = bucket_seconds
+        self.n_buckets = n_buckets
+        self.epochs = np.full(n_buckets, -1, dtype=np.int64)
+        self.counts = np.zeros(n_buckets, dtype=np.int64)
+        self.anomalies = np.zeros(n_buckets, dtype=np.int64)
+        self.sums = np.zeros(n_buckets, dtype=np.float64)
+        self.sums_sq = np.zeros(n_buckets, dtype=np.float64)
+        self.histograms = np.zeros((n_buckets, HISTOGRAM_BUCKETS), dtype=np.int64)
+
+    def add(self, now: float, count: int, anomalies: int, total: float, total_sq: float, histogram: np.ndarray):
+        epoch = int(now) // self.bucket_seconds
+        slot = epoch % self.n_buckets
+        if self.epochs[slot] != epoch:
+            self.epochs[slot] = epoch
+            self.counts[slot] = 0
+            self.anomalies[slot] = 0
+            self.sums[slot] = 0.0
+            self.sums_sq[slot] = 0.0
+            self.histograms[slot] = 0
+        self.counts[slot] += count
+        self.anomalies[slot] += anomalies
+        self.sums[slot] += total
+        self.sums_sq[slot] += total_sq
+        self.histograms[slot] += histogram
+
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.epochs, self.counts, self.anomalies,
+                                      self.sums, self.sums_sq, self.histograms))
+
+    def summary(self, now: float) -> Dict:
+        epoch = int(now) // self.bucket_seconds
+        live = self.epochs > epoch - self.n_buckets
+        return _summary(self.counts[live].sum(), self.anomalies[live].sum(),
+                        self.sums[live].sum(), self.sums_sq[live].sum(),
+                        self.histograms[live].sum(axis=0))
+
+class DetectionStats:
+    """Constant-memory streaming detection statistics (all-time plus rolling windows)"""
+
+    def __init__(self):
+        self.count = 0
+        self.anomalies = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.histogram = np.zeros(HISTOGRAM_BUCKETS, dtype=np.int64)
+        self.windows = {name: RollingWindow(*spec) for name, spec in ROLLING_WINDOWS.items()}
+        self.lock = threading.Lock()
+
+    def record(self, scores: np.ndarray, is_anomaly: np.ndarray, now: Optional[float] = None):
+        """Fold a batch of anomaly scores and verdicts into every aggregate"""
+        if len(scores) == 0:
+            return
+        now = now if now is not None else time.time()
+        count = len(scores)
+        anomalies = int(np.count_nonzero(is_anomaly))
+        total = float(scores.sum())
+        total_sq = float(np.dot(scores, scores))
+        buckets = np.clip((scores * HISTOGRAM_BUCKETS).astype(np.int64), 0, HISTOGRAM_BUCKETS - 1)
+        histogram = np.bincount(buckets, minlength=HISTOGRAM_BUCKETS)
+        with self.lock:
+            self.count += count
+            self.anomalies += anomalies
+            self.total += total
+            self.total_sq += total_sq
+            self.histogram += histogram
+            for window in self.windows.values():
+                window.add(now, count, anomalies, total, total_sq, histogram)
+
+    def nbytes(self) -> int:
+        """Memory held by the aggregates; fixed for the lifetime of the object"""
+        return self.histogram.nbytes + sum(w.nbytes() for w in self.windows.values())
+
+    def snapshot(self, now: Optional[float] = None) -> Dict:
+        now = now if now is not None else time.time()
+        with self.lock:
+            stats = _summary(self.count, self.anomalies, self.total, self.total_sq, self.histogram)
+            if self.count:
+                stats["windows"] = {name: w.summary(now) for name, w in self.windows.items()}
+        return stats
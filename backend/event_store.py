@@ -0,0 +1,317 @@
+import json
+import threading
+import time
+import numpy as np
+from typing import List, Dict, Optional
+from saas import ORGANIZATIONS
+from config import EVENT_SEGMENT_EVENTS, EVENT_SEGMENT_RETRY_SECONDS, RETENTION_SAMPLE_ITEMS
+from segment_store import SEGMENTS
+from retention import RETENTION, approx_size
+from search_index import SEARCH
+
+# Per-tier event history capacity (events kept in memory per org)
+EVENT_CAPACITY_BY_TIER = {
+    "starter": 5000,
+    "pro": 50000,
+    "enterprise": 250000
+}
+DEFAULT_EVENT_CAPACITY = 5000
+
+# Event types are shared across orgs, so intern them once
+EVENT_TYPE_CODES = {}
+EVENT_TYPE_NAMES = []
+_type_lock = threading.Lock()
+
+def event_type_code(event_type: str) -> int:
+    code = EVENT_TYPE_CODES.get(event_type)
+    if code is None:
+        with _type_lock:
+            code = EVENT_TYPE_CODES.get(event_type)
+            if code is None:
+                code = len(EVENT_TYPE_NAMES)
+                EVENT_TYPE_NAMES.append(event_type)
+                EVENT_TYPE_CODES[event_type] = code
+    return code
+
+class EventRingBuffer:
+    """Fixed-capacity, columnar event history for one org (the hot tier).
+
+    With a segment store attached, events are spilled to it in chunks before
+    they would be overwritten. Events carry a per-org sequence number so the
+    two tiers can be merged without duplicates.
+    """
+
+    def __init__(self, org_id: str, capacity: int, store=None, first_seq: int = 0):
+        self.org_id = org_id
+        self.capacity = capacity
+        self.head = 0  # next write slot
+        self.size = 0
+        self.store = store
+        self.first_seq = first_seq  # events below this were stored before this buffer existed
+        self.next_seq = first_seq  # seq of the next appended event
+        self.spilled_seq = first_seq  # events below this seq are in the store
+        self.agent_ids = []  # interned agent id strings
+        self.agent_codes = {}
+        self.lock = threading.Lock()
+        self.spill_lock = threading.Lock()  # one segment write at a time
+        self.retry_at = 0.0  # after a failed write, appends don't retry before this
+        self.spill_stats = {"spill_errors": 0, "lost": 0}
+        self._allocate(capacity)
+
+    def _allocate(self, capacity: int):
+        self.timestamps = np.zeros(capacity, dtype=np.int64)
+        self.type_codes = np.zeros(capacity, dtype=np.int16)
+        self.agent_col = np.zeros(capacity, dtype=np.int32)
+        self.scores = np.zeros(capacity, dtype=np.uint8)
+        self.anomaly_scores = np.full(capacity, np.nan, dtype=np.float32)
+        self.details = np.empty(capacity, dtype=object)  # compact JSON strings
+
+    def _columns(self):
+        return [self.timestamps, self.type_codes, self.agent_col,
+                self.scores, self.anomaly_scores, self.details]
+
+    def _agent_code(self, agent_id: str) -> int:
+        code = self.agent_codes.get(agent_id)
+        if code is None:
+            code = len(self.agent_ids)
+            self.agent_ids.append(agent_id)
+            self.agent_codes[agent_id] = code
+        return code
+
+    def _ordered_slots(self) -> np.ndarray:
+        """Slot indices from oldest to newest"""
+        return np.arange(self.head - self.size, self.head) % self.capacity
+
+    @property
+    def oldest_seq(self) -> int:
+        return self.next_seq - self.size
+
+    def _account_lost(self):
+        """Count unspilled events that are no longer resident; call with self.lock held"""
+        gone = self.oldest_seq - self.spilled_seq
+        if gone > 0:
+            self.spill_stats["lost"] += gone
+            self.spilled_seq = self.oldest_seq
+
+    def _spill(self, count: int, block: bool = True) -> bool:
+        """Write the oldest `count` not-yet-spilled events to the segment store.
+
+        spilled_seq only advances once the segment is on disk; after a failure
+        the events stay unspilled and resident, so a later spill retries them.
+        """
+        if not self.spill_lock.acquire(blocking=block):
+            return False  # another thread is already writing the oldest events
+        try:
+            with self.lock:
+                start = self.spilled_seq - self.oldest_seq
+                count = min(count, self.size - start)
+                if count <= 0:
+                    return True
+                slots = self._ordered_slots()[start:start + count]
+                first_seq = self.spilled_seq
+                columns = {
+                    "timestamps": self.timestamps[slots],
+                    "event_types": np.array(EVENT_TYPE_NAMES, dtype=object)[self.type_codes[slots]],
+                    "agent_ids": np.array(self.agent_ids, dtype=object)[self.agent_col[slots]],
+                    "scores": self.scores[slots],
+                    "anomaly_scores": self.anomaly_scores[slots],
+                    "details": self.details[slots]
+                }
+            # Compress outside the lock; the events stay readable from memory meanwhile
+            try:
+                self.store.write(self.org_id, first_seq, columns)
+                written = True
+            except Exception as e:
+                written = False
+                self.spill_stats["spill_errors"] += 1
+                self.retry_at = time.time() + EVENT_SEGMENT_RETRY_SECONDS
+                print(f"❌ Event segment write failed for {self.org_id}: {e}")
+            with self.lock:
+                if written:
+                    self.spilled_seq = first_seq + count
+                # Appends during the write may have overwritten events it did not cover
+                self._account_lost()
+            return written
+        finally:
+            self.spill_lock.release()
+
+    def flush(self):
+        """Spill every resident event that is not yet in the store"""
+        if self.store is not None:
+            self._spill(self.next_seq - self.spilled_seq)
+
+    def append(self, event: Dict) -> int:
+        """O(1) append; overwrites the oldest event once full. Returns the event's seq"""
+        if (self.store is not None and self.size == self.capacity and self.spilled_seq <= self.oldest_seq
+                and time.time() >= self.retry_at):
+            self._spill(min(EVENT_SEGMENT_EVENTS, self.capacity), block=False)
+        with self.lock:
+            if (self.store is not None and self.size == self.capacity and self.spilled_seq <= self.oldest_seq
+                    and not self.spill_lock.locked()):
+                # The store is failing: the oldest event is overwritten without reaching it
+                self.spill_stats["lost"] += 1
+                self.spilled_seq = self.oldest_seq + 1
+            i = self.head
+            self.timestamps[i] = event["timestamp"]
+            self.type_codes[i] = event_type_code(event["event_type"])
+            self.agent_col[i] = self._agent_code(event["agent_id"])
+            self.scores[i] = event.get("threat_score", 0)
+            self.anomaly_scores[i] = event["anomaly_score"] if event.get("ml_detected") else np.nan
+            self.details[i] = json.dumps(event.get("details", {}), separators=(",", ":"))
+            self.head = (i + 1) % self.capacity
+            self.size = min(self.size + 1, self.capacity)
+            self.next_seq += 1
+            return self.next_seq - 1
+
+    def resize(self, capacity: int):
+        """Change capacity, keeping the newest events that still fit"""
+        if capacity == self.capacity:
+            return
+        if self.store is not None and self.size > capacity:
+            # Events that no longer fit must reach the cold tier first
+            self._spill(self.oldest_seq + self.size - capacity - self.spilled_seq)
+        with self.lock:
+            slots = self._ordered_slots()[-capacity:]
+            kept = [col[slots] for col in self._columns()]
+            self._allocate(capacity)
+            n = len(slots)
+            for col, values in zip(self._columns(), kept):
+                col[:n] = values
+            self.capacity = capacity
+            self.size = n
+            self.head = n % capacity
+            if self.store is not None and not self.spill_lock.locked():
+                self._account_lost()
+
+    def _to_dict(self, i: int) -> Dict:
+        event = {
+            "agent_id": self.agent_ids[self.agent_col[i]],
+            "event_type": EVENT_TYPE_NAMES[self.type_codes[i]],
+            "timestamp": int(self.timestamps[i]),
+            "details": json.loads(self.details[i]),
+            "org_id": self.org_id,
+            "threat_score": int(self.scores[i])
+        }
+        if not np.isnan(self.anomaly_scores[i]):
+            event["ml_detected"] = True
+            event["anomaly_score"] = float(self.anomaly_scores[i])
+        return event
+
+    def query(self, limit: int = 25, since: Optional[int] = None,
+              until: Optional[int] = None, agent_id: Optional[str] = None,
+              include_cold: bool = False) -> List[Dict]:
+        """Newest `limit` events matching the filters, oldest first"""
+        with self.lock:
+            floor = self.oldest_seq
+            slots = self._ordered_slots()
+            code = self.agent_codes.get(agent_id) if agent_id is not None else None
+            if agent_id is not None and code is None:
+                slots = slots[:0]
+            elif code is not None:
+                slots = slots[self.agent_col[slots] == code]
+            if since is not None:
+                slots = slots[self.timestamps[slots] >= since]
+            if until is not None:
+                slots = slots[self.timestamps[slots] <= until]
+            if limit is not None:
+                slots = slots[-limit:] if limit > 0 else slots[:0]
+            events = [self._to_dict(i) for i in slots]
+        if include_cold and self.store is not None and (limit is None or len(events) < limit):
+            remaining = None if limit is None else limit - len(events)
+            events = self.store.query(self.org_id, remaining, since, until, agent_id, before_seq=floor) + events
+        return events
+
+    def get(self, seqs: List[int]) -> Dict[int, Dict]:
+        """Resident events by sequence number; others are left to the caller"""
+        with self.lock:
+            found = {}
+            for seq in seqs:
+                if self.oldest_seq <= seq < self.next_seq:
+                    found[seq] = self._to_dict((self.head - (self.next_seq - seq)) % self.capacity)
+            return found
+
+    def latest(self, n: int) -> List[Dict]:
+        return self.query(limit=n)
+
+    def __len__(self):
+        return self.size
+
+    def nbytes(self) -> int:
+        """Column arrays plus the detail strings held, estimated from a sample"""
+        with self.lock:
+            slots = self._ordered_slots()
+            step = max(1, len(slots) // RETENTION_SAMPLE_ITEMS)
+            sample = list(self.details[slots[::step][:RETENTION_SAMPLE_ITEMS]])
+        fixed = sum(c.nbytes for c in self._columns())
+        if not sample:
+            return fixed
+        return fixed + int(sum(approx_size(d) for d in sample) / len(sample) * len(slots))
+
+# org_id -> EventRingBuffer
+EVENTS_BY_ORG = {}
+
+def capacity_for_org(org_id: str) -> int:
+    tier = ORGANIZATIONS.get(org_id, {}).get("subscription_tier")
+    return EVENT_CAPACITY_BY_TIER.get(tier, DEFAULT_EVENT_CAPACITY)
+
+def get_org_events(org_id: str) -> EventRingBuffer:
+    """Get (or create) the org's buffer, resizing it if the tier changed"""
+    capacity = capacity_for_org(org_id)
+    buf = EVENTS_BY_ORG.get(org_id)
+    if buf is None:
+        buf = EVENTS_BY_ORG.setdefault(
+            org_id, EventRingBuffer(org_id, capacity, store=SEGMENTS, first_seq=SEGMENTS.next_seq(org_id))
+        )
+    if buf.capacity != capacity:
+        buf.resize(capacity)
+    return buf
+
+def query_events(org_id: str, limit: int = 25, since: Optional[int] = None,
+                 until: Optional[int] = None, agent_id: Optional[str] = None) -> List[Dict]:
+    """Query an org's events across the in-memory and on-disk tiers"""
+    buf = EVENTS_BY_ORG.get(org_id)
+    if buf is None:
+        return SEGMENTS.query(org_id, limit, since, until, agent_id)
+    return buf.query(limit=limit, since=since, until=until, agent_id=agent_id, include_cold=True)
+
+def get_events(refs: List) -> Dict:
+    """Search resolver: (org_id, seq) pairs from memory, else from the segment store"""
+    by_org = {}
+    for org_id, seq in refs:
+        by_org.setdefault(org_id, []).append(seq)
+    found = {}
+    for org_id, seqs in by_org.items():
+        buf = EVENTS_BY_ORG.get(org_id)
+        events = buf.get(seqs) if buf is not None else {}
+        cold = [s for s in seqs if s not in events]
+        if cold:
+            events.update(SEGMENTS.get(org_id, cold))
+        found.update(((org_id, seq), event) for seq, event in events.items())
+    return found
+
+SEARCH.register_resolver("event", get_events)
+
+def cold_event_docs():
+    """Search backfill source: events already on disk before this process started"""
+    # Live indexing covers everything from each buffer's first_seq on
+    boundaries = {}
+    for org_id in SEGMENTS.orgs():
+        buf = EVENTS_BY_ORG.get(org_id)
+        boundaries[org_id] = buf.first_seq if buf is not None else SEGMENTS.next_seq(org_id)
+    return (("event", (org_id, seq, event))
+            for org_id, boundary in boundaries.items()
+            for seq, event in SEGMENTS.scan(org_id, before_seq=boundary))
+
+def buffers_memory_usage() -> Dict:
+    buffers = list(EVENTS_BY_ORG.values())
+    return {"items": sum(len(b) for b in buffers), "bytes": sum(b.nbytes() for b in buffers),
+            "max_items": sum(b.capacity for b in buffers),
+            "spill_errors": sum(b.spill_stats["spill_errors"] for b in buffers),
+            "lost": sum(b.spill_stats["lost"] for b in buffers)}
+
+RETENTION.register_gauge("event_buffers", buffers_memory_usage)
+
+def flush_all():
+    """Spill all in-memory events, e.g. on shutdown, so they survive a restart"""
+    for buf in list(EVENTS_BY_ORG.values()):
+        buf.flush()
@@ -1,37 +1,283 @@
-from fastapi import APIRouter, Response
-from models import Evidence
+from fastapi import APIRouter, Body, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from typing import Dict, List, Optional
+from pydantic import ValidationError
+from models import Evidence, IncidentLog
+from batch_io import read_json_records
+import db
+from blob_store import BLOBS, incident_digests, is_digest
+from config import (AUDIT_RETENTION_SECONDS, BLOB_GC_MIN_AGE_SECONDS, EVIDENCE_RETENTION_ITEMS,
+                    LOG_RETENTION_SECONDS, RETENTION_STORE_BYTES)
+from retention import RETENTION
+from search_index import SEARCH
+import asyncio
+import json
 import time
 import csv
 import io
+import itertools
+import threading
+import zlib
 
 router = APIRouter(prefix="/forensics")
 EVIDENCES = []
+EVIDENCE_OFFSET = 0  # absolute position of EVIDENCES[0]
+EVIDENCE_LOCK = threading.Lock()  # guards EVIDENCES together with EVIDENCE_OFFSET
+
+def evidence_evicted(evicted):
+    # Runs under EVIDENCE_LOCK with the delete, so export cursors (absolute positions) stay valid
+    global EVIDENCE_OFFSET
+    EVIDENCE_OFFSET += len(evicted)
+
+RETENTION.register("evidence", lambda: EVIDENCES, max_items=EVIDENCE_RETENTION_ITEMS,
+                   max_bytes=RETENTION_STORE_BYTES, max_age=LOG_RETENTION_SECONDS,
+                   timestamp=lambda ev: ev.created, on_evict=evidence_evicted, lock=EVIDENCE_LOCK)
 
 @router.post("/")
 def add_evidence(ev: Evidence):
-    EVIDENCES.append(ev)
-    return {"msg": "Evidence added", "count": len(EVIDENCES)}
+    with EVIDENCE_LOCK:
+        EVIDENCES.append(ev)
+        count = len(EVIDENCES)
+    return {"msg": "Evidence added", "count": count}
 
 @router.get("/")
 def get_all_evidence():
     return EVIDENCES
 
-@router.get("/export")
-def export_evidence(format: str = "csv"):
+@router.post("/incident")
+def add_incident(incident: IncidentLog):
+    record = incident.dict()
+    try:
+        digests = incident_digests(record, strict=True)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid incident: {e}")
+    try:
+        row_ids = db.add_incident(record).result()
+    except (OverflowError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid incident: {e}")
+    # Referenced only once committed, so a failed write cannot leak refcounts
+    BLOBS.add_refs(digests)
+    SEARCH.add_audit(row_ids[0], record)
+    return {"msg": "Incident logged"}
+
+@router.post("/incidents/batch")
+async def add_incident_batch(request: Request):
+    """Bulk incident upload from agents (JSON array or NDJSON, optionally gzip'd)"""
+    try:
+        incidents = [IncidentLog(**item) for item in await read_json_records(request)]
+    except (ValueError, ValidationError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid incident batch: {e}")
+    records = [i.dict() for i in incidents]
+    try:
+        digests = [d for r in records for d in incident_digests(r, strict=True)]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid incident batch: {e}")
+    # Acknowledge only once the batch is committed, so agents can drop their copy
+    try:
+        row_ids = await asyncio.wrap_future(db.add_incidents(records))
+    except (OverflowError, ValueError) as e:
+        # A row SQLite cannot store will never succeed; 4xx so agents set it aside
+        raise HTTPException(status_code=400, detail=f"Invalid incident batch: {e}")
+    # SQLite and index updates block; keep them off the event loop
+    await run_in_threadpool(index_incidents, row_ids, records, digests)
+    return {"msg": "Incidents logged", "count": len(incidents)}
+
+def index_incidents(row_ids, records, digests):
+    BLOBS.add_refs(digests)
+    for row_id, record in zip(row_ids, records):
+        SEARCH.add_audit(row_id, record)
+
+@router.post("/blobs/missing")
+def missing_blobs(body: Dict[str, List[str]] = Body(...)):
+    """Which artifact digests the server does not have yet (agents upload only those)"""
+    return {"missing": BLOBS.missing(body.get("digests", []))}
+
+@router.post("/blobs/batch")
+async def upload_blobs(request: Request):
+    """Store artifacts sent as {"digest", "content"} records; duplicates are skipped"""
+    try:
+        records = await read_json_records(request)
+        blobs = [(r["digest"], r["content"].encode()) for r in records]
+    except (ValueError, KeyError, AttributeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid blob batch: {e}")
+    try:
+        # zlib, file and SQLite work per blob; run it in the threadpool, not on the event loop
+        stored = await run_in_threadpool(store_blobs, blobs)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"msg": "Blobs stored", "stored": stored, "duplicates": len(blobs) - stored}
+
+def store_blobs(blobs):
+    return sum(BLOBS.put(content, digest) for digest, content in blobs)
+
+@router.get("/blobs/stats")
+def blob_stats():
+    return BLOBS.stats()
+
+@router.post("/blobs/gc")
+def collect_blobs(min_age: float = BLOB_GC_MIN_AGE_SECONDS):
+    """Delete artifacts no incident references any more"""
+    return {"msg": "Blob GC complete", "removed": BLOBS.gc(min_age)}
+
+@router.get("/blobs/{digest}")
+def get_blob(digest: str):
+    if not is_digest(digest):
+        raise HTTPException(status_code=400, detail="Artifact digests are 64 lowercase hex characters")
+    content = BLOBS.get(digest)
+    if content is None:
+        raise HTTPException(status_code=404, detail="Unknown artifact")
+    return Response(content=content, media_type="text/plain; charset=utf-8")
+
+def get_audit_incidents(refs):
+    """Search resolver for agent-reported incidents in the audit DB"""
+    return {(None, incident["id"]): incident for incident in db.get_incidents(ref for _, ref in refs)}
+
+SEARCH.register_resolver("audit", get_audit_incidents)
+
+def purge_audit(now):
+    """Delete audit incidents past AUDIT_RETENTION_SECONDS and release the artifacts they reference"""
+    if not AUDIT_RETENTION_SECONDS:
+        return 0
+    purged = 0
+    for incidents in db.purge_incidents(now - AUDIT_RETENTION_SECONDS):
+        BLOBS.release(d for incident in incidents for d in incident_digests(incident))
+        purged += len(incidents)
+    return purged
+
+RETENTION.register_sweep("audit_incidents", purge_audit)
+# Runs after the purge, so artifacts it released are freed in the same pass
+RETENTION.register_sweep("blobs", lambda now: BLOBS.gc(BLOB_GC_MIN_AGE_SECONDS))
+
+def audit_incident_docs():
+    """Search backfill source: audit incidents stored before this process started"""
+    boundary = db.max_incident_id()
+    return (("audit", (incident["id"], incident))
+            for incident in db.iter_incidents(order="asc")
+            if incident["id"] <= boundary)
+
+def incident_filters(since, until, action, user, pid, command, order):
+    return {"since": since, "until": until, "action": action, "user": user,
+            "pid": pid, "command": command, "order": order}
+
+@router.get("/incidents")
+def query_incidents(since: Optional[float] = None, until: Optional[float] = None,
+                    action: Optional[str] = None, user: Optional[str] = None,
+                    pid: Optional[int] = None, command: Optional[str] = None,
+                    cursor: Optional[str] = None, limit: int = 100, order: str = "desc"):
+    """One page of audit incidents; pass next_cursor back to continue"""
+    try:
+        incidents, next_cursor = db.query_incidents(
+            cursor=cursor, limit=limit,
+            **incident_filters(since, until, action, user, pid, command, order)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"incidents": incidents, "count": len(incidents), "next_cursor": next_cursor}
+
+@router.get("/incidents/stream")
+def stream_incidents(since: Optional[float] = None, until: Optional[float] = None,
+                     action: Optional[str] = None, user: Optional[str] = None,
+                     pid: Optional[int] = None, command: Optional[str] = None,
+                     order: str = "desc"):
+    """Every matching incident as NDJSON, read page by page"""
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be 'asc' or 'desc'")
+    filters = incident_filters(since, until, action, user, pid, command, order)
+    lines = (json.dumps(incident) + "\n" for incident in db.iter_incidents(**filters))
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson", "json": "application/json"}
+EXPORT_CHUNK_BYTES = 64 * 1024
+EVIDENCE_FIELDS = list(Evidence.__fields__)
+
+def iter_evidence(cursor=0, type=None, created_since=None, created_until=None):
+    """(resume cursor, evidence) pairs from an absolute position in EVIDENCES.
+
+    Positions count from the first evidence ever stored (EVIDENCE_OFFSET of
+    them may since have been dropped), so cursors stay valid as the list changes.
+    """
+    position = cursor
+    while True:
+        with EVIDENCE_LOCK:
+            # Entries before the offset were dropped, possibly since the last row
+            position = max(position, EVIDENCE_OFFSET)
+            index = position - EVIDENCE_OFFSET
+            if index >= len(EVIDENCES):
+                return
+            ev = EVIDENCES[index]
+        position += 1
+        if type is not None and ev.type != type:
+            continue
+        if created_since is not None and ev.created < created_since:
+            continue
+        if created_until is not None and ev.created > created_until:
+            continue
+        yield position, ev
+
+def render_export(rows, format):
+    """Yield the export body as text pieces; every row carries its resume cursor"""
     if format == "csv":
-        output = io.StringIO()
-        # If there is no evidence, just return the header for CSV
-        if not EVIDENCES:
-            # Use the Evidence model fields for the header
-            # Update these if your Evidence model changes
-            output.write("id,type,created,summary,file_path\n")
-            return Response(content=output.getvalue(), media_type="text/csv")
-        writer = csv.DictWriter(output, fieldnames=EVIDENCES[0].dict().keys())
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=EVIDENCE_FIELDS + ["cursor"])
         writer.writeheader()
-        for ev in EVIDENCES:
-            writer.writerow(ev.dict())
-        return Response(content=output.getvalue(), media_type="text/csv")
-    return EVIDENCES  # Default JSON
+        for position, ev in rows:
+            writer.writerow({**ev.dict(), "cursor": position})
+            if buf.tell() >= EXPORT_CHUNK_BYTES:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+        return
+    if format == "json":
+        yield "["
+    separator = "\n" if format == "ndjson" else ","
+    first = True
+    for position, ev in rows:
+        yield ("" if first else separator) + json.dumps({**ev.dict(), "cursor": position})
+        first = False
+    yield "]" if format == "json" else ("" if first else "\n")
+
+def chunked(pieces):
+    """Coalesce small text pieces into ~EXPORT_CHUNK_BYTES encoded chunks"""
+    pending, size = [], 0
+    for piece in pieces:
+        pending.append(piece)
+        size += len(piece)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield "".join(pending).encode()
+            pending, size = [], 0
+    if pending:
+        yield "".join(pending).encode()
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+@router.get("/export")
+def export_evidence(format: str = "csv", gzip: bool = False, type: Optional[str] = None,
+                    created_since: Optional[float] = None, created_until: Optional[float] = None,
+                    cursor: int = 0, limit: Optional[int] = None):
+    """Stream evidence as CSV, NDJSON or JSON (optionally gzip'd); resume with a row's cursor"""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {sorted(EXPORT_FORMATS)}")
+    rows = iter_evidence(cursor, type, created_since, created_until)
+    if limit is not None:
+        rows = itertools.islice(rows, max(limit, 0))
+    body = chunked(render_export(rows, format))
+    filename = f"evidence.{format}"
+    media_type = EXPORT_FORMATS[format]
+    if gzip:
+        body = gzipped(body)
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(body, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
 # Add this after EVIDENCES = []
 EVIDENCES.append(Evidence(
     id="1",
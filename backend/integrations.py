@@ -2,6 +2,8 @@ from fastapi import APIRouter
 from pydantic import BaseModel
 import time
 import json
+from config import LOG_RETENTION_ITEMS, LOG_RETENTION_SECONDS, RETENTION_STORE_BYTES
+from retention import RETENTION
 
 router = APIRouter(prefix="/integrations")
 
@@ -11,6 +13,9 @@ OKTA_CONFIG = {"api_key": "demo_okta_key", "org_url": "https://demo.okta.com"}
 EDR_CONFIG = {"api_key": "demo_edr_key", "endpoint": "https://demo-edr.api.com"}
 
 INTEGRATION_LOGS = []
+RETENTION.register("integration_logs", lambda: INTEGRATION_LOGS, max_items=LOG_RETENTION_ITEMS,
+                   max_bytes=RETENTION_STORE_BYTES, max_age=LOG_RETENTION_SECONDS,
+                   timestamp=lambda log: log["timestamp"])
 
 class AWSAction(BaseModel):
     action: str  # "isolate_sg", "revoke_credentials"
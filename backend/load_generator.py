@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# Asyncio load generator: simulates a fleet of agent_client agents in one process
+# (registration, heartbeats, batched or single events, attack bursts) and reports
+# per-endpoint latency histograms, throughput and error rates. Talks only to --backend-url.
+import argparse
+import asyncio
+import bisect
+import json
+import random
+import time
+import httpx
+from agent_client import registration_info, generate_event
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+class EndpointStats:
+    """Request count, error breakdown and latency histogram for one endpoint"""
+
+    def __init__(self):
+        self.requests = 0
+        self.events = 0
+        self.errors = {}
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, latency_ms, events, error=None):
+        self.requests += 1
+        self.histogram[bisect.bisect_left(LATENCY_BUCKETS_MS, latency_ms)] += 1
+        self.total_ms += latency_ms
+        self.max_ms = max(self.max_ms, latency_ms)
+        if error is None:
+            self.events += events
+        else:
+            self.errors[error] = self.errors.get(error, 0) + 1
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile"""
+        target = p / 100 * self.requests
+        seen = 0
+        for i, count in enumerate(self.histogram):
+            seen += count
+            if count and seen >= target:
+                return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else self.max_ms
+        return 0.0
+
+    def summary(self, elapsed):
+        errors = sum(self.errors.values())
+        return {
+            "requests": self.requests,
+            "requests_per_sec": round(self.requests / elapsed, 1) if elapsed else 0.0,
+            "events_per_sec": round(self.events / elapsed, 1) if elapsed else 0.0,
+            "error_rate": round(errors / self.requests, 4) if self.requests else 0.0,
+            "errors": dict(self.errors),
+            "mean_ms": round(self.total_ms / self.requests, 2) if self.requests else 0.0,
+            "p50_ms": self.percentile(50),
+            "p90_ms": self.percentile(90),
+            "p99_ms": self.percentile(99),
+            "max_ms": round(self.max_ms, 2),
+            "histogram": dict(zip([f"<={b}ms" for b in LATENCY_BUCKETS_MS] + ["inf"], self.histogram))
+        }
+
+class LoadGenerator:
+    def __init__(self, args):
+        self.args = args
+        self.stats = {}
+        self.rng = random.Random(args.seed)
+        self.orgs, self.org_weights = parse_orgs(args.orgs)
+        self.start = None
+        self.slots = None
+
+    def endpoint(self, path):
+        return self.stats.setdefault(path, EndpointStats())
+
+    async def post(self, client, path, body, events=0):
+        # Wait for a connection slot here rather than in httpx's pool, whose
+        # queue handling degrades with thousands of waiters; latency excludes the wait
+        async with self.slots:
+            began = time.perf_counter()
+            error = None
+            try:
+                res = await client.post(path, json=body)
+                if res.status_code >= 300:
+                    error = str(res.status_code)
+            except httpx.HTTPError as e:
+                error = e.__class__.__name__
+            self.endpoint(path).record((time.perf_counter() - began) * 1000, events, error)
+        return error is None
+
+    def in_burst(self, index, now):
+        """Burst agents are every Nth agent, attacking for --burst-duration every --burst-every"""
+        args = self.args
+        if not args.burst_every or not args.burst_agents:
+            return False
+        if index % max(1, round(1 / args.burst_agents)) != 0:
+            return False
+        elapsed = now - self.start - args.burst_start
+        return elapsed >= 0 and elapsed % args.burst_every < args.burst_duration
+
+    async def run_agent(self, client, index, org_id, stop_at):
+        args = self.args
+        agent_id = f"sim-{index:05d}"
+        rng = random.Random(args.seed * 100003 + index)
+        pending = []
+        now = time.time()
+        next_event = now + rng.expovariate(args.rate)
+        next_heartbeat = now + rng.uniform(0, args.heartbeat_interval)
+        flush_at = now + args.batch_max_age
+        while True:
+            now = time.time()
+            if now >= stop_at:
+                break
+            await asyncio.sleep(max(0.0, min(next_event, next_heartbeat, flush_at, stop_at) - now))
+            now = time.time()
+            if now >= next_event:
+                attacking = self.in_burst(index, now)
+                evt = generate_event(agent_id, org_id, attack=attacking)
+                rate = args.rate * (args.burst_multiplier if attacking else 1)
+                next_event = now + rng.expovariate(rate)
+                if args.batch_size <= 1:
+                    await self.post(client, "/agent/event", evt, events=1)
+                else:
+                    pending.append(evt)
+            if pending and (len(pending) >= args.batch_size or now >= flush_at):
+                await self.post(client, "/agent/events/batch", pending, events=len(pending))
+                pending = []
+            if now >= flush_at:
+                flush_at = now + args.batch_max_age
+            if now >= next_heartbeat:
+                await self.post(client, "/agent/heartbeat", {"agent_id": agent_id, "org_id": org_id})
+                next_heartbeat = now + args.heartbeat_interval
+        if pending:
+            await self.post(client, "/agent/events/batch", pending, events=len(pending))
+
+    async def report_progress(self, stop_at):
+        last = {}
+        while time.time() < stop_at:
+            await asyncio.sleep(self.args.report_interval)
+            line = []
+            for path, s in sorted(self.stats.items()):
+                done = s.requests - last.get(path, 0)
+                last[path] = s.requests
+                line.append(f"{path} {done / self.args.report_interval:.0f}/s err={sum(s.errors.values())}")
+            print(f"[{time.time() - self.start:6.1f}s] " + " | ".join(line))
+
+    async def run(self):
+        args = self.args
+        limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+        self.slots = asyncio.Semaphore(args.connections)
+        async with httpx.AsyncClient(base_url=args.backend_url, limits=limits, timeout=args.timeout) as client:
+            orgs = self.rng.choices(self.orgs, weights=self.org_weights, k=args.agents)
+            # Register the whole fleet first so the timed phase is steady-state traffic
+            began = time.time()
+            await asyncio.gather(*(
+                self.post(client, "/agent/register", registration_info(f"sim-{i:05d}", org, hostname=f"sim-{i:05d}"))
+                for i, org in enumerate(orgs)
+            ))
+            registration_seconds = time.time() - began
+            self.start = time.time()
+            stop_at = self.start + args.duration
+            tasks = [self.run_agent(client, i, org, stop_at) for i, org in enumerate(orgs)]
+            if args.report_interval:
+                tasks.append(self.report_progress(stop_at))
+            await asyncio.gather(*tasks)
+        elapsed = time.time() - self.start
+        return {
+            "config": {k: v for k, v in vars(args).items() if k != "json"},
+            "registration_seconds": round(registration_seconds, 2),
+            "elapsed": round(elapsed, 2),
+            "agents_by_org": {org: orgs.count(org) for org in self.orgs},
+            "endpoints": {
+                path: s.summary(registration_seconds if path == "/agent/register" else elapsed)
+                for path, s in sorted(self.stats.items())
+            }
+        }
+
+def parse_orgs(spec):
+    """'acme=3,globex=1' -> (['acme', 'globex'], [3.0, 1.0]); weights default to 1"""
+    names, weights = [], []
+    for part in spec.split(","):
+        name, _, weight = part.strip().partition("=")
+        names.append(name)
+        weights.append(float(weight) if weight else 1.0)
+    return names, weights
+
+def print_report(result):
+    print(f"\n{result['config']['agents']} agents (registered in {result['registration_seconds']}s) "
+          f"for {result['elapsed']}s, orgs {result['agents_by_org']}")
+    for path, s in result["endpoints"].items():
+        print(f"  {path:22} {s['requests']:>8} req  {s['requests_per_sec']:>8}/s  "
+              f"{s['events_per_sec']:>8} ev/s  err {s['error_rate'] * 100:5.2f}%  "
+              f"p50<={s['p50_ms']}ms p90<={s['p90_ms']}ms p99<={s['p99_ms']}ms max={s['max_ms']}ms")
+        if s["errors"]:
+            print(f"  {'':22} errors {s['errors']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulated agent fleet for REFLEX backend load testing")
+    parser.add_argument('--backend-url', default="http://localhost:8000")
+    parser.add_argument('--agents', type=int, default=1000, help='Number of simulated agents')
+    parser.add_argument('--orgs', default="default_org", help="Org weights, e.g. 'acme=3,globex=1'")
+    parser.add_argument('--rate', type=float, default=1.0, help='Events per second per agent (Poisson)')
+    parser.add_argument('--batch-size', type=int, default=50, help='Events per batch; 1 uses /agent/event')
+    parser.add_argument('--batch-max-age', type=float, default=2.0, help='Flush partial batches after (s)')
+    parser.add_argument('--heartbeat-interval', type=float, default=30.0)
+    parser.add_argument('--duration', type=float, default=60.0, help='Test length (seconds)')
+    parser.add_argument('--burst-every', type=float, default=0.0, help='Seconds between attack bursts (0 = none)')
+    parser.add_argument('--burst-start', type=float, default=10.0, help='Offset of the first burst (s)')
+    parser.add_argument('--burst-duration', type=float, default=5.0, help='Length of each burst (s)')
+    parser.add_argument('--burst-agents', type=float, default=0.1, help='Fraction of agents that attack (0 = none)')
+    parser.add_argument('--burst-multiplier', type=float, default=10.0, help='Event rate multiplier in a burst')
+    parser.add_argument('--connections', type=int, default=100, help='Max concurrent HTTP connections')
+    parser.add_argument('--timeout', type=float, default=10.0, help='Per-request timeout (s)')
+    parser.add_argument('--report-interval', type=float, default=5.0, help='Progress line every N s (0 = off)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+    if not 0 <= args.burst_agents <= 1:
+        parser.error("--burst-agents must be a fraction between 0 and 1")
+    result = asyncio.run(LoadGenerator(args).run())
+    print_report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
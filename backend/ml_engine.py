@@ -1,115 +1,437 @@
 import numpy as np
 from sklearn.ensemble import IsolationForest
 from sklearn.preprocessing import StandardScaler
+import threading
 import time
-from typing import List, Dict
+from collections import namedtuple, OrderedDict
+from typing import List, Dict, Callable, Optional
+from urllib.parse import unquote
+from config import (ML_RETRAIN_INTERVAL_SECONDS, ML_RETRAIN_EVERY_EVENTS, ML_TRAIN_SAMPLES,
+                    ML_MODEL_CACHE_BYTES, ML_MODEL_MIN_BYTES)
+from detection_stats import DetectionStats
+from model_store import ModelStore
+from retention import RETENTION
+
+# Feature layout: event-type one-hot, normalized threat score, keyword flags
+EVENT_TYPE_COLUMNS = {"process_start": 0, "file_write": 1, "network_connection": 2}
+SCORE_COLUMN = 3
+KEYWORD_COLUMNS = (("curl", 4), ("bash", 5))
+N_FEATURES = 6
+
+def _flag_keywords(row: np.ndarray, value):
+    """Set keyword columns for any string found in a (possibly nested) details value"""
+    if isinstance(value, str):
+        lowered = value.lower()
+        for keyword, col in KEYWORD_COLUMNS:
+            if keyword in lowered:
+                row[col] = 1.0
+    elif isinstance(value, dict):
+        for v in value.values():
+            _flag_keywords(row, v)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            _flag_keywords(row, v)
+
+def extract_feature_matrix(events: List[Dict]) -> np.ndarray:
+    """Turn a batch of events into a preallocated (n_events, N_FEATURES) matrix"""
+    X = np.zeros((len(events), N_FEATURES), dtype=np.float64)
+    for i, event in enumerate(events):
+        row = X[i]
+        col = EVENT_TYPE_COLUMNS.get(event.get("event_type"))
+        if col is not None:
+            row[col] = 1.0
+        row[SCORE_COLUMN] = float(event.get("threat_score", 0)) / 100.0
+        _flag_keywords(row, event.get("details", {}))
+    return X
+
+# Immutable trained scaler/model pair; swapped in as a single reference
+ModelVersion = namedtuple("ModelVersion", ["version", "scaler", "model", "trained_at", "samples"])
 
 class MLThreatDetector:
-    def __init__(self):
-        self.scaler = StandardScaler()
-        self.model = IsolationForest(contamination=0.1, random_state=42)
+    def __init__(self, platform_stats: Optional[DetectionStats] = None):
+        self.active: Optional[ModelVersion] = None
+        self.model_bytes = 0
         self.baseline_features = []
-        self.is_trained = False
-        self.threat_history = []
+        self.stats = DetectionStats()
+        self.platform_stats = platform_stats
+        self._version_counter = 0
+        self._train_lock = threading.Lock()
+    
+    @property
+    def is_trained(self) -> bool:
+        return self.active is not None
+    
+    @property
+    def model_version(self) -> int:
+        active = self.active
+        return active.version if active else 0
     
     def extract_features(self, event: Dict) -> List[float]:
         """Extract numerical features from security event"""
-        features = [
-            1.0 if event.get("event_type") == "process_start" else 0.0,
-            1.0 if event.get("event_type") == "file_write" else 0.0,
-            1.0 if event.get("event_type") == "network_connection" else 0.0,
-            float(event.get("threat_score", 0)) / 100.0,
-            1.0 if "curl" in str(event.get("details", {})).lower() else 0.0,
-            1.0 if "bash" in str(event.get("details", {})).lower() else 0.0,
-        ]
-        return features
-    
-    def learn_baseline(self, events: List[Dict]):
-        """Learn behavioral baseline from event history"""
+        return extract_feature_matrix([event])[0].tolist()
+    
+    def train_version(self, events: List[Dict], max_samples: int = 100) -> Optional[ModelVersion]:
+        """Fit a new, not yet active, model version on recent events"""
         if len(events) < 10:
-            return False
-        
-        features_list = []
-        for event in events[-100:]:  # Use last 100 events
-            features = self.extract_features(event)
-            features_list.append(features)
-        
-        if len(features_list) < 10:
-            return False
+            return None
         
-        X = np.array(features_list)
-        self.baseline_features = X
+        X = extract_feature_matrix(events[-max_samples:])
         
         try:
-            X_scaled = self.scaler.fit_transform(X)
-            self.model.fit(X_scaled)
-            self.is_trained = True
-            print("✅ ML Model trained on baseline")
-            return True
+            # Fit fresh objects so inference never sees a half-trained pair
+            scaler = StandardScaler()
+            model = IsolationForest(contamination=0.1, random_state=42)
+            X_scaled = scaler.fit_transform(X)
+            model.fit(X_scaled)
         except Exception as e:
             print(f"❌ ML training failed: {e}")
+            return None
+        
+        with self._train_lock:
+            self._version_counter += 1
+            self.baseline_features = X
+            version = ModelVersion(self._version_counter, scaler, model, int(time.time()), len(X))
+        print(f"✅ ML Model v{version.version} trained on baseline ({len(X)} events)")
+        return version
+    
+    def activate(self, version: ModelVersion, model_bytes: int = 0):
+        """Atomically swap inference over to a model version"""
+        self.active = version
+        self.model_bytes = model_bytes
+    
+    def learn_baseline(self, events: List[Dict], max_samples: int = 100):
+        """Learn behavioral baseline from event history and swap in the new model"""
+        version = self.train_version(events, max_samples)
+        if version is None:
             return False
+        self.activate(version)
+        return True
     
     def detect_anomaly(self, event: Dict) -> Dict:
         """Detect anomalies using ML model"""
-        if not self.is_trained:
-            # Fallback to rule-based
-            return {
+        return self.detect_anomaly_batch([event])[0]
+    
+    def detect_anomaly_batch(self, events: List[Dict]) -> List[Dict]:
+        """Detect anomalies for a batch of events with a single model pass"""
+        if not events:
+            return []
+        active = self.active
+        if active is None:
+            return [{
                 "is_anomaly": False,
                 "anomaly_score": 0.0,
                 "method": "untrained",
                 "reasoning": "Model not yet trained"
-            }
+            } for _ in events]
         
         try:
-            features = np.array([self.extract_features(event)])
-            X_scaled = self.scaler.transform(features)
+            X_scaled = active.scaler.transform(extract_feature_matrix(events))
             
-            # -1 = anomaly, 1 = normal
-            prediction = self.model.predict(X_scaled)[0]
-            anomaly_score = abs(self.model.score_samples(X_scaled)[0])
+            # One score_samples call; predict() is score_samples compared to offset_
+            raw_scores = active.model.score_samples(X_scaled)
+            predictions = raw_scores < active.model.offset_
+            anomaly_scores = np.abs(raw_scores)
             
-            is_anomaly = prediction == -1
+            self.stats.record(anomaly_scores, predictions)
+            if self.platform_stats is not None:
+                self.platform_stats.record(anomaly_scores, predictions)
             
-            result = {
+            return [{
                 "is_anomaly": is_anomaly,
-                "anomaly_score": float(anomaly_score),
+                "anomaly_score": anomaly_score,
                 "method": "isolation_forest",
+                "model_version": active.version,
                 "reasoning": f"Anomaly score: {anomaly_score:.3f} (threshold: 0.5)"
-            }
-            
-            self.threat_history.append({
-                "event_id": event.get("agent_id", "unknown"),
-                "is_anomaly": is_anomaly,
-                "score": anomaly_score,
-                "timestamp": int(time.time())
-            })
-            
-            return result
+            } for anomaly_score, is_anomaly in zip(anomaly_scores.tolist(), predictions.tolist())]
         except Exception as e:
-            print(f"❌ Anomaly detection failed: {e}")
-            return {
+            print(f"❌ Batch anomaly detection failed: {e}")
+            return [{
                 "is_anomaly": False,
                 "anomaly_score": 0.0,
                 "method": "error",
                 "reasoning": str(e)
-            }
+            } for _ in events]
     
     def get_detection_stats(self) -> Dict:
         """Get ML detection statistics"""
-        if not self.threat_history:
-            return {"total": 0, "anomalies": 0, "detection_rate": 0.0}
-        
-        total = len(self.threat_history)
-        anomalies = sum(1 for t in self.threat_history if t["is_anomaly"])
+        stats = self.stats.snapshot()
+        if not self.stats.count:
+            return stats
+        stats.update({
+            "model_status": "trained" if self.is_trained else "untrained",
+            "model_version": self.model_version
+        })
+        return stats
+
+def _to_version(stored: Dict) -> ModelVersion:
+    return ModelVersion(stored["version"], stored["scaler"], stored["model"],
+                        stored["trained_at"], stored["samples"])
+
+def _key_part(value: str) -> str:
+    # '/' separates org from group, so it (and '%', to stay reversible) is escaped
+    return value.replace("%", "%25").replace("/", "%2F")
+
+def model_key(org_id: str, agent_group: Optional[str] = None) -> str:
+    """Registry key for a tenant's model, optionally narrowed to an agent group.
+
+    Parts are escaped, so an org id containing '/' can never produce another
+    org's "org/group" key.
+    """
+    org = _key_part(org_id)
+    return f"{org}/{_key_part(agent_group)}" if agent_group else org
+
+def model_org(key: str) -> str:
+    """The org id a model key belongs to"""
+    return unquote(key.split("/", 1)[0])
+
+class ModelRegistry:
+    """Per-tenant detectors with an LRU cache bounded by a model memory budget"""
+    
+    def __init__(self, budget_bytes: int = ML_MODEL_CACHE_BYTES, store: Optional[ModelStore] = None):
+        self.budget_bytes = budget_bytes
+        self.store = store or ModelStore()
+        self.detectors = OrderedDict()  # key -> MLThreatDetector, least recently used first
+        self.platform_stats = DetectionStats()  # aggregated across tenants
+        self.lock = threading.Lock()
+        self.stats = {"created": 0, "evicted": 0, "reloaded": 0}
+        self.evict_listeners = []  # called with the key of each evicted detector
+    
+    def get(self, key: str) -> MLThreatDetector:
+        """Get a tenant's detector, reloading it from the model store or creating it lazily"""
+        with self.lock:
+            det = self.detectors.get(key)
+            if det is not None:
+                self.detectors.move_to_end(key)
+                return det
+            det = MLThreatDetector(platform_stats=self.platform_stats)
+            try:
+                det._version_counter = self.store.latest_version(key)
+                stored = self.store.load(key)
+            except Exception as e:
+                print(f"❌ Model reload failed for {key}: {e}")
+                stored = None
+            if stored is not None:
+                det.activate(_to_version(stored), stored["bytes"])
+                self.stats["reloaded"] += 1
+            else:
+                self.stats["created"] += 1
+            self.detectors[key] = det
+            self._enforce_budget()
+            return det
+    
+    def peek(self, key: str) -> Optional[MLThreatDetector]:
+        with self.lock:
+            return self.detectors.get(key)
+    
+    def used_bytes(self) -> int:
+        # Untrained detectors still hold stats and state; charge each at least the floor
+        return sum(max(d.model_bytes, ML_MODEL_MIN_BYTES) for d in self.detectors.values())
+    
+    def _enforce_budget(self):
+        # Every trained version is already in the store, so eviction just drops it.
+        # Always keep the most recently used model resident.
+        while len(self.detectors) > 1 and self.used_bytes() > self.budget_bytes:
+            key, _ = self.detectors.popitem(last=False)
+            self.stats["evicted"] += 1
+            for listener in self.evict_listeners:
+                listener(key)
+    
+    def publish(self, key: str, det: MLThreatDetector, version: ModelVersion):
+        """Persist a newly trained version and activate it unless the key is pinned"""
+        manifest = self.store.save(key, version._asdict())
+        if manifest["active"] == version.version:
+            entry = next(v for v in manifest["versions"] if v["version"] == version.version)
+            det.activate(version, entry["bytes"])
+        with self.lock:
+            self._enforce_budget()
+    
+    def _swap_to(self, key: str, manifest: Dict):
+        stored = self.store.load(key, manifest["active"])
+        det = self.peek(key)
+        if det is not None and stored is not None:
+            det.activate(_to_version(stored), stored["bytes"])
+    
+    def pin(self, key: str, version: int) -> Dict:
+        """Activate a stored version and keep it active across retrains"""
+        manifest = self.store.set_active(key, version, pinned=True)
+        self._swap_to(key, manifest)
+        return manifest
+    
+    def rollback(self, key: str, version: Optional[int] = None) -> Dict:
+        """Pin the given version, or the one trained before the active version"""
+        if version is None:
+            manifest = self.store.read_manifest(key)
+            older = [v["version"] for v in manifest["versions"]
+                     if manifest["active"] is not None and v["version"] < manifest["active"]]
+            if not older:
+                raise KeyError(f"No earlier model version for {key}")
+            version = max(older)
+        return self.pin(key, version)
+    
+    def unpin(self, key: str) -> Dict:
+        """Resume following the newest trained version"""
+        latest = self.store.latest_version(key)
+        if latest == 0:
+            raise KeyError(f"No stored models for {key}")
+        manifest = self.store.set_active(key, latest, pinned=False)
+        self._swap_to(key, manifest)
+        return manifest
+    
+    def list_models(self) -> List[Dict]:
+        models = []
+        for key in self.store.keys():
+            manifest = self.store.read_manifest(key)
+            manifest["resident"] = self.peek(key) is not None
+            models.append(manifest)
+        return models
+    
+    def warm_start(self):
+        """Load stored models, most recently trained first, until the memory budget is used"""
+        def last_trained(key):
+            return max((v["trained_at"] for v in self.store.read_manifest(key)["versions"]), default=0)
         
+        loaded = 0
+        for key in sorted(self.store.keys(), key=last_trained, reverse=True):
+            if self.used_bytes() >= self.budget_bytes:
+                break
+            if self.get(key).is_trained:
+                loaded += 1
+        print(f"✅ Warm-started {loaded} ML model(s) from {self.store.root}")
+    
+    def detect_anomaly_batch(self, events: List[Dict]) -> List[Dict]:
+        """Score a mixed-tenant batch, one model pass per tenant"""
+        by_key = {}
+        for i, event in enumerate(events):
+            by_key.setdefault(model_key(event.get("org_id")), []).append(i)
+        results = [None] * len(events)
+        for key, idxs in by_key.items():
+            scored = self.get(key).detect_anomaly_batch([events[i] for i in idxs])
+            for i, result in zip(idxs, scored):
+                results[i] = result
+        return results
+    
+    def memory_usage(self) -> Dict:
+        with self.lock:
+            return {"items": len(self.detectors), "bytes": self.used_bytes(), "max_bytes": self.budget_bytes}
+
+    def stats_memory_usage(self) -> Dict:
+        """Detection statistics are constant-size per detector plus the platform aggregate"""
+        with self.lock:
+            stats = [d.stats for d in self.detectors.values()] + [self.platform_stats]
+        return {"items": len(stats), "bytes": sum(s.nbytes() for s in stats)}
+
+    def get_detection_stats(self, org_id: Optional[str] = None) -> Dict:
+        if org_id is not None:
+            key = model_key(org_id)
+            # A read must not create a detector; only tenants with a stored model are loaded
+            if self.peek(key) is None and not self.store.latest_version(key):
+                return {"total": 0, "anomalies": 0, "detection_rate": 0.0, "model_status": "untrained"}
+            return self.get(key).get_detection_stats()
+        stats = self.platform_stats.snapshot()
+        with self.lock:
+            trained = sum(1 for d in self.detectors.values() if d.is_trained)
+            stats.update({
+                "model_status": "trained" if trained else "untrained",
+                "models_loaded": len(self.detectors),
+                "models_trained": trained,
+                "model_cache_bytes": self.used_bytes(),
+                "model_cache_budget_bytes": self.budget_bytes,
+                **self.stats
+            })
+        return stats
+
+class RetrainScheduler:
+    """Retrains tenant models in the background on a cadence or after N new events"""
+    
+    def __init__(self, registry: ModelRegistry,
+                 interval_seconds: float = ML_RETRAIN_INTERVAL_SECONDS,
+                 every_events: int = ML_RETRAIN_EVERY_EVENTS,
+                 train_samples: int = ML_TRAIN_SAMPLES):
+        self.registry = registry
+        self.interval_seconds = interval_seconds
+        self.every_events = every_events
+        self.train_samples = train_samples
+        self.sample_provider: Optional[Callable[[str], List[Dict]]] = None
+        self.events_since_train = {}  # model key -> count
+        self.last_trained = {}  # model key -> unix time
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        registry.evict_listeners.append(self.forget)
+    
+    def forget(self, key: str):
+        """Drop counters for an evicted model; its next events start them again"""
+        with self.lock:
+            self.events_since_train.pop(key, None)
+            self.last_trained.pop(key, None)
+    
+    def note_events(self, key: str, count: int):
+        """Record newly scored events for a model; wakes the trainer once enough have arrived"""
+        with self.lock:
+            pending = self.events_since_train.get(key, 0) + count
+            self.events_since_train[key] = pending
+        det = self.registry.peek(key)
+        if pending >= self.every_events or det is None or not det.is_trained:
+            self.wakeup.set()
+    
+    def start(self, sample_provider: Callable[[str], List[Dict]]):
+        if self.thread is not None:
+            return
+        self.sample_provider = sample_provider
+        self.thread = threading.Thread(target=self._run, name="ml_retrainer", daemon=True)
+        self.thread.start()
+    
+    def _due(self, on_interval: bool) -> List[str]:
+        due = []
+        with self.lock:
+            pending = dict(self.events_since_train)
+        for key, count in pending.items():
+            if count == 0:
+                continue
+            det = self.registry.peek(key)
+            if on_interval or count >= self.every_events or det is None or not det.is_trained:
+                due.append(key)
+        return due
+    
+    def _run(self):
+        while True:
+            woken = self.wakeup.wait(timeout=self.interval_seconds)
+            self.wakeup.clear()
+            for key in self._due(on_interval=not woken):
+                with self.lock:
+                    pending = self.events_since_train.get(key, 0)
+                try:
+                    events = self.sample_provider(key)
+                    det = self.registry.get(key)
+                    version = det.train_version(events, max_samples=self.train_samples)
+                    if version is not None:
+                        self.registry.publish(key, det, version)
+                        with self.lock:
+                            if key in self.events_since_train:  # unless evicted meanwhile
+                                self.events_since_train[key] -= pending
+                            self.last_trained[key] = time.time()
+                except Exception as e:
+                    print(f"❌ Scheduled retrain failed for {key}: {e}")
+    
+    def get_status(self) -> Dict:
+        with self.lock:
+            pending = dict(self.events_since_train)
+        models = {}
+        for key, count in pending.items():
+            det = self.registry.peek(key)
+            models[key] = {
+                "model_version": det.model_version if det else None,
+                "events_since_train": count,
+                "last_trained": int(self.last_trained.get(key, 0))
+            }
         return {
-            "total_events_analyzed": total,
-            "anomalies_detected": anomalies,
-            "detection_rate": round(anomalies / total * 100, 2),
-            "avg_anomaly_score": round(np.mean([t["score"] for t in self.threat_history]), 3),
-            "model_status": "trained" if self.is_trained else "untrained"
+            "models": models,
+            "interval_seconds": self.interval_seconds,
+            "every_events": self.every_events
         }
 
-# Global detector instance
-detector = MLThreatDetector()
+# Per-tenant model registry
+registry = ModelRegistry()
+RETENTION.register_gauge("ml_models", registry.memory_usage)
+RETENTION.register_gauge("detection_stats", registry.stats_memory_usage)
+retrainer = RetrainScheduler(registry)
@@ -1,11 +1,18 @@
 from fastapi import APIRouter
 from models import ThreatScore
+from rule_matcher import KeywordMatcher
 from pydantic import BaseModel
 import random
 import time
 
 router = APIRouter(prefix="/ml")
 
+SUSPICIOUS_KEYWORDS = ["sleep", "bash", "curl", "wget", "nc"]
+BASELINE_KEYWORDS = ["nginx", "gunicorn", "flask", "python", "node"]
+# Weight = list position, so the earliest-listed keyword wins as before
+SUSPICIOUS_MATCHER = KeywordMatcher({kw: i for i, kw in enumerate(SUSPICIOUS_KEYWORDS)})
+BASELINE_MATCHER = KeywordMatcher({kw: i for i, kw in enumerate(BASELINE_KEYWORDS)})
+
 class ProcessFeatures(BaseModel):
     pid: int
     parent_pid: int
@@ -17,23 +24,20 @@ class ProcessFeatures(BaseModel):
 
 @router.post("/score", response_model=ThreatScore)
 def score_process(features: ProcessFeatures):
-    suspicious_keywords = ["sleep", "bash", "curl", "wget", "nc"]
-    baseline_keywords = ["nginx", "gunicorn", "flask", "python", "node"]
-
     score = 0.1  # default benign
     reasoning = "Process appears benign"
 
-    for kw in suspicious_keywords:
-        if kw in features.command_line:
-            score = random.uniform(0.7, 0.99)
-            reasoning = f"Suspicious keyword found: {kw}"
-            break
+    suspicious = SUSPICIOUS_MATCHER.matches(features.command_line)
+    if suspicious:
+        kw = min(suspicious, key=suspicious.get)
+        score = random.uniform(0.7, 0.99)
+        reasoning = f"Suspicious keyword found: {kw}"
     else:
-        for kw in baseline_keywords:
-            if kw in features.command_line:
-                score = 0.05
-                reasoning = f"Baseline keyword found: {kw}"
-                break
+        baseline = BASELINE_MATCHER.matches(features.command_line)
+        if baseline:
+            kw = min(baseline, key=baseline.get)
+            score = 0.05
+            reasoning = f"Baseline keyword found: {kw}"
 
     return ThreatScore(
         pid=features.pid,
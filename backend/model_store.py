@@ -0,0 +1,127 @@
+import json
+import os
+import threading
+import joblib
+from typing import List, Dict, Optional
+from config import ML_MODEL_STORE_DIR, ML_MODEL_KEEP_VERSIONS
+from safe_names import path_name
+
+class ModelStore:
+    """Versioned on-disk store of trained scaler/model pairs, one directory per model key"""
+
+    def __init__(self, root: str = ML_MODEL_STORE_DIR, keep_versions: int = ML_MODEL_KEEP_VERSIONS):
+        self.root = root
+        self.keep_versions = keep_versions
+        self.lock = threading.Lock()
+        self._migrate_names()
+
+    def _migrate_names(self):
+        """Rename directories written under the old key.replace("/", "__") naming"""
+        if not os.path.isdir(self.root):
+            return
+        for name in os.listdir(self.root):
+            try:
+                with open(os.path.join(self.root, name, "manifest.json")) as f:
+                    target = self._dir(json.load(f)["key"])
+            except (OSError, ValueError, KeyError):
+                continue
+            if os.path.join(self.root, name) != target and not os.path.exists(target):
+                os.rename(os.path.join(self.root, name), target)
+
+    def _dir(self, key: str) -> str:
+        # Keys come from client-supplied org ids; they must never name a path outside root
+        return os.path.join(self.root, path_name(key))
+
+    def _version_path(self, key: str, version: int) -> str:
+        return os.path.join(self._dir(key), f"v{version}.joblib")
+
+    def _manifest_path(self, key: str) -> str:
+        return os.path.join(self._dir(key), "manifest.json")
+
+    def read_manifest(self, key: str) -> Dict:
+        try:
+            with open(self._manifest_path(key)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"key": key, "versions": [], "active": None, "pinned": None}
+
+    def _write_manifest(self, key: str, manifest: Dict):
+        path = self._manifest_path(key)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, path)
+
+    def keys(self) -> List[str]:
+        if not os.path.isdir(self.root):
+            return []
+        keys = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name, "manifest.json")
+            if os.path.exists(path):
+                with open(path) as f:
+                    keys.append(json.load(f)["key"])
+        return keys
+
+    def latest_version(self, key: str) -> int:
+        versions = self.read_manifest(key)["versions"]
+        return max((v["version"] for v in versions), default=0)
+
+    def save(self, key: str, model: Dict) -> Dict:
+        """Persist a trained model; it becomes active unless the key is pinned"""
+        with self.lock:
+            os.makedirs(self._dir(key), exist_ok=True)
+            path = self._version_path(key, model["version"])
+            tmp = path + ".tmp"
+            # Uncompressed so NumPy arrays can be memory-mapped on load
+            joblib.dump(model, tmp)
+            os.replace(tmp, path)
+
+            manifest = self.read_manifest(key)
+            manifest["versions"].append({
+                "version": model["version"],
+                "trained_at": model["trained_at"],
+                "samples": model["samples"],
+                "bytes": os.path.getsize(path)
+            })
+            if manifest["pinned"] is None:
+                manifest["active"] = model["version"]
+            self._prune(key, manifest)
+            self._write_manifest(key, manifest)
+            return manifest
+
+    def _prune(self, key: str, manifest: Dict):
+        keep = {manifest["active"], manifest["pinned"]}
+        versions = manifest["versions"]
+        while len(versions) > self.keep_versions:
+            victim = next((v for v in versions if v["version"] not in keep), None)
+            if victim is None:
+                break
+            versions.remove(victim)
+            try:
+                os.remove(self._version_path(key, victim["version"]))
+            except FileNotFoundError:
+                pass
+
+    def load(self, key: str, version: Optional[int] = None) -> Optional[Dict]:
+        """Load a version (default: the active one), memory-mapping its arrays"""
+        if version is None:
+            version = self.read_manifest(key)["active"]
+        if version is None:
+            return None
+        path = self._version_path(key, version)
+        if not os.path.exists(path):
+            return None
+        model = joblib.load(path, mmap_mode="r")
+        model["bytes"] = os.path.getsize(path)
+        return model
+
+    def set_active(self, key: str, version: int, pinned: bool) -> Dict:
+        with self.lock:
+            manifest = self.read_manifest(key)
+            if not any(v["version"] == version for v in manifest["versions"]):
+                raise KeyError(f"Unknown model version {version} for {key}")
+            manifest["active"] = version
+            manifest["pinned"] = version if pinned else None
+            self._write_manifest(key, manifest)
+            return manifest
@@ -2,11 +2,14 @@ from pydantic import BaseModel, Field
 from typing import List, Dict, Optional, Any
 from enum import Enum
 
+MAX_INT64 = 2**63 - 1
+MAX_TIMESTAMP = 253402300799  # 9999-12-31T23:59:59Z
+
 # ===== EXISTING MODELS (KEEP THESE) =====
 
 class IncidentLog(BaseModel):
-    pid: int
-    timestamp: float
+    pid: int = Field(ge=0, le=MAX_INT64)  # stored as SQLite INTEGER
+    timestamp: float = Field(ge=0, le=MAX_TIMESTAMP)
     action: str
     command_line: str
     user: str = None
@@ -0,0 +1,165 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Dict
+from config import (INGEST_QUEUE_EVENTS, CORRELATION_QUEUE_SIZE, SCORING_BATCH_EVENTS,
+                    CORRELATION_WINDOW_SECONDS, CORRELATION_SCORE_THRESHOLD, ML_TRAIN_SAMPLES)
+from event_store import EVENTS_BY_ORG, get_org_events
+from ml_engine import retrainer, model_key, model_org
+from threat_engine import calculate_threat_scores_with_ml, correlate_events, CORRELATOR
+from search_index import SEARCH
+
+# Stage 1 -> 2: (events, future) submissions waiting to be scored;
+# bounded in events (not submissions) by submit()
+INGEST_QUEUE = queue.Queue()
+# Stage 2 -> 3: lists of high-score events waiting for correlation; a full
+# queue blocks the scoring worker, which pushes backpressure to ingest
+CORRELATION_QUEUE = queue.Queue(maxsize=CORRELATION_QUEUE_SIZE)
+
+PIPELINE_STATS = {
+    "accepted": 0,
+    "rejected": 0,
+    "scored": 0,
+    "correlated_events": 0,
+    "incidents_opened": 0,
+    "last_scoring_batch": 0,
+    "last_scoring_ms": 0.0
+}
+
+_pending_events = 0  # events accepted but not yet scored
+_lock = threading.Lock()
+_workers = []
+
+class PipelineFull(Exception):
+    """Raised when the ingest queue has no room for a submission"""
+
+def submit(events: List[Dict]) -> Future:
+    """Stage 1: accept events without scoring them; raises PipelineFull on backpressure"""
+    global _pending_events
+    with _lock:
+        if _pending_events + len(events) > INGEST_QUEUE_EVENTS:
+            PIPELINE_STATS["rejected"] += len(events)
+            raise PipelineFull()
+        _pending_events += len(events)
+        PIPELINE_STATS["accepted"] += len(events)
+    future = Future()
+    INGEST_QUEUE.put((events, future))
+    return future
+
+def _drain_ingest():
+    """Block for one submission, then coalesce whatever else is waiting"""
+    batch = [INGEST_QUEUE.get()]
+    count = len(batch[0][0])
+    while count < SCORING_BATCH_EVENTS:
+        try:
+            item = INGEST_QUEUE.get_nowait()
+        except queue.Empty:
+            break
+        batch.append(item)
+        count += len(item[0])
+    return batch
+
+def _score_batch(batch):
+    events = [e for evts, _ in batch for e in evts]
+    start = time.time()
+    scores = calculate_threat_scores_with_ml(events)
+
+    hot_events = []
+    stored = []
+    for evt_dict, threat_score in zip(events, scores):
+        evt_dict["threat_score"] = threat_score
+        seq = get_org_events(evt_dict["org_id"]).append(evt_dict)
+        stored.append((evt_dict["org_id"], seq, evt_dict))
+        if threat_score > CORRELATION_SCORE_THRESHOLD:
+            hot_events.append(evt_dict)
+    SEARCH.add_events(stored)
+
+    offset = 0
+    for evts, future in batch:
+        future.set_result(scores[offset:offset + len(evts)])
+        offset += len(evts)
+
+    per_model = {}
+    for evt_dict in events:
+        key = model_key(evt_dict["org_id"])
+        per_model[key] = per_model.get(key, 0) + 1
+    for key, count in per_model.items():
+        retrainer.note_events(key, count)
+    with _lock:
+        PIPELINE_STATS["scored"] += len(events)
+        PIPELINE_STATS["last_scoring_batch"] = len(events)
+        PIPELINE_STATS["last_scoring_ms"] = round((time.time() - start) * 1000, 2)
+
+    if hot_events:
+        CORRELATION_QUEUE.put(hot_events)
+
+def scoring_worker():
+    """Stage 2: score coalesced submissions in one pass and store them"""
+    global _pending_events
+    while True:
+        batch = _drain_ingest()
+        try:
+            _score_batch(batch)
+        except Exception as e:
+            print(f"❌ Scoring worker failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            with _lock:
+                _pending_events -= sum(len(evts) for evts, _ in batch)
+
+def correlation_worker():
+    """Stage 3: fold high-score events into the sliding-window correlator"""
+    last_sweep = time.time()
+    while True:
+        try:
+            hot_events = CORRELATION_QUEUE.get(timeout=CORRELATION_WINDOW_SECONDS)
+        except queue.Empty:
+            hot_events = []
+        new_incidents = []
+        try:
+            for org_id in {e["org_id"] for e in hot_events}:
+                print(f"⚠️ HIGH THREAT for org {org_id}: Triggering auto-response")
+            new_incidents = correlate_events(hot_events)
+            for inc in new_incidents:
+                print(f"🚨 AUTO-RESPONSE INITIATED: {inc}")
+            if time.time() - last_sweep >= CORRELATION_WINDOW_SECONDS:
+                CORRELATOR.sweep()
+                last_sweep = time.time()
+        except Exception as e:
+            print(f"❌ Correlation worker failed: {e}")
+        with _lock:
+            PIPELINE_STATS["correlated_events"] += len(hot_events)
+            PIPELINE_STATS["incidents_opened"] += len(new_incidents)
+
+def recent_training_events(key: str) -> List[Dict]:
+    """Most recent events of a model's org, for baseline retraining"""
+    org_id = model_org(key)
+    if org_id not in EVENTS_BY_ORG:
+        return []
+    return EVENTS_BY_ORG[org_id].latest(ML_TRAIN_SAMPLES)
+
+def start():
+    """Start the scoring and correlation workers (idempotent)"""
+    if _workers:
+        return
+    retrainer.start(recent_training_events)
+    for target in (scoring_worker, correlation_worker):
+        t = threading.Thread(target=target, name=target.__name__, daemon=True)
+        t.start()
+        _workers.append(t)
+    print("✅ Ingest pipeline started")
+
+def get_pipeline_stats() -> Dict:
+    with _lock:
+        return {
+            **PIPELINE_STATS,
+            "ingest_pending_events": _pending_events,
+            "ingest_capacity_events": INGEST_QUEUE_EVENTS,
+            "ingest_queue_submissions": INGEST_QUEUE.qsize(),
+            "correlation_queue_depth": CORRELATION_QUEUE.qsize(),
+            "correlation_queue_capacity": CORRELATION_QUEUE_SIZE,
+            "workers_alive": sum(1 for t in _workers if t.is_alive())
+        }
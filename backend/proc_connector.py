@@ -0,0 +1,90 @@
+# Linux netlink process connector (CN_PROC): fork/exec/exit notifications from the kernel.
+# Stdlib only; needs CAP_NET_ADMIN (usually root), callers fall back to polling otherwise.
+import errno
+import os
+import socket
+import struct
+
+NETLINK_CONNECTOR = 11
+CN_IDX_PROC = 1
+CN_VAL_PROC = 1
+NLMSG_DONE = 3
+PROC_CN_MCAST_LISTEN = 1
+PROC_CN_MCAST_IGNORE = 2
+
+PROC_EVENT_FORK = 0x00000001
+PROC_EVENT_EXEC = 0x00000002
+PROC_EVENT_EXIT = 0x80000000
+
+NLMSGHDR = struct.Struct("=IHHII")
+CN_MSG = struct.Struct("=IIIIHH")
+PROC_EVENT_HDR = struct.Struct("=IIQ")
+FORK_DATA = struct.Struct("=IIII")  # parent pid, parent tgid, child pid, child tgid
+EXEC_DATA = struct.Struct("=II")  # pid, tgid
+EXIT_DATA = struct.Struct("=IIII")  # pid, tgid, exit code, exit signal
+
+class ProcConnector:
+    """Subscribes to process events; recv() yields ("fork"|"exec"|"exit", ...) tuples"""
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_CONNECTOR)
+        try:
+            self.sock.bind((os.getpid(), CN_IDX_PROC))
+            self._control(PROC_CN_MCAST_LISTEN)
+        except OSError:
+            self.sock.close()
+            raise
+
+    def _control(self, op):
+        payload = struct.pack("=I", op)
+        cn = CN_MSG.pack(CN_IDX_PROC, CN_VAL_PROC, 0, 0, len(payload), 0) + payload
+        msg = NLMSGHDR.pack(NLMSGHDR.size + len(cn), NLMSG_DONE, 0, 0, os.getpid()) + cn
+        self.sock.send(msg)
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def recv(self):
+        """Block for the next datagram; returns parsed events (empty on timeout).
+
+        Raises OverflowError if the kernel dropped events (ENOBUFS) so the
+        caller can resynchronise from /proc.
+        """
+        try:
+            data = self.sock.recv(4096)
+        except socket.timeout:
+            return []
+        except OSError as e:
+            if e.errno == errno.ENOBUFS:
+                raise OverflowError("process connector buffer overrun")
+            raise
+        events = []
+        offset = 0
+        while offset + NLMSGHDR.size <= len(data):
+            msg_len = NLMSGHDR.unpack_from(data, offset)[0]
+            if msg_len < NLMSGHDR.size:
+                break
+            base = offset + NLMSGHDR.size + CN_MSG.size
+            if base + PROC_EVENT_HDR.size <= offset + msg_len:
+                what = PROC_EVENT_HDR.unpack_from(data, base)[0]
+                body = base + PROC_EVENT_HDR.size
+                if what == PROC_EVENT_FORK:
+                    _, parent_tgid, child_pid, child_tgid = FORK_DATA.unpack_from(data, body)
+                    if child_pid == child_tgid:  # skip new threads
+                        events.append(("fork", child_tgid, parent_tgid))
+                elif what == PROC_EVENT_EXEC:
+                    _, tgid = EXEC_DATA.unpack_from(data, body)
+                    events.append(("exec", tgid))
+                elif what == PROC_EVENT_EXIT:
+                    pid, tgid, _, _ = EXIT_DATA.unpack_from(data, body)
+                    if pid == tgid:
+                        events.append(("exit", tgid))
+            offset += (msg_len + 3) & ~3  # NLMSG_ALIGN
+        return events
+
+    def close(self):
+        try:
+            self._control(PROC_CN_MCAST_IGNORE)
+        except OSError:
+            pass
+        self.sock.close()
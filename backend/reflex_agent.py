@@ -4,15 +4,76 @@ import time
 import requests
 import socket
 import argparse
+import platform
+import functools
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from rule_matcher import KeywordMatcher
+from proc_connector import ProcConnector
+from uploader import BatchUploader
 
 # CONFIG
 API_BASE = "http://127.0.0.1:8000"
+SPOOL_PATH = "reflex_agent_spool.ndjson"
+POLICY_CACHE_PATH = "reflex_agent_policy.json"
+POLICY_REFRESH_SECONDS = 5.0
+HEARTBEAT_SECONDS = 30
+ORG_ID = "default_org"
+AGENT_ID = f"{socket.gethostname()}-{os.getpid()}"
+MIN_INTERVAL = 0.05
+MAX_INTERVAL = 5.0
+CPU_BUDGET = 0.02  # fraction of one core
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+MONITOR_STATE = {"mode": None}  # which monitor loop is running, for heartbeats
+CMDLINE_MAX_BYTES = 4096
+ENVIRON_MAX_BYTES = 8192
+FORENSICS_WORKERS = 2
+FORENSICS_MAX_PENDING = 256  # queued + running captures; beyond this incidents go out without one
+FULL_CAPTURE_ACTIONS = {"kill_blocked", "alert"}  # everything else gets a minimal capture
+ARTIFACT_FIELDS = ("cmdline", "environ", "cwd", "parent_cmd")
+ARTIFACT_MIN_BYTES = 128  # smaller values stay inline in the incident
+KNOWN_DIGESTS_MAX = 8192
+
+BLOB_ENDPOINT = "/forensics/blobs/batch"
+
+def make_uploader(base_url, spool_path):
+    # Blob batches are narrowed to what the backend lacks just before sending,
+    # and their digests are only trusted as known once a batch is accepted
+    return BatchUploader(base_url, spool_path).add_hook(
+        BLOB_ENDPOINT, prepare=lambda records: missing_blobs(records),
+        on_result=lambda records, accepted: blobs_settled(records, accepted))
+
+# Incidents and baseline entries are batched in the background and spooled
+# to disk while the backend is unreachable
+UPLOADER = make_uploader(API_BASE, SPOOL_PATH)
+# Non-kill incidents are captured and reported off the monitor loop
+FORENSICS_POOL = ThreadPoolExecutor(max_workers=FORENSICS_WORKERS, thread_name_prefix="forensics")
+FORENSICS_SLOTS = threading.BoundedSemaphore(FORENSICS_MAX_PENDING)
+FORENSICS_STATS = {"shed": 0, "inline": 0}
+# Artifact digests the backend confirmed it holds, most recent last
+KNOWN_DIGESTS = OrderedDict()
+# Digests queued for upload but not yet confirmed, so repeats are not queued twice
+PENDING_DIGESTS = set()
+KNOWN_DIGESTS_LOCK = threading.Lock()
 
 def register_agent(pid):
+    hostname = socket.gethostname()
+    try:
+        ip = socket.gethostbyname(hostname)
+    except OSError:
+        ip = "127.0.0.1"
     info = {
+        "agent_id": AGENT_ID,
+        "org_id": ORG_ID,
+        "hostname": hostname,
+        "ip": ip,
+        "os": platform.system(),
+        "version": "1.0",
         "pid": pid,
-        "start_time": time.time(),
-        "hostname": socket.gethostname()
+        "start_time": time.time()
     }
     try:
         res = requests.post(f"{API_BASE}/agent/register", json=info, timeout=2)
@@ -20,20 +81,22 @@ def register_agent(pid):
     except Exception as e:
         print(f"[AGENT] Registration failed: {e}")
 
-def post_incident(pid, parent_pid, cmd, user, action):
-    record = {
-        "pid": pid,
-        "timestamp": time.time(),
-        "action": action,
-        "command_line": cmd,
-        "user": user,
-        "details": {"parent_pid": parent_pid}
-    }
+def send_heartbeat():
+    mode = MONITOR_STATE["mode"]
+    if mode != "poll":
+        GOVERNOR.measure()  # the poll loop is the only other caller
+    stats = {"mode": mode, **GOVERNOR.snapshot(), "uploader": dict(UPLOADER.stats),
+             "forensics": dict(FORENSICS_STATS)}
     try:
-        res = requests.post(f"{API_BASE}/forensics/", json=record, timeout=2)
-        print(f"[LOG] Incident posted: {action} (PID {pid})")
+        requests.post(f"{API_BASE}/agent/heartbeat", timeout=2,
+                      json={"agent_id": AGENT_ID, "org_id": ORG_ID, "stats": stats})
     except Exception as e:
-        print(f"[LOG] Incident failed: {e}")
+        print(f"[AGENT] Heartbeat failed: {e}")
+
+def heartbeat_loop():
+    while True:
+        time.sleep(HEARTBEAT_SECONDS)
+        send_heartbeat()
 
 def add_baseline_entry(exec_path, user, fingerprint):
     entry = {
@@ -41,104 +104,373 @@ def add_baseline_entry(exec_path, user, fingerprint):
         "user": user,
         "fingerprint": fingerprint
     }
-    try:
-        res = requests.post(f"{API_BASE}/baseline/entry", json=entry, timeout=2)
-        print(f"[BASELINE] Added entry: {exec_path}")
-    except Exception as e:
-        print(f"[BASELINE] Add failed: {e}")
+    UPLOADER.submit("/baseline/entries/batch", entry)
+    print(f"[BASELINE] Queued entry: {exec_path}")
 
-def get_policy():
-    try:
-        res = requests.get(f"{API_BASE}/baseline/policy", timeout=2)
-        return res.json()
-    except Exception as e:
-        print(f"[POLICY] Get failed: {e}")
-        return None
-
-def get_child_pids(target_pid):
-    # Returns a set of child PIDs of the given PID (Linux /proc-based)
-    children = set()
-    for pid in os.listdir('/proc'):
-        if pid.isdigit():
+def compile_policy(policy):
+    return KeywordMatcher(policy.get("block", [])), KeywordMatcher(policy.get("allow", []))
+
+class PolicyCache:
+    """Last known policy, revalidated in the background with conditional GETs.
+
+    Policy checks never touch the network; if the backend is unreachable the
+    agent keeps enforcing the cached (or on-disk) copy.
+    """
+
+    def __init__(self, path=POLICY_CACHE_PATH, refresh_interval=POLICY_REFRESH_SECONDS):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.policy = None
+        self.etag = None
+        self.matchers = None
+        self.thread = None
+        self.online = True
+
+    def load(self):
+        """Seed from the on-disk copy so a restart while offline still enforces"""
+        try:
+            with open(self.path) as f:
+                cached = json.load(f)
+            self._install(cached["policy"], cached.get("etag"))
+            print(f"[POLICY] Loaded cached policy {self.etag}")
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+
+    def _install(self, policy, etag):
+        matchers = compile_policy(policy)
+        self.policy, self.etag, self.matchers = policy, etag, matchers
+
+    def refresh(self):
+        """Fetch the policy unless unchanged; True if a new policy was installed"""
+        headers = {"If-None-Match": self.etag} if self.etag else {}
+        try:
+            res = requests.get(f"{API_BASE}/baseline/policy", headers=headers, timeout=2)
+        except Exception as e:
+            if self.online:
+                print(f"[POLICY] Get failed, enforcing last known policy: {e}")
+            self.online = False
+            return False
+        self.online = True
+        if res.status_code != 200:  # 304: cached copy is current
+            return False
+        self._install(res.json(), res.headers.get("ETag"))
+        print(f"[POLICY] Policy updated {self.etag}")
+        try:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump({"policy": self.policy, "etag": self.etag}, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"[POLICY] Cache write failed: {e}")
+        return True
+
+    def _run(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            self.refresh()
+
+    def start(self):
+        if self.thread is None:
+            self.load()
+            self.refresh()
+            self.thread = threading.Thread(target=self._run, name="policy-refresh", daemon=True)
+            self.thread.start()
+        return self
+
+POLICY_CACHE = PolicyCache()
+
+class ProcessTable:
+    """One /proc scan per tick: pid -> (ppid, start_time, uid, comm) plus a children index"""
+
+    def __init__(self):
+        self.procs = {}
+        self.children = {}
+
+    @classmethod
+    def snapshot(cls):
+        table = cls()
+        for name in os.listdir('/proc'):
+            if not name.isdigit():
+                continue
+            pid = int(name)
             try:
                 with open(f'/proc/{pid}/stat') as f:
-                    stat = f.read().split()
-                    ppid = int(stat[3])
-                    if ppid == target_pid:
-                        children.add(int(pid))
+                    stat = f.read()
+                uid = os.stat(f'/proc/{pid}').st_uid
             except Exception:
-                continue
-    return children
+                continue  # exited mid-scan
+            # comm may contain spaces or ')' so split around the last ')'
+            comm = stat[stat.index('(') + 1:stat.rindex(')')]
+            fields = stat[stat.rindex(')') + 2:].split()
+            ppid = int(fields[1])
+            start_time = int(fields[19])
+            table.procs[pid] = (ppid, start_time, uid, comm)
+            table.children.setdefault(ppid, []).append(pid)
+        return table
+
+    def ppid(self, pid):
+        entry = self.procs.get(pid)
+        return entry[0] if entry else -1
+
+    def start_time(self, pid):
+        entry = self.procs.get(pid)
+        return entry[1] if entry else -1
+
+    def uid(self, pid):
+        entry = self.procs.get(pid)
+        return entry[2] if entry else -1
+
+    def descendants(self, roots):
+        """All processes below any of the given roots"""
+        found = set()
+        stack = list(roots)
+        while stack:
+            for child in self.children.get(stack.pop(), ()):
+                if child not in found:
+                    found.add(child)
+                    stack.append(child)
+        return found
+
+    def ancestry(self, pid):
+        """Parent chain of pid, nearest first, ending at init (or where the chain breaks)"""
+        chain = []
+        curr = pid
+        while curr != 1 and curr > 0 and curr in self.procs:
+            curr = self.procs[curr][0]
+            chain.append(curr)
+        return chain
+
+def read_ppid(pid):
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            stat = f.read()
+        return int(stat[stat.rindex(')') + 2:].split()[1])
+    except Exception:
+        return -1
+
+def read_capped(path, limit, sep):
+    """Read at most limit bytes of a NUL-separated /proc file; returns (text, truncated)"""
+    with open(path, 'rb') as f:
+        data = f.read(limit + 1)
+    return data[:limit].replace(b'\x00', sep).decode(errors="replace"), len(data) > limit
 
 def get_command_line(pid):
     try:
-        with open(f'/proc/{pid}/cmdline', 'rb') as f:
-            raw = f.read().replace(b'\x00', b' ').decode().strip()
-            return raw if raw else "[unknown command]"
+        raw = read_capped(f'/proc/{pid}/cmdline', CMDLINE_MAX_BYTES, b' ')[0].strip()
+        return raw if raw else "[unknown command]"
     except Exception:
         return "[unreadable]"
 
-def get_user(pid):
+@functools.lru_cache(maxsize=1024)
+def user_name(uid):
     try:
         import pwd
+        return pwd.getpwuid(uid).pw_name
+    except Exception:
+        return "[unknown_user]"
+
+def get_user(pid, table=None):
+    if table is not None and pid in table.procs:
+        return user_name(table.uid(pid))
+    try:
         stat_info = os.stat(f"/proc/{pid}")
-        return pwd.getpwuid(stat_info.st_uid).pw_name
+        return user_name(stat_info.st_uid)
     except Exception:
         return "[unknown_user]"
 
-def agent_monitor(monitor_pid, learn_mode=True, interval=1, contain_mode=False):
-    print(f"[AGENT] Starting monitor for PID {monitor_pid} (learn_mode={learn_mode}, contain={contain_mode}, interval={interval}s)")
-    register_agent(os.getpid())
-    seen = set()
+def load_policy_matchers():
+    return POLICY_CACHE.matchers
+
+def handle_new_process(child, parent, matchers, learn_mode, contain_mode, table=None):
+    timing = {"detected_at": time.time()}
+    cmd = get_command_line(child)
+    user = get_user(child, table)
+    print(f"[DETECT] New child found: PID {child} (parent {parent}) CMD '{cmd}' USER {user}")
+    if learn_mode:
+        add_baseline_entry(exec_path=cmd.split()[0], user=user, fingerprint=cmd)
+        report_incident(child, parent, cmd, user, "baseline_add", table, timing=timing)
+        return
+    blocked = matchers is not None and matchers[0].any(cmd)
+    allowed = matchers is not None and matchers[1].any(cmd)
+    if blocked:
+        print(f"[ACTION] Blocking & killing PID {child}: '{cmd}'")
+        # Full capture inline while the process still exists, kill, then report off-loop
+        forensics = get_full_forensics(child, table, "full")
+        if contain_mode:
+            try:
+                os.kill(child, 9)
+                timing["killed_at"] = time.time()
+            except Exception as e:
+                print(f"[ERROR] Kill failed: {e}")
+        report_incident(child, parent, cmd, user, "kill_blocked", table, forensics, timing)
+    elif allowed:
+        print(f"[ACTION] Allowed: {cmd}")
+        report_incident(child, parent, cmd, user, "allow", table, timing=timing)
+    else:
+        print(f"[ACTION] Alert: unknown/uncategorized: {cmd}")
+        report_incident(child, parent, cmd, user, "alert", table, timing=timing)
+
+def report_incident(pid, parent_pid, cmd, user, action, table=None, forensics=None, timing=None):
+    """Run post_incident on the forensics pool, keeping at most FORENSICS_MAX_PENDING in flight.
+
+    When the pool is saturated (e.g. a fork storm) only the capture is shed: the
+    incident is still queued from here, without forensics. Kills keep theirs, since
+    they were taken inline before the kill.
+    """
+    if FORENSICS_SLOTS.acquire(blocking=False):
+        try:
+            future = FORENSICS_POOL.submit(post_incident, pid, parent_pid, cmd, user, action,
+                                           table, forensics, timing)
+            future.add_done_callback(lambda _: FORENSICS_SLOTS.release())
+            return
+        except RuntimeError:  # pool shut down at exit
+            FORENSICS_SLOTS.release()
+    if forensics is None:
+        FORENSICS_STATS["shed"] += 1
+        if FORENSICS_STATS["shed"] % 100 == 1:
+            print(f"[FORENSICS] Pool saturated, shed {FORENSICS_STATS['shed']} capture(s) so far")
+        forensics = {"level": "none", "parent_pid": parent_pid, "shed": True}
+    else:
+        FORENSICS_STATS["inline"] += 1
+    post_incident(pid, parent_pid, cmd, user, action, table, forensics, timing)
+
+def agent_cpu_seconds():
+    """utime + stime of this process (all threads), from /proc/self/stat"""
+    with open("/proc/self/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLK_TCK
+
+class PollGovernor:
+    """Adaptive poll interval: snaps fast on new children, backs off when quiet,
+    and never lets the agent's own CPU use exceed cpu_budget (fraction of a core)."""
+
+    def __init__(self, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL, cpu_budget=CPU_BUDGET):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.cpu_budget = cpu_budget
+        self.interval = max_interval
+        self.cpu_usage = 0.0
+        self.last_cpu = agent_cpu_seconds()
+        self.last_wall = time.monotonic()
+
+    def measure(self):
+        cpu, wall = agent_cpu_seconds(), time.monotonic()
+        if wall > self.last_wall:
+            usage = (cpu - self.last_cpu) / (wall - self.last_wall)
+            self.cpu_usage = 0.7 * self.cpu_usage + 0.3 * usage  # EWMA smooths tick jitter
+        self.last_cpu, self.last_wall = cpu, wall
+        return self.cpu_usage
+
+    def next_interval(self, new_children):
+        usage = self.measure()
+        if new_children:
+            interval = self.min_interval  # snap to fast polling; backing off is gradual
+        else:
+            interval = self.interval * 1.5
+        if usage > self.cpu_budget:
+            interval = max(interval, self.interval * usage / self.cpu_budget)
+        self.interval = min(max(interval, self.min_interval), self.max_interval)
+        return self.interval
+
+    def snapshot(self):
+        return {
+            "interval": round(self.interval, 3),
+            "cpu_usage": round(self.cpu_usage, 4),
+            "cpu_budget": self.cpu_budget,
+            "budget_used": round(self.cpu_usage / self.cpu_budget, 3) if self.cpu_budget else None
+        }
+
+GOVERNOR = PollGovernor()
+
+def poll_monitor(roots, learn_mode, interval, contain_mode):
+    seen = {}  # pid -> start_time, so a recycled PID counts as new
+    GOVERNOR.interval = min(max(interval, GOVERNOR.min_interval), GOVERNOR.max_interval)
     while True:
-        children = get_child_pids(monitor_pid)
-        new_children = children - seen
+        table = ProcessTable.snapshot()
+        watched = table.descendants(roots)
+        new_children = [pid for pid in watched if seen.get(pid) != table.start_time(pid)]
         if new_children:
-            policy = get_policy()
+            matchers = load_policy_matchers()
         for child in new_children:
-            cmd = get_command_line(child)
-            user = get_user(child)
-            print(f"[DETECT] New child found: PID {child} CMD '{cmd}' USER {user}")
-            if learn_mode:
-                add_baseline_entry(exec_path=cmd.split()[0], user=user, fingerprint=cmd)
-                post_incident(child, monitor_pid, cmd, user, "baseline_add")
-            else:
-                blocked = policy and any(blk in cmd for blk in policy.get("block", []))
-                allowed = policy and any(allow in cmd for allow in policy.get("allow", []))
-                if blocked:
-                    print(f"[ACTION] Blocking & killing PID {child}: '{cmd}'")
-                    post_incident(child, monitor_pid, cmd, user, "kill_blocked")
-                    if contain_mode:
-                        try:
-                            os.kill(child, 9)
-                        except Exception as e:
-                            print(f"[ERROR] Kill failed: {e}")
-                elif allowed:
-                    print(f"[ACTION] Allowed: {cmd}")
-                    post_incident(child, monitor_pid, cmd, user, "allow")
-                else:
-                    print(f"[ACTION] Alert: unknown/uncategorized: {cmd}")
-                    post_incident(child, monitor_pid, cmd, user, "alert")
-        seen = children
-        time.sleep(interval)
+            handle_new_process(child, table.ppid(child), matchers, learn_mode, contain_mode, table)
+        seen = {pid: table.start_time(pid) for pid in watched}
+        time.sleep(GOVERNOR.next_interval(len(new_children)))
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="REFLEX Autonomous Security Agent")
-    parser.add_argument('--monitor-pid', type=int, required=True, help='PID to monitor')
-    parser.add_argument('--learn', action='store_true', help='Enable baseline learning mode')
-    parser.add_argument('--interval', type=float, default=1.0, help='Polling interval (seconds)')
-    parser.add_argument('--contain', action='store_true', help='Actually kill blocked PIDs')
-    args = parser.parse_args()
-    agent_monitor(
-        monitor_pid=args.monitor_pid,
-        learn_mode=args.learn,
-        interval=args.interval,
-        contain_mode=args.contain
-    )
-def get_full_forensics(pid):
-    forensics = {}
-    # Command line
+def netlink_monitor(connector, roots, learn_mode, interval, contain_mode):
+    # Start from a snapshot, then track the trees purely from kernel fork/exec/exit events
+    table = ProcessTable.snapshot()
+    watched = table.descendants(roots)
+    parents = {pid: table.ppid(pid) for pid in watched}
+    matchers = load_policy_matchers()
+    for pid in watched:
+        handle_new_process(pid, parents[pid], matchers, learn_mode, contain_mode, table)
+
+    connector.settimeout(interval)
+    while True:
+        try:
+            events = connector.recv()
+        except OverflowError:
+            print("[AGENT] Process events dropped, resyncing from /proc")
+            table = ProcessTable.snapshot()
+            current = table.descendants(roots)
+            for pid in current - watched:
+                handle_new_process(pid, table.ppid(pid), matchers, learn_mode, contain_mode, table)
+            watched = current
+            parents = {pid: table.ppid(pid) for pid in watched}
+            continue
+        for event in events:
+            kind, pid = event[0], event[1]
+            if kind == "fork":
+                parent = event[2]
+                if parent in watched or parent in roots:
+                    watched.add(pid)
+                    parents[pid] = parent
+            elif kind == "exec":
+                if pid not in watched:
+                    continue
+                matchers = load_policy_matchers()
+                handle_new_process(pid, parents.get(pid, -1), matchers, learn_mode, contain_mode)
+            elif kind == "exit":
+                watched.discard(pid)
+                parents.pop(pid, None)
+
+def agent_monitor(monitor_pids, learn_mode=True, interval=1, contain_mode=False, mode="auto"):
+    if isinstance(monitor_pids, int):
+        monitor_pids = [monitor_pids]
+    roots = set(monitor_pids)
+    print(f"[AGENT] Starting monitor for PIDs {sorted(roots)} (learn_mode={learn_mode}, contain={contain_mode}, interval={interval}s, mode={mode})")
+    register_agent(os.getpid())
+    UPLOADER.start()
+    POLICY_CACHE.start()
+    threading.Thread(target=heartbeat_loop, name="heartbeat", daemon=True).start()
+    if mode in ("auto", "netlink"):
+        try:
+            connector = ProcConnector()
+        except OSError as e:
+            if mode == "netlink":
+                raise
+            print(f"[AGENT] Process connector unavailable ({e}), falling back to polling")
+        else:
+            print("[AGENT] Using netlink process connector")
+            MONITOR_STATE["mode"] = "netlink"
+            try:
+                return netlink_monitor(connector, roots, learn_mode, interval, contain_mode)
+            finally:
+                connector.close()
+    MONITOR_STATE["mode"] = "poll"
+    poll_monitor(roots, learn_mode, interval, contain_mode)
+
+def get_full_forensics(pid, table=None, level="full"):
+    # Minimal: cmdline and parent only. Full adds cwd, environ, parent cmdline and ancestry.
+    forensics = {"level": level}
     forensics["cmdline"] = get_command_line(pid)
+    if table is not None:
+        ppid = table.ppid(pid)
+    else:
+        ppid = read_ppid(pid)
+    forensics["parent_pid"] = ppid
+    if level == "minimal":
+        return forensics
     # CWD
     try:
         forensics["cwd"] = os.readlink(f"/proc/{pid}/cwd")
@@ -146,48 +478,123 @@ def get_full_forensics(pid):
         forensics["cwd"] = "[unreadable]"
     # Environ
     try:
-        with open(f"/proc/{pid}/environ", 'rb') as f:
-            forensics["environ"] = f.read().replace(b'\x00', b'\n').decode()
+        environ, truncated = read_capped(f"/proc/{pid}/environ", ENVIRON_MAX_BYTES, b'\n')
+        forensics["environ"] = environ
+        forensics["environ_truncated"] = truncated
     except Exception:
         forensics["environ"] = "[unreadable]"
-    # Parent command
-    try:
-        with open(f"/proc/{pid}/stat") as f:
-            stat = f.read().split()
-            ppid = int(stat[3])
-            forensics["parent_pid"] = ppid
-            forensics["parent_cmd"] = get_command_line(ppid)
-    except Exception:
-        forensics["parent_pid"] = -1
-        forensics["parent_cmd"] = "[unreadable]"
-    # Ancestry (grandparents)
-    ancestry = []
-    curr = pid
-    try:
+    # Ancestry comes from the tick's process table when available,
+    # otherwise from walking this process's own stat chain
+    if table is not None:
+        ancestry = table.ancestry(pid)
+    else:
+        ancestry = []
+        curr = pid
         while curr != 1 and curr > 0:
-            with open(f"/proc/{curr}/stat") as f:
-                stat = f.read().split()
-                ppid = int(stat[3])
-                ancestry.append(ppid)
-                curr = ppid
-    except Exception:
-        pass
+            curr = read_ppid(curr)
+            if curr < 0:
+                break
+            ancestry.append(curr)
+    forensics["parent_cmd"] = get_command_line(ppid) if ppid > 0 else "[unreadable]"
     forensics["ancestry"] = ancestry
     return forensics
 
-def post_incident(pid, parent_pid, cmd, user, action):
-    # Use advanced forensics
-    forensics = get_full_forensics(pid)
+def missing_blobs(records):
+    """Uploader hook: one missing-digest check per blob batch, off the response path"""
+    res = requests.post(f"{API_BASE}/forensics/blobs/missing",
+                        json={"digests": [r["digest"] for r in records]}, timeout=2)
+    res.raise_for_status()
+    missing = set(res.json()["missing"])
+    return [r for r in records if r["digest"] in missing]
+
+def blobs_settled(records, accepted):
+    """Uploader hook: a blob batch was stored (or rejected) by the backend"""
+    with KNOWN_DIGESTS_LOCK:
+        for record in records:
+            digest = record["digest"]
+            PENDING_DIGESTS.discard(digest)
+            if accepted:
+                KNOWN_DIGESTS[digest] = True
+                KNOWN_DIGESTS.move_to_end(digest)
+        while len(KNOWN_DIGESTS) > KNOWN_DIGESTS_MAX:
+            KNOWN_DIGESTS.popitem(last=False)
+
+def externalize_artifacts(forensics):
+    # Large text fields go to the backend's blob store by SHA-256; the incident keeps
+    # only the digest, and content the backend already has is never re-sent
+    artifacts = {}
+    contents = {}
+    for field in ARTIFACT_FIELDS:
+        value = forensics.get(field)
+        if not isinstance(value, str) or len(value) < ARTIFACT_MIN_BYTES:
+            continue
+        data = value.encode()
+        digest = hashlib.sha256(data).hexdigest()
+        artifacts[field] = digest
+        contents[digest] = value
+        del forensics[field]
+    if not artifacts:
+        return forensics
+    with KNOWN_DIGESTS_LOCK:
+        unknown = [d for d in contents if d not in KNOWN_DIGESTS and d not in PENDING_DIGESTS]
+        if len(PENDING_DIGESTS) < KNOWN_DIGESTS_MAX:
+            PENDING_DIGESTS.update(unknown)
+    # Queued ahead of the incident, so the blobs reach the backend first; the
+    # uploader drops the ones the backend already has before sending
+    for digest in unknown:
+        UPLOADER.submit(BLOB_ENDPOINT, {"digest": digest, "content": contents[digest]})
+    forensics["artifacts"] = artifacts
+    return forensics
+
+def post_incident(pid, parent_pid, cmd, user, action, table=None, forensics=None, timing=None):
+    if forensics is None:
+        level = "full" if action in FULL_CAPTURE_ACTIONS else "minimal"
+        forensics = get_full_forensics(pid, table, level)
+    forensics = externalize_artifacts(forensics)
     record = {
         "pid": pid,
         "timestamp": time.time(),
         "action": action,
         "command_line": cmd,
         "user": user,
-        "details": {"parent_pid": parent_pid, "forensics": forensics}
+        "details": {"org_id": ORG_ID, "parent_pid": parent_pid, "forensics": forensics, **(timing or {})}
     }
-    try:
-        res = requests.post(f"{API_BASE}/forensics/", json=record, timeout=2)
-        print(f"[LOG] Incident posted: {action} (PID {pid})")
-    except Exception as e:
-        print(f"[LOG] Incident failed: {e}")
+    UPLOADER.submit("/forensics/incidents/batch", record)
+    print(f"[LOG] Incident queued: {action} (PID {pid})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="REFLEX Autonomous Security Agent")
+    parser.add_argument('--monitor-pid', type=int, nargs='+', required=True,
+                        help='PID(s) whose full descendant trees are monitored')
+    parser.add_argument('--learn', action='store_true', help='Enable baseline learning mode')
+    parser.add_argument('--interval', type=float, default=1.0, help='Initial polling interval (seconds)')
+    parser.add_argument('--min-interval', type=float, default=MIN_INTERVAL,
+                        help='Fastest adaptive polling interval (seconds)')
+    parser.add_argument('--max-interval', type=float, default=MAX_INTERVAL,
+                        help='Slowest adaptive polling interval when the host is quiet (seconds)')
+    parser.add_argument('--cpu-budget', type=float, default=CPU_BUDGET,
+                        help='Max agent CPU as a fraction of one core (e.g. 0.02 = 2%%)')
+    parser.add_argument('--api-base', default=API_BASE, help='Backend base URL')
+    parser.add_argument('--org-id', default=ORG_ID, help='Organization this agent reports to')
+    parser.add_argument('--contain', action='store_true', help='Actually kill blocked PIDs')
+    parser.add_argument('--spool', default=SPOOL_PATH,
+                        help='Local spool file for telemetry while the backend is unreachable')
+    parser.add_argument('--policy-refresh', type=float, default=POLICY_REFRESH_SECONDS,
+                        help='Seconds between background policy revalidations')
+    parser.add_argument('--mode', choices=['auto', 'netlink', 'poll'], default='auto',
+                        help='Process event source: netlink connector (needs root), polling, or auto')
+    args = parser.parse_args()
+    API_BASE = args.api_base
+    UPLOADER = make_uploader(API_BASE, args.spool)
+    POLICY_CACHE.refresh_interval = args.policy_refresh
+    GOVERNOR.min_interval = args.min_interval
+    GOVERNOR.max_interval = args.max_interval
+    GOVERNOR.cpu_budget = args.cpu_budget
+    ORG_ID = args.org_id
+    agent_monitor(
+        monitor_pids=args.monitor_pid,
+        learn_mode=args.learn,
+        interval=args.interval,
+        contain_mode=args.contain,
+        mode=args.mode
+    )
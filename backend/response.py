@@ -3,11 +3,19 @@ from pydantic import BaseModel
 import time
 from typing import List, Dict
 import requests
+from config import LOG_RETENTION_ITEMS, LOG_RETENTION_SECONDS, PLAYBOOK_RETENTION_ITEMS, RETENTION_STORE_BYTES
+from retention import RETENTION
 
 router = APIRouter(prefix="/response")
 
 RESPONSE_LOGS = []
 PLAYBOOKS = {}
+RETENTION.register("response_logs", lambda: RESPONSE_LOGS, max_items=LOG_RETENTION_ITEMS,
+                   max_bytes=RETENTION_STORE_BYTES, max_age=LOG_RETENTION_SECONDS,
+                   timestamp=lambda log: log["timestamp"])
+# Playbooks are configuration: no age limit, and the oldest are only spilled past the count budget
+RETENTION.register("playbooks", lambda: PLAYBOOKS, max_items=PLAYBOOK_RETENTION_ITEMS,
+                   max_bytes=RETENTION_STORE_BYTES)
 
 class ResponsePlaybook(BaseModel):
     playbook_id: str
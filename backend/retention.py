@@ -0,0 +1,225 @@
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import nullcontext
+from fastapi import APIRouter
+from typing import Callable, Dict, Optional
+from config import RETENTION_INTERVAL_SECONDS, RETENTION_SPILL_DIR, RETENTION_SAMPLE_ITEMS
+
+router = APIRouter(prefix="/retention")
+
+def approx_size(obj, depth: int = 0) -> int:
+    """Rough deep size of JSON-like data (dicts, lists, strings, pydantic models)"""
+    size = sys.getsizeof(obj)
+    if depth > 8:
+        return size
+    if isinstance(obj, dict):
+        size += sum(approx_size(k, depth + 1) + approx_size(v, depth + 1) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(approx_size(v, depth + 1) for v in obj)
+    elif hasattr(obj, "__dict__") and not isinstance(obj, type):
+        size += approx_size(vars(obj), depth + 1)
+    return size
+
+def to_json(item):
+    return item.dict() if hasattr(item, "dict") else item
+
+class RetainedStore:
+    """An append-ordered list or dict (oldest first) kept within count, byte and age budgets.
+
+    Evicted items are appended to a gzip'd NDJSON file per store and day when
+    spill is on, so nothing is lost, only moved out of memory. If the store has
+    a lock, eviction and on_evict(evicted_items) run under it, so readers that
+    take the same lock never see the container and its bookkeeping disagree.
+    """
+
+    def __init__(self, name: str, source: Callable, max_items: int = 0, max_bytes: int = 0,
+                 max_age: float = 0, timestamp: Optional[Callable] = None, spill: bool = True,
+                 on_evict: Optional[Callable] = None, lock=None):
+        self.name = name
+        self.source = source  # returns the live container, which may be replaced over time
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.timestamp = timestamp
+        self.spill = spill
+        self.on_evict = on_evict
+        self.lock = lock
+        self.stats = {"evicted": 0, "spilled": 0}
+
+    def _items(self, container):
+        return list(container.values()) if isinstance(container, dict) else container
+
+    def item_bytes(self, items) -> float:
+        """Mean size of an item, estimated from an evenly spaced sample"""
+        if not items:
+            return 0.0
+        step = max(1, len(items) // RETENTION_SAMPLE_ITEMS)
+        sample = items[::step][:RETENTION_SAMPLE_ITEMS]
+        return sum(approx_size(item) for item in sample) / len(sample)
+
+    def usage(self) -> Dict:
+        container = self.source()
+        items = self._items(container)
+        count = len(items)
+        return {
+            "items": count,
+            "bytes": int(self.item_bytes(items) * count + sys.getsizeof(container)),
+            "max_items": self.max_items or None,
+            "max_bytes": self.max_bytes or None,
+            "max_age_seconds": self.max_age or None,
+            **self.stats
+        }
+
+    def excess(self, now: float) -> int:
+        """How many of the oldest items are over budget"""
+        items = self._items(self.source())
+        count = len(items)
+        drop = 0
+        if self.max_items and count > self.max_items:
+            drop = count - self.max_items
+        if self.max_bytes and count:
+            keep = int(self.max_bytes // max(self.item_bytes(items), 1.0))
+            drop = max(drop, count - keep)
+        if self.max_age and self.timestamp is not None:
+            cutoff = now - self.max_age
+            # Items are append-ordered, so aged-out ones form a prefix
+            while drop < count and self.timestamp(items[drop]) < cutoff:
+                drop += 1
+        return min(drop, count)
+
+    def enforce(self, now: Optional[float] = None) -> int:
+        now = now if now is not None else time.time()
+        with self.lock or nullcontext():
+            drop = self.excess(now)
+            if drop == 0:
+                return 0
+            container = self.source()
+            if isinstance(container, dict):
+                keys = list(container)[:drop]
+                evicted = [container.pop(k) for k in keys if k in container]
+            else:
+                evicted = container[:drop]
+                del container[:drop]
+            if self.on_evict is not None:
+                self.on_evict(evicted)
+        self.stats["evicted"] += len(evicted)
+        if self.spill and evicted:
+            self._spill(evicted, now)
+        return len(evicted)
+
+    def _spill(self, evicted, now: float):
+        directory = os.path.join(RETENTION_SPILL_DIR, self.name)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, time.strftime("%Y-%m-%d", time.gmtime(now)) + ".ndjson.gz")
+        lines = "".join(json.dumps(to_json(item), default=str) + "\n" for item in evicted)
+        # Each spill is its own gzip member; concatenated members read back as one stream
+        with open(path, "ab") as f:
+            f.write(gzip.compress(lines.encode()))
+        self.stats["spilled"] += len(evicted)
+
+class RetentionManager:
+    """Registry of in-process stores; enforces their budgets from one background thread.
+
+    Stores that bound themselves (ring buffers, model cache, fixed-size stats)
+    register a gauge instead, so /retention/stats still accounts for them.
+    Stores that live outside the process (databases, files) or need their own
+    compaction register a sweep, sweep(now) -> items removed, run on the same
+    schedule; an optional measure() reports their usage like a gauge.
+    """
+
+    def __init__(self, interval: float = RETENTION_INTERVAL_SECONDS):
+        self.interval = interval
+        self.stores = {}
+        self.gauges = {}
+        self.sweeps = {}
+        self.sweep_stats = {}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.last_run = None
+
+    def register(self, name: str, source: Callable, **policy) -> RetainedStore:
+        store = RetainedStore(name, source, **policy)
+        with self.lock:
+            self.stores[name] = store
+        return store
+
+    def register_gauge(self, name: str, measure: Callable[[], Dict]):
+        """measure() returns at least {"items", "bytes"} for a self-bounded store"""
+        with self.lock:
+            self.gauges[name] = measure
+
+    def register_sweep(self, name: str, sweep: Callable[[float], int],
+                       measure: Optional[Callable[[], Dict]] = None):
+        with self.lock:
+            self.sweeps[name] = (sweep, measure)
+            self.sweep_stats[name] = {"evicted": 0}
+
+    def enforce(self) -> Dict[str, int]:
+        now = time.time()
+        evicted = {}
+        for name, store in list(self.stores.items()):
+            try:
+                evicted[name] = store.enforce(now)
+            except Exception as e:
+                print(f"❌ Retention failed for {name}: {e}")
+        for name, (sweep, _) in list(self.sweeps.items()):
+            try:
+                evicted[name] = sweep(now)
+                self.sweep_stats[name]["evicted"] += evicted[name]
+            except Exception as e:
+                print(f"❌ Retention failed for {name}: {e}")
+        self.last_run = now
+        return evicted
+
+    def report(self) -> Dict:
+        stores = {}
+        for name, store in list(self.stores.items()):
+            stores[name] = {"kind": "retained", **store.usage()}
+        for name, measure in list(self.gauges.items()):
+            try:
+                stores[name] = {"kind": "self_bounded", **measure()}
+            except Exception as e:
+                stores[name] = {"kind": "self_bounded", "error": str(e)}
+        for name, (_, measure) in list(self.sweeps.items()):
+            try:
+                usage = measure() if measure is not None else {}
+            except Exception as e:
+                usage = {"error": str(e)}
+            stores[name] = {"kind": "swept", **usage, **self.sweep_stats[name]}
+        return {
+            "total_bytes": sum(s.get("bytes", 0) for s in stores.values()),
+            "interval_seconds": self.interval,
+            "last_run": self.last_run,
+            "stores": stores
+        }
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            evicted = self.enforce()
+            total = sum(evicted.values())
+            if total:
+                print(f"✅ Retention evicted {total} item(s): " +
+                      ", ".join(f"{k}={v}" for k, v in evicted.items() if v))
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="retention", daemon=True)
+                self.thread.start()
+
+RETENTION = RetentionManager()
+
+@router.get("/stats")
+def retention_stats():
+    """Approximate memory use and budgets of every in-process store"""
+    return RETENTION.report()
+
+@router.post("/enforce")
+def enforce_retention():
+    """Apply every store's budget now instead of waiting for the next sweep"""
+    return {"evicted": RETENTION.enforce()}
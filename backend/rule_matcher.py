@@ -0,0 +1,103 @@
+# Multi-pattern keyword matching (Aho-Corasick), shared by the backend and the agent.
+# Stdlib only, so reflex_agent.py can ship it alongside itself.
+import threading
+from collections import deque
+
+class KeywordMatcher:
+    """Aho-Corasick automaton over a fixed keyword -> weight mapping"""
+
+    def __init__(self, weights):
+        if not isinstance(weights, dict):
+            weights = {kw: 1 for kw in weights}
+        self.weights = {kw: w for kw, w in weights.items() if kw}
+        self._goto = [{}]  # state -> {char: next state}
+        self._fail = [0]
+        self._out = [()]  # state -> keywords ending here
+        for keyword in self.weights:
+            self._add(keyword)
+        self._link()
+
+    def _add(self, keyword):
+        state = 0
+        for ch in keyword:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+                self._goto[state][ch] = nxt
+            state = nxt
+        self._out[state] = self._out[state] + (keyword,)
+
+    def _link(self):
+        # Breadth-first failure links; each state inherits its fail state's outputs
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def _scan(self, text):
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                yield out[state]
+
+    def matches(self, text):
+        """Every distinct keyword found in text, with its weight, in one pass"""
+        found = {}
+        for keywords in self._scan(text):
+            for kw in keywords:
+                found[kw] = self.weights[kw]
+        return found
+
+    def any(self, text):
+        """True as soon as any keyword is found"""
+        for _ in self._scan(text):
+            return True
+        return False
+
+    def score(self, text):
+        """Sum of weights of the distinct keywords found in text"""
+        return sum(self.matches(text).values())
+
+class RuleSet:
+    """Holds a compiled matcher and recompiles it when the rules change"""
+
+    def __init__(self, weights=None):
+        self._lock = threading.Lock()
+        self.version = 0
+        self.matcher = KeywordMatcher({})
+        if weights:
+            self.update(weights)
+
+    def update(self, weights):
+        """Compile new rules and swap them in atomically"""
+        matcher = KeywordMatcher(dict(weights) if isinstance(weights, dict) else weights)
+        with self._lock:
+            self.matcher = matcher
+            self.version += 1
+        return self.version
+
+    @property
+    def rules(self):
+        return dict(self.matcher.weights)
+
+    def matches(self, text):
+        return self.matcher.matches(text)
+
+    def any(self, text):
+        return self.matcher.any(text)
+
+    def score(self, text):
+        return self.matcher.score(text)
@@ -0,0 +1,25 @@
+import hashlib
+from typing import Optional
+from urllib.parse import quote, unquote
+
+MAX_NAME_LENGTH = 200
+
+def path_name(key: str) -> str:
+    """Reversible, path-safe file name for an arbitrary (client-supplied) key.
+
+    Everything but [A-Za-z0-9_~-] is percent-encoded, dots included, so no key
+    can produce '.', '..', a separator or an absolute path. Keys whose encoding
+    would exceed MAX_NAME_LENGTH become '#' plus a digest, which is not reversible.
+    """
+    if key == "":
+        return "%"
+    name = quote(key, safe="").replace(".", "%2E")
+    if len(name) > MAX_NAME_LENGTH:
+        return "#" + hashlib.sha256(key.encode()).hexdigest()
+    return name
+
+def key_of(name: str) -> Optional[str]:
+    """Inverse of path_name; None for digest names"""
+    if name.startswith("#"):
+        return None
+    return "" if name == "%" else unquote(name)
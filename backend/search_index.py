@@ -0,0 +1,506 @@
+import bisect
+import re
+import threading
+import time
+import numpy as np
+from array import array
+from fastapi import APIRouter, HTTPException
+from typing import Callable, Dict, Iterable, List, Optional
+from config import (SEARCH_MAX_TOKENS_PER_FIELD, SEARCH_MAX_TOKEN_LENGTH, SEARCH_MAX_RESULTS,
+                    SEARCH_MAX_DOCS, SEARCH_MAX_AGE_SECONDS, SEARCH_COMPACT_CHUNK_TERMS)
+from retention import RETENTION
+
+router = APIRouter(prefix="/search")
+
+FIELDS = ("command_line", "process", "file", "ip", "user", "agent_id", "org_id", "action", "event_type")
+KINDS = ("event", "incident", "audit")
+KIND_CODES = {kind: i for i, kind in enumerate(KINDS)}
+
+# Split on whitespace, path and key/value punctuation; '.', '-' and '_' stay inside tokens
+TOKEN_SPLIT = re.compile(r"[\s/\\=,;:'\"()\[\]{}<>|&]+")
+
+def tokenize(value) -> List[str]:
+    """Tokens of one field value, plus the whole value so exact paths and IPs match"""
+    value = str(value).strip().lower()
+    if not value:
+        return []
+    tokens = [t for t in TOKEN_SPLIT.split(value) if t][:SEARCH_MAX_TOKENS_PER_FIELD]
+    if len(value) <= SEARCH_MAX_TOKEN_LENGTH:
+        tokens.append(value)
+    return [t[:SEARCH_MAX_TOKEN_LENGTH] for t in tokens]
+
+def term_key(field: str, token: str) -> str:
+    return f"{field}:{token}"
+
+def event_fields(event: Dict) -> Dict[str, List]:
+    details = event.get("details") or {}
+    return {
+        "process": [details.get("process")],
+        "file": [details.get("file")],
+        "ip": [details.get("ip")],
+        "user": [details.get("user")],
+        "command_line": [details.get("command_line") or details.get("cmdline")],
+        "agent_id": [event.get("agent_id")],
+        "org_id": [event.get("org_id")],
+        "event_type": [event.get("event_type")]
+    }
+
+def incident_fields(incident: Dict, events: Optional[List[Dict]] = None) -> Dict[str, List]:
+    """A correlated incident is found by anything in its events"""
+    fields = {"agent_id": [incident.get("agent_id")], "org_id": [incident.get("org_id")]}
+    for event in incident.get("events", []) if events is None else events:
+        for field, values in event_fields(event).items():
+            fields.setdefault(field, []).extend(values)
+    return fields
+
+def audit_fields(record: Dict) -> Dict[str, List]:
+    """Agent-reported incidents: the command line plus any inline forensic command lines"""
+    forensics = (record.get("details") or {}).get("forensics") or {}
+    if not isinstance(forensics, dict):
+        forensics = {}
+    return {
+        "command_line": [record.get("command_line"), forensics.get("cmdline"), forensics.get("parent_cmd")],
+        "user": [record.get("user")],
+        "action": [record.get("action")]
+    }
+
+class SearchIndex:
+    """In-memory inverted index over events, correlated incidents and audit incidents.
+
+    Terms are "field:token"; each maps to a posting list of doc ids. Doc ids are
+    assigned in arrival order, and per-doc kind, timestamp, org and a kind-specific
+    reference (event seq, incident id, audit row id) are kept in parallel arrays
+    starting at doc id `base`. Documents themselves are not stored; registered
+    resolvers load them for a page of hits. compact() drops the oldest docs
+    beyond max_docs / max_age; ids are never reused, so cursors stay valid.
+    Posting lists are trimmed a chunk of terms at a time, so they may still hold
+    ids below `base` for a while; queries ignore those.
+    """
+
+    def __init__(self, max_docs: int = SEARCH_MAX_DOCS, max_age: float = SEARCH_MAX_AGE_SECONDS):
+        self.max_docs = max_docs
+        self.max_age = max_age
+        self.postings = {}  # term -> sorted array('I') of doc ids
+        self.sorted_terms = []  # for prefix queries
+        self.new_terms = []  # not yet merged into sorted_terms
+        self.stale_terms = 0  # entries in sorted_terms whose posting list was emptied
+        self.base = 0  # doc id of the oldest doc still held
+        self.kinds = array('b')
+        self.timestamps = array('d')
+        self.orgs = array('i')
+        self.refs = array('q')
+        self.org_ids = []
+        self.org_codes = {}
+        self.updatable = {}  # (kind, ref) -> doc id, for docs that gain terms later
+        self.resolvers = {}
+        self.lock = threading.Lock()
+
+    def register_resolver(self, kind: str, resolver: Callable):
+        """resolver([(org_id, ref), ...]) -> {(org_id, ref): document}"""
+        self.resolvers[kind] = resolver
+
+    def _org_code(self, org_id) -> int:
+        if org_id is None:
+            return -1
+        code = self.org_codes.get(org_id)
+        if code is None:
+            code = len(self.org_ids)
+            self.org_ids.append(org_id)
+            self.org_codes[org_id] = code
+        return code
+
+    def _index(self, doc: int, fields: Dict[str, List]):
+        for field, values in fields.items():
+            for value in values:
+                if value is None:
+                    continue
+                for token in tokenize(value):
+                    term = term_key(field, token)
+                    posting = self.postings.get(term)
+                    if posting is None:
+                        posting = self.postings[term] = array('I')
+                        self.new_terms.append(term)
+                    if not posting or posting[-1] < doc:
+                        posting.append(doc)
+                    elif posting[-1] != doc:
+                        # An older doc gaining terms; its id belongs near the tail
+                        i = bisect.bisect_left(posting, doc)
+                        if posting[i] != doc:
+                            posting.insert(i, doc)
+
+    def add(self, kind: str, ref: int, timestamp: float, fields: Dict[str, List],
+            org_id: Optional[str] = None, updatable: bool = False) -> int:
+        with self.lock:
+            doc = self.base + len(self.kinds)
+            self.kinds.append(KIND_CODES[kind])
+            self.timestamps.append(float(timestamp or 0))
+            self.orgs.append(self._org_code(org_id))
+            self.refs.append(ref)
+            self._index(doc, fields)
+            if updatable:
+                self.updatable[(kind, ref)] = doc
+            return doc
+
+    def extend(self, kind: str, ref: int, fields: Dict[str, List]):
+        """Add terms to an updatable doc, e.g. an incident that absorbed another event"""
+        with self.lock:
+            doc = self.updatable.get((kind, ref))
+            if doc is not None:
+                self._index(doc, fields)
+
+    def seal(self, kind: str, ref: int):
+        """The doc will not change again (e.g. its incident closed)"""
+        with self.lock:
+            self.updatable.pop((kind, ref), None)
+
+    def add_events(self, items: Iterable):
+        """(org_id, seq, event) triples, indexed under one lock acquisition"""
+        with self.lock:
+            for org_id, seq, event in items:
+                doc = self.base + len(self.kinds)
+                self.kinds.append(KIND_CODES["event"])
+                self.timestamps.append(float(event.get("timestamp") or 0))
+                self.orgs.append(self._org_code(org_id))
+                self.refs.append(seq)
+                self._index(doc, event_fields(event))
+
+    def add_incident(self, incident: Dict):
+        self.add("incident", incident["incident_id"], incident["first_seen"], incident_fields(incident),
+                 org_id=incident.get("org_id"), updatable=True)
+
+    def add_audit(self, row_id: int, record: Dict):
+        # Agents report their org inside details; older rows without one match no org
+        org_id = (record.get("details") or {}).get("org_id")
+        self.add("audit", row_id, record.get("timestamp"), audit_fields(record),
+                 org_id=org_id if isinstance(org_id, str) else None)
+
+    # ----- compaction -----
+
+    def excess(self, now: float) -> int:
+        """How many of the oldest docs are over budget; call with self.lock held"""
+        count = len(self.kinds)
+        drop = max(0, count - self.max_docs) if self.max_docs else 0
+        if self.max_age and drop < count:
+            # Docs arrive roughly in time order, so aged-out ones are treated as a prefix
+            fresh = np.frombuffer(self.timestamps, dtype=np.float64)[drop:] >= now - self.max_age
+            drop += int(np.argmax(fresh)) if fresh.any() else count - drop
+        return drop
+
+    def compact(self, now: Optional[float] = None, chunk: int = SEARCH_COMPACT_CHUNK_TERMS) -> int:
+        """Drop the oldest docs beyond the budgets from every posting list; returns how many"""
+        now = now if now is not None else time.time()
+        with self.lock:
+            drop = self.excess(now)
+            if drop == 0:
+                return 0
+            self.base += drop
+            for column in (self.kinds, self.timestamps, self.orgs, self.refs):
+                del column[:drop]
+            self.updatable = {key: doc for key, doc in self.updatable.items() if doc >= self.base}
+            base = self.base
+            terms = list(self.postings)
+        # Ingest takes the same lock; trim a chunk of posting lists per acquisition
+        # rather than holding it for a pass over every term
+        for i in range(0, len(terms), chunk):
+            with self.lock:
+                for term in terms[i:i + chunk]:
+                    posting = self.postings.get(term)
+                    if posting is None or posting[0] >= base:
+                        continue
+                    del posting[:bisect.bisect_left(posting, base)]
+                    if not posting:
+                        del self.postings[term]
+                        self.stale_terms += 1
+        return drop
+
+    # ----- queries -----
+
+    def _posting(self, term: str) -> np.ndarray:
+        posting = self.postings.get(term)
+        if posting is None:
+            return np.empty(0, dtype=np.uint32)
+        return np.frombuffer(posting, dtype=np.uint32).copy()
+
+    def _prefix(self, prefix: str) -> List[str]:
+        if self.stale_terms > len(self.sorted_terms) // 2:
+            # Mostly emptied terms: rebuild once rather than filtering on every compaction
+            self.sorted_terms = sorted(self.postings)
+            self.new_terms = []
+            self.stale_terms = 0
+        elif self.new_terms:
+            # Two sorted runs: timsort merges them in linear time
+            self.sorted_terms += sorted(self.new_terms)
+            self.sorted_terms.sort()
+            self.new_terms = []
+        start = bisect.bisect_left(self.sorted_terms, prefix)
+        end = start
+        while end < len(self.sorted_terms) and self.sorted_terms[end].startswith(prefix):
+            end += 1
+        return [t for t in self.sorted_terms[start:end] if t in self.postings]
+
+    def _match(self, field: Optional[str], token: str, prefix: bool) -> np.ndarray:
+        fields = FIELDS if field is None else (field,)
+        parts = [t for t in TOKEN_SPLIT.split(token) if t]
+        matches = []
+        for f in fields:
+            key = term_key(f, token)
+            for term in (self._prefix(key) if prefix else [key]):
+                matches.append(self._posting(term))
+            if not prefix and len(parts) > 1:
+                # "/bin/sh" also matches values containing both "bin" and "sh", like "nc -e /bin/sh"
+                docs = self._posting(term_key(f, parts[0]))
+                for part in parts[1:]:
+                    docs = np.intersect1d(docs, self._posting(term_key(f, part)), assume_unique=True)
+                matches.append(docs)
+        if len(matches) == 1:
+            return matches[0]
+        return np.unique(np.concatenate(matches or [np.empty(0, dtype=np.uint32)]))
+
+    def _all(self) -> np.ndarray:
+        return np.arange(self.base, self.base + len(self.kinds), dtype=np.uint32)
+
+    def _eval(self, node) -> np.ndarray:
+        op = node[0]
+        if op == "term":
+            return self._match(*node[1:])
+        if op == "not":
+            return np.setdiff1d(self._all(), self._eval(node[1]), assume_unique=True)
+        if op == "or":
+            result = self._eval(node[1])
+            for child in node[2:]:
+                result = np.union1d(result, self._eval(child))
+            return result
+        # AND: intersect the positive clauses, then subtract the negated ones
+        positive = [c for c in node[1:] if c[0] != "not"]
+        negative = [c[1] for c in node[1:] if c[0] == "not"]
+        result = None
+        for child in positive:
+            docs = self._eval(child)
+            result = docs if result is None else np.intersect1d(result, docs, assume_unique=True)
+            if len(result) == 0:
+                return result
+        if result is None:
+            result = self._all()
+        for child in negative:
+            result = np.setdiff1d(result, self._eval(child), assume_unique=True)
+        return result
+
+    def search(self, query: str, org_id: str, kinds: Optional[List[str]] = None,
+               since: Optional[float] = None, until: Optional[float] = None,
+               limit: int = 50, cursor: Optional[str] = None) -> Dict:
+        """Matching docs of one org, newest first; each hit is resolved to its current document"""
+        started = time.perf_counter()
+        tree = parse_query(query)
+        limit = max(1, min(limit, SEARCH_MAX_RESULTS))
+        with self.lock:
+            base = self.base
+            org = self.org_codes.get(org_id)
+            docs = self._eval(tree).astype(np.int64) if org is not None else np.empty(0, dtype=np.int64)
+            kind_col = np.frombuffer(self.kinds, dtype=np.int8).copy()
+            ts_col = np.frombuffer(self.timestamps, dtype=np.float64).copy()
+            org_col = np.frombuffer(self.orgs, dtype=np.int32).copy()
+            ref_col = np.frombuffer(self.refs, dtype=np.int64).copy()
+        # Columns are indexed by doc id - base from here on; posting lists not yet
+        # trimmed by compact() may still hold older ids
+        docs = docs[docs >= base] - base
+        # Scope to the org before anything is resolved
+        docs = docs[org_col[docs] == org]
+        if kinds:
+            docs = docs[np.isin(kind_col[docs], [KIND_CODES[k] for k in kinds])]
+        if since is not None:
+            docs = docs[ts_col[docs] >= since]
+        if until is not None:
+            docs = docs[ts_col[docs] < until]
+        matched = len(docs)
+        if cursor:
+            cursor_ts, cursor_doc = decode_cursor(cursor)
+            ts = ts_col[docs]
+            docs = docs[(ts < cursor_ts) | ((ts == cursor_ts) & (docs < cursor_doc - base))]
+        # Newest first: timestamp desc, then doc id desc
+        order = np.lexsort((-docs, -ts_col[docs]))
+        page = docs[order][:limit + 1]
+        hits = [self._hit(int(d) + base, KINDS[kind_col[d]], float(ts_col[d]), int(org_col[d]), int(ref_col[d]))
+                for d in page[:limit]]
+        self._resolve(hits)
+        next_cursor = f"{hits[-1]['timestamp']!r}:{hits[-1]['doc_id']}" if len(page) > limit else None
+        return {
+            "query": query,
+            "total": matched,
+            "results": hits,
+            "next_cursor": next_cursor,
+            "took_ms": round((time.perf_counter() - started) * 1000, 2)
+        }
+
+    def _hit(self, doc: int, kind: str, timestamp: float, org: int, ref: int) -> Dict:
+        return {"doc_id": doc, "kind": kind, "timestamp": timestamp,
+                "org_id": self.org_ids[org] if org >= 0 else None, "ref": ref}
+
+    def _resolve(self, hits: List[Dict]):
+        by_kind = {}
+        for hit in hits:
+            by_kind.setdefault(hit["kind"], []).append(hit)
+        for kind, group in by_kind.items():
+            resolver = self.resolvers.get(kind)
+            found = {}
+            if resolver is not None:
+                try:
+                    found = resolver([(h["org_id"], h["ref"]) for h in group])
+                except Exception as e:
+                    print(f"❌ Search resolver failed for {kind}: {e}")
+            for hit in group:
+                # None once the source has dropped it (e.g. evicted by retention)
+                hit["document"] = found.get((hit["org_id"], hit["ref"]))
+
+    def stats(self) -> Dict:
+        with self.lock:
+            posting_bytes = sum(p.itemsize * len(p) for p in self.postings.values())
+            per_kind = np.bincount(np.frombuffer(self.kinds, dtype=np.int8), minlength=len(KINDS)) \
+                if len(self.kinds) else np.zeros(len(KINDS), dtype=np.int64)
+            return {
+                "items": len(self.kinds),
+                "max_items": self.max_docs or None,
+                "max_age_seconds": self.max_age or None,
+                "first_doc_id": self.base,
+                "terms": len(self.postings),
+                "docs_by_kind": {kind: int(n) for kind, n in zip(KINDS, per_kind)},
+                "bytes": posting_bytes + len(self.kinds) * 29 + len(self.postings) * 120
+            }
+
+    def backfill(self, sources: List[Callable[[], Iterable]]):
+        """Index pre-existing docs from each source in a background thread.
+
+        Each source is called now, so it can fix its boundary before live
+        indexing moves on, and returns an iterable of ("event", (org_id, seq, event))
+        or ("audit", (row_id, record)) pairs.
+        """
+        iterables = [source() for source in sources]
+
+        def run():
+            count = 0
+            for items in iterables:
+                events = []
+                try:
+                    for kind, args in items:
+                        if kind == "event":
+                            events.append(args)
+                            if len(events) >= 1000:
+                                self.add_events(events)
+                                events = []
+                        else:
+                            self.add_audit(*args)
+                        count += 1
+                    self.add_events(events)
+                except Exception as e:
+                    print(f"❌ Search backfill failed: {e}")
+            print(f"✅ Search index backfilled {count} document(s)")
+
+        threading.Thread(target=run, name="search-backfill", daemon=True).start()
+
+def decode_cursor(cursor: str):
+    try:
+        timestamp, doc = cursor.rsplit(":", 1)
+        return float(timestamp), int(doc)
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+# ----- query language -----
+# Terms are ANDed by default; AND / OR / NOT (or a leading '-') and parentheses
+# combine them. field:value restricts a term to one field, a trailing '*' makes it
+# a prefix, and "quoted values" keep their spaces.
+
+QUERY_TOKEN = re.compile(r'\(|\)|-?(?:[A-Za-z_]+:)?"[^"]*"\*?|[^\s()]+')
+
+def parse_query(query: str):
+    tokens = QUERY_TOKEN.findall(query or "")
+    if not tokens:
+        raise ValueError("Empty query")
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else None
+
+    def take():
+        nonlocal pos
+        pos += 1
+        return tokens[pos - 1]
+
+    def parse_or():
+        children = [parse_and()]
+        while peek() == "OR":
+            take()
+            children.append(parse_and())
+        return children[0] if len(children) == 1 else ("or", *children)
+
+    def parse_and():
+        children = [parse_not()]
+        while peek() not in (None, ")", "OR"):
+            if peek() == "AND":
+                take()
+            children.append(parse_not())
+        return children[0] if len(children) == 1 else ("and", *children)
+
+    def parse_not():
+        token = peek()
+        if token == "NOT":
+            take()
+            return ("not", parse_not())
+        if token is not None and token.startswith("-") and len(token) > 1:
+            tokens[pos] = token[1:]
+            return ("not", parse_not())
+        return parse_atom()
+
+    def parse_atom():
+        token = peek()
+        if token is None or token in (")", "AND", "OR"):
+            raise ValueError(f"Unexpected {token or 'end of query'!r}")
+        take()
+        if token == "(":
+            node = parse_or()
+            if peek() != ")":
+                raise ValueError("Missing ')'")
+            take()
+            return node
+        return parse_term(token)
+
+    node = parse_or()
+    if pos != len(tokens):
+        raise ValueError(f"Unexpected {tokens[pos]!r}")
+    return node
+
+def parse_term(token: str):
+    field = None
+    name, sep, rest = token.partition(":")
+    if sep and name in FIELDS:
+        field, token = name, rest
+    prefix = token.endswith("*") and len(token) > 1
+    if prefix:
+        token = token[:-1]
+    if len(token) >= 2 and token.startswith('"') and token.endswith('"'):
+        token = token[1:-1]
+    token = token.strip().lower()[:SEARCH_MAX_TOKEN_LENGTH]
+    if not token:
+        raise ValueError("Empty search term")
+    return ("term", field, token, prefix)
+
+SEARCH = SearchIndex()
+RETENTION.register_sweep("search_index", SEARCH.compact, SEARCH.stats)
+
+@router.get("/")
+def search(q: str, org_id: str, kind: Optional[str] = None, since: Optional[float] = None,
+           until: Optional[float] = None, limit: int = 50, cursor: Optional[str] = None):
+    """Boolean / prefix search over one org's events, correlated incidents and agent incidents.
+
+    Example: q=file:/home/ops/secret.txt OR (process:nc* AND NOT user:root)
+    kind is a comma-separated subset of event,incident,audit.
+    """
+    kinds = [k.strip() for k in kind.split(",")] if kind else None
+    if kinds and any(k not in KIND_CODES for k in kinds):
+        raise HTTPException(status_code=400, detail=f"kind must be among {', '.join(KINDS)}")
+    try:
+        return SEARCH.search(q, org_id, kinds, since, until, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/stats")
+def search_stats():
+    return SEARCH.stats()
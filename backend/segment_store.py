@@ -0,0 +1,228 @@
+import bisect
+import json
+import os
+import re
+import threading
+import time
+import numpy as np
+from typing import List, Dict, Optional
+from config import EVENT_SEGMENT_DIR
+from safe_names import path_name
+
+ORG_ID_FILE = "org_id"  # each org directory records the org id it was encoded from
+# <first_seq>-<count>-<min_ts>-<max_ts>.npz; older files may carry negative timestamps
+SEGMENT_NAME = re.compile(r"(\d+)-(\d+)-(-?\d+)-(-?\d+)\.npz")
+
+class SegmentStore:
+    """Cold event tier: append-only, compressed columnar segments per org and day.
+
+    Each segment holds a contiguous run of an org's event sequence numbers; its
+    file name carries first_seq, count and min/max timestamp so range scans can
+    skip segments without opening them.
+    """
+
+    def __init__(self, root: str = EVENT_SEGMENT_DIR):
+        self.root = root
+        self.lock = threading.Lock()
+        self.index = {}  # org_id -> [segment meta], ordered by first_seq
+        self._migrate_names()
+
+    def _migrate_names(self):
+        """Rename directories written under the old org_id.replace("/", "__") naming"""
+        if not os.path.isdir(self.root):
+            return
+        for name in os.listdir(self.root):
+            if os.path.exists(os.path.join(self.root, name, ORG_ID_FILE)):
+                continue
+            org_id = name.replace("__", "/")
+            target = self._org_dir(org_id)
+            if os.path.join(self.root, name) != target and os.path.exists(target):
+                continue
+            os.rename(os.path.join(self.root, name), target)
+            self._record_org_id(org_id)
+
+    def _org_dir(self, org_id: str) -> str:
+        # Org ids are client-supplied; they must never name a path outside root
+        return os.path.join(self.root, path_name(org_id))
+
+    def _record_org_id(self, org_id: str):
+        path = os.path.join(self._org_dir(org_id), ORG_ID_FILE)
+        if not os.path.exists(path):
+            with open(path, "w") as f:
+                f.write(org_id)
+
+    def orgs(self) -> List[str]:
+        if not os.path.isdir(self.root):
+            return []
+        found = []
+        for name in os.listdir(self.root):
+            try:
+                with open(os.path.join(self.root, name, ORG_ID_FILE)) as f:
+                    found.append(f.read())
+            except OSError:
+                continue
+        return found
+
+    def segments(self, org_id: str) -> List[Dict]:
+        with self.lock:
+            if org_id not in self.index:
+                self.index[org_id] = self._scan(org_id)
+            return list(self.index[org_id])
+
+    def _scan(self, org_id: str) -> List[Dict]:
+        found = []
+        org_dir = self._org_dir(org_id)
+        if not os.path.isdir(org_dir):
+            return found
+        for day in os.listdir(org_dir):
+            if day == ORG_ID_FILE:
+                continue
+            for name in os.listdir(os.path.join(org_dir, day)):
+                match = SEGMENT_NAME.fullmatch(name)
+                if match is None:
+                    if name.endswith(".npz"):
+                        print(f"⚠️ Skipping unrecognized event segment {os.path.join(org_dir, day, name)}")
+                    continue
+                first_seq, count, min_ts, max_ts = (int(p) for p in match.groups())
+                found.append({"first_seq": first_seq, "count": count, "min_ts": min_ts,
+                              "max_ts": max_ts, "path": os.path.join(org_dir, day, name)})
+        return sorted(found, key=lambda s: s["first_seq"])
+
+    def next_seq(self, org_id: str) -> int:
+        segs = self.segments(org_id)
+        return segs[-1]["first_seq"] + segs[-1]["count"] if segs else 0
+
+    def write(self, org_id: str, first_seq: int, columns: Dict) -> Dict:
+        """Persist one contiguous chunk of events as a compressed segment"""
+        timestamps = columns["timestamps"]
+        count = len(timestamps)
+        min_ts, max_ts = int(timestamps.min()), int(timestamps.max())
+        day = time.strftime("%Y-%m-%d", time.gmtime(min_ts))
+        directory = os.path.join(self._org_dir(org_id), day)
+        os.makedirs(directory, exist_ok=True)
+        self._record_org_id(org_id)
+        path = os.path.join(directory, f"{first_seq:012d}-{count}-{min_ts}-{max_ts}.npz")
+        # Per-segment dictionaries keep the files independent of in-process interning
+        type_names, type_codes = np.unique(columns["event_types"], return_inverse=True)
+        agent_names, agent_codes = np.unique(columns["agent_ids"], return_inverse=True)
+        details = [d.encode() for d in columns["details"]]
+        offsets = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum([len(d) for d in details], out=offsets[1:])
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez_compressed(
+                f,
+                timestamps=timestamps.astype(np.int64),
+                type_names=type_names.astype(str), type_codes=type_codes.astype(np.int16),
+                agent_names=agent_names.astype(str), agent_codes=agent_codes.astype(np.int32),
+                scores=columns["scores"].astype(np.uint8),
+                anomaly_scores=columns["anomaly_scores"].astype(np.float32),
+                details_data=np.frombuffer(b"".join(details), dtype=np.uint8),
+                details_offsets=offsets
+            )
+        os.replace(tmp, path)
+        meta = {"first_seq": first_seq, "count": count, "min_ts": min_ts, "max_ts": max_ts, "path": path}
+        with self.lock:
+            if org_id in self.index:
+                self.index[org_id].append(meta)
+        return meta
+
+    def query(self, org_id: str, limit: Optional[int] = None, since: Optional[int] = None,
+              until: Optional[int] = None, agent_id: Optional[str] = None,
+              before_seq: Optional[int] = None) -> List[Dict]:
+        """Newest `limit` matching events with seq < before_seq, oldest first"""
+        results = []
+        for seg in reversed(self.segments(org_id)):
+            if limit is not None and len(results) >= limit:
+                break
+            if before_seq is not None and seg["first_seq"] >= before_seq:
+                continue
+            if (since is not None and seg["max_ts"] < since) or (until is not None and seg["min_ts"] > until):
+                continue  # whole segment outside the time range
+            events = self._read(org_id, seg, since, until, agent_id, before_seq)
+            if limit is not None:
+                events = events[-(limit - len(results)):]
+            results = events + results
+        return results
+
+    def _read(self, org_id, seg, since, until, agent_id, before_seq) -> List[Dict]:
+        with np.load(seg["path"]) as data:
+            timestamps = data["timestamps"]
+            mask = np.ones(len(timestamps), dtype=bool)
+            if before_seq is not None:
+                mask[max(0, before_seq - seg["first_seq"]):] = False
+            if since is not None:
+                mask &= timestamps >= since
+            if until is not None:
+                mask &= timestamps <= until
+            agent_names = data["agent_names"]
+            if agent_id is not None:
+                code = np.flatnonzero(agent_names == agent_id)
+                if len(code) == 0:
+                    return []
+                mask &= data["agent_codes"] == code[0]
+            rows = np.flatnonzero(mask)
+            if len(rows) == 0:
+                return []
+            return self._events(org_id, data, rows)
+
+    def _events(self, org_id, data, rows) -> List[Dict]:
+        timestamps, agent_names = data["timestamps"], data["agent_names"]
+        type_names, type_codes = data["type_names"], data["type_codes"]
+        agent_codes, scores = data["agent_codes"], data["scores"]
+        anomaly_scores = data["anomaly_scores"]
+        details_data, offsets = data["details_data"].tobytes(), data["details_offsets"]
+        events = []
+        for i in rows:
+            event = {
+                "agent_id": str(agent_names[agent_codes[i]]),
+                "event_type": str(type_names[type_codes[i]]),
+                "timestamp": int(timestamps[i]),
+                "details": json.loads(details_data[offsets[i]:offsets[i + 1]]),
+                "org_id": org_id,
+                "threat_score": int(scores[i])
+            }
+            if not np.isnan(anomaly_scores[i]):
+                event["ml_detected"] = True
+                event["anomaly_score"] = float(anomaly_scores[i])
+            events.append(event)
+        return events
+
+    def get(self, org_id: str, seqs: List[int]) -> Dict[int, Dict]:
+        """Events by sequence number, opening each segment involved once"""
+        segs = self.segments(org_id)
+        starts = [s["first_seq"] for s in segs]
+        by_segment = {}
+        for seq in seqs:
+            i = bisect.bisect_right(starts, seq) - 1
+            if i >= 0 and seq < segs[i]["first_seq"] + segs[i]["count"]:
+                by_segment.setdefault(i, []).append(seq)
+        found = {}
+        for i, wanted in by_segment.items():
+            seg = segs[i]
+            with np.load(seg["path"]) as data:
+                rows = [seq - seg["first_seq"] for seq in wanted]
+                found.update(zip(wanted, self._events(org_id, data, rows)))
+        return found
+
+    def scan(self, org_id: str, before_seq: Optional[int] = None):
+        """(seq, event) for every stored event below before_seq, oldest first"""
+        for seg in self.segments(org_id):
+            if before_seq is not None and seg["first_seq"] >= before_seq:
+                break
+            count = seg["count"] if before_seq is None else min(seg["count"], before_seq - seg["first_seq"])
+            with np.load(seg["path"]) as data:
+                events = self._events(org_id, data, range(count))
+            yield from zip(range(seg["first_seq"], seg["first_seq"] + count), events)
+
+    def stats(self, org_id: str) -> Dict:
+        segs = self.segments(org_id)
+        return {
+            "segments": len(segs),
+            "events": sum(s["count"] for s in segs),
+            "bytes": sum(os.path.getsize(s["path"]) for s in segs if os.path.exists(s["path"])),
+            "min_ts": min((s["min_ts"] for s in segs), default=None),
+            "max_ts": max((s["max_ts"] for s in segs), default=None)
+        }
+
+SEGMENTS = SegmentStore()
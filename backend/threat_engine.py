@@ -1,69 +1,192 @@
-from ml_engine import detector
+from ml_engine import registry, model_key
+from rule_matcher import RuleSet
+from config import (CORRELATION_WINDOW_SECONDS, CORRELATION_SCORE_THRESHOLD,
+                    CORRELATION_MIN_EVENTS, INCIDENT_MAX_EVENTS, INCIDENT_RETENTION_ITEMS,
+                    INCIDENT_RETENTION_SECONDS, RETENTION_STORE_BYTES)
+from retention import RETENTION
+from search_index import SEARCH, event_fields
+import bisect
+import threading
 import time
-from collections import defaultdict
+from collections import deque
 
 INCIDENTS = []
 INCIDENT_COUNTER = 0
 
-def calculate_threat_score_with_ml(event):
-    """Score using both rules and ML"""
-    # Rule-based score
-    THREAT_RULES = {
-        "curl": 80,
-        "bash": 50,
-        "network_connection": 40,
-        "file_write": 30,
-    }
-    
-    score = 0
-    process = event.get("details", {}).get("process", "")
-    event_type = event.get("event_type", "")
-    
-    for keyword, weight in THREAT_RULES.items():
-        if keyword in process or keyword in event_type:
-            score += weight
-    
-    # ML anomaly boost
-    ml_result = detector.detect_anomaly(event)
+def incidents_evicted(evicted):
+    # The correlator must stop merging into incidents nobody can see any more
+    CORRELATOR.close_incidents(evicted)
+
+RETENTION.register("incidents", lambda: INCIDENTS, max_items=INCIDENT_RETENTION_ITEMS,
+                   max_bytes=RETENTION_STORE_BYTES, max_age=INCIDENT_RETENTION_SECONDS,
+                   timestamp=lambda i: i["timestamp"], on_evict=incidents_evicted)
+
+def get_incidents(refs):
+    """Search resolver: INCIDENTS is ordered by incident_id, so look ids up by bisection"""
+    incidents = list(INCIDENTS)
+    ids = [i["incident_id"] for i in incidents]
+    found = {}
+    for org_id, incident_id in refs:
+        i = bisect.bisect_left(ids, incident_id)
+        if i < len(ids) and ids[i] == incident_id:
+            found[(org_id, incident_id)] = incidents[i]
+    return found
+
+SEARCH.register_resolver("incident", get_incidents)
+
+THREAT_RULES = {
+    "curl": 80,
+    "bash": 50,
+    "network_connection": 40,
+    "file_write": 30,
+}
+THREAT_RULESET = RuleSet(THREAT_RULES)
+
+def set_threat_rules(rules):
+    """Replace the keyword rules; the matcher is recompiled once here"""
+    THREAT_RULES.clear()
+    THREAT_RULES.update(rules)
+    return THREAT_RULESET.update(THREAT_RULES)
+
+def calculate_rule_score(event):
+    """Rule-based keyword score for a single event"""
+    process = str(event.get("details", {}).get("process", ""))
+    event_type = str(event.get("event_type", ""))
+    # One automaton pass; NUL keeps keywords from spanning the two fields
+    return THREAT_RULESET.score(f"{process}\x00{event_type}")
+
+def apply_ml_result(event, score, ml_result):
+    """Fold an ML anomaly verdict into a rule score"""
     if ml_result["is_anomaly"]:
         score += int(ml_result["anomaly_score"] * 30)
         event["ml_detected"] = True
         event["anomaly_score"] = ml_result["anomaly_score"]
-    
     return min(score, 100)
 
-def correlate_events(events):
-    """Group related events into incidents"""
-    global INCIDENT_COUNTER
-    agent_events = defaultdict(list)
-    
-    for e in events[-50:]:
-        agent_events[e["agent_id"]].append(e)
+def calculate_threat_score_with_ml(event):
+    """Score using both rules and ML"""
+    score = calculate_rule_score(event)
     
+    # ML anomaly boost
+    ml_result = registry.get(model_key(event.get("org_id"))).detect_anomaly(event)
+    return apply_ml_result(event, score, ml_result)
+
+def calculate_threat_scores_with_ml(events):
+    """Score a batch of events using rules and one batched ML pass"""
+    rule_scores = [calculate_rule_score(e) for e in events]
+    ml_results = registry.detect_anomaly_batch(events)
+    return [
+        apply_ml_result(event, score, ml_result)
+        for event, score, ml_result in zip(events, rule_scores, ml_results)
+    ]
+
+class SlidingWindowCorrelator:
+    """Incremental per-(org, agent) correlation over a time window of high-score events"""
+
+    def __init__(self, window_seconds=CORRELATION_WINDOW_SECONDS,
+                 score_threshold=CORRELATION_SCORE_THRESHOLD,
+                 min_events=CORRELATION_MIN_EVENTS,
+                 max_incident_events=INCIDENT_MAX_EVENTS):
+        self.window_seconds = window_seconds
+        self.score_threshold = score_threshold
+        self.min_events = min_events
+        self.max_incident_events = max_incident_events
+        self.windows = {}  # (org_id, agent_id) -> deque of high-score events
+        self.open_incidents = {}  # (org_id, agent_id) -> incident dict
+        self.lock = threading.Lock()
+
+    def _evict(self, key, window, now_ts):
+        cutoff = now_ts - self.window_seconds
+        while window and window[0]["timestamp"] < cutoff:
+            window.popleft()
+        incident = self.open_incidents.get(key)
+        if incident and incident["last_seen"] < cutoff:
+            incident["status"] = "closed"
+            del self.open_incidents[key]
+            SEARCH.seal("incident", incident["incident_id"])
+
+    def observe(self, event):
+        """Fold one scored event into its agent's window; returns a new incident or None"""
+        if event.get("threat_score", 0) <= self.score_threshold:
+            return None
+        key = (event.get("org_id"), event["agent_id"])
+        ts = event["timestamp"]
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None:
+                window = self.windows[key] = deque()
+            self._evict(key, window, ts)
+            window.append(event)
+
+            incident = self.open_incidents.get(key)
+            if incident is not None:
+                # Merge new evidence into the open incident
+                incident["event_count"] += 1
+                # timestamp stays the creation time: retention evicts incidents
+                # oldest-first on it, so activity is tracked in last_seen only
+                incident["last_seen"] = max(incident["last_seen"], ts)
+                if event.get("ml_detected"):
+                    incident["ml_detected"] += 1
+                incident["events"].append(event)
+                if len(incident["events"]) > self.max_incident_events:
+                    del incident["events"][0]
+                SEARCH.extend("incident", incident["incident_id"], event_fields(event))
+                return None
+
+            if len(window) < self.min_events:
+                return None
+            return self._open_incident(key, list(window))
+
+    def _open_incident(self, key, evt_list):
+        global INCIDENT_COUNTER
+        INCIDENT_COUNTER += 1
+        incident = {
+            "incident_id": INCIDENT_COUNTER,
+            "org_id": key[0],
+            "agent_id": key[1],
+            "severity": "high",
+            "event_count": len(evt_list),
+            "timestamp": int(time.time()),
+            "first_seen": evt_list[0]["timestamp"],
+            "last_seen": evt_list[-1]["timestamp"],
+            "events": evt_list[-self.max_incident_events:],
+            "status": "active",
+            "ml_detected": sum(1 for e in evt_list if e.get("ml_detected"))
+        }
+        self.open_incidents[key] = incident
+        INCIDENTS.append(incident)
+        SEARCH.add_incident(incident)
+        return incident
+
+    def close_incidents(self, incidents):
+        """Close these incidents if still open; later events open a new one"""
+        with self.lock:
+            for incident in incidents:
+                key = (incident["org_id"], incident["agent_id"])
+                if self.open_incidents.get(key) is incident:
+                    incident["status"] = "closed"
+                    del self.open_incidents[key]
+                    SEARCH.seal("incident", incident["incident_id"])
+
+    def sweep(self, now_ts=None):
+        """Drop state for agents whose window has gone quiet"""
+        now_ts = now_ts if now_ts is not None else int(time.time())
+        with self.lock:
+            for key in list(self.windows):
+                window = self.windows[key]
+                self._evict(key, window, now_ts)
+                if not window and key not in self.open_incidents:
+                    del self.windows[key]
+
+CORRELATOR = SlidingWindowCorrelator()
+
+def correlate_events(events):
+    """Feed scored events to the correlator; returns newly opened incidents"""
     new_incidents = []
-    for agent_id, evt_list in agent_events.items():
-        # Train ML on baseline first
-        detector.learn_baseline(evt_list)
-        
-        high_score_events = [e for e in evt_list if calculate_threat_score_with_ml(e) > 60]
-        if len(high_score_events) >= 2:
-            INCIDENT_COUNTER += 1
-            incident = {
-                "incident_id": INCIDENT_COUNTER,
-                "agent_id": agent_id,
-                "severity": "high",
-                "event_count": len(high_score_events),
-                "timestamp": int(time.time()),
-                "events": high_score_events,
-                "status": "active",
-                "ml_detected": sum(1 for e in high_score_events if e.get("ml_detected"))
-            }
+    for e in events:
+        incident = CORRELATOR.observe(e)
+        if incident is not None:
             new_incidents.append(incident)
-    
-    INCIDENTS.extend(new_incidents)
-    if len(INCIDENTS) > 50:
-        INCIDENTS[:] = INCIDENTS[-50:]
-    
     return new_incidents
 
 def auto_respond(incident):
@@ -77,6 +200,6 @@ def auto_respond(incident):
         responses.append(f"ACTION: Agent quarantine initiated")
     return responses
 
-def get_ml_stats():
+def get_ml_stats(org_id=None):
     """Get ML detection statistics"""
-    return detector.get_detection_stats()
+    return registry.get_detection_stats(org_id)
@@ -0,0 +1,257 @@
+# Background telemetry uploader for agents: buffers records, sends gzip'd NDJSON batches
+# over a pooled requests.Session, and spools to disk while the backend is unreachable.
+import atexit
+import gzip
+import json
+import os
+import queue
+import threading
+import time
+import requests
+
+MAX_BACKOFF = 30.0
+MAX_REJECTED_BYTES = 10 * 1024 * 1024  # cap on the dead-letter file of rejected records
+
+class BatchUploader:
+    def __init__(self, base_url, spool_path, batch_size=200, flush_interval=1.0,
+                 max_pending=10000, timeout=5):
+        self.base_url = base_url
+        self.spool_path = spool_path
+        self.offset_path = spool_path + ".offset"
+        self.rejected_path = spool_path + ".rejected"
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.session = requests.Session()  # keep-alive connections reused across batches
+        self.spool_lock = threading.Lock()
+        self.backoff = 0.0
+        self.retry_at = 0.0
+        self.stats = {"sent": 0, "spooled": 0, "replayed": 0, "rejected": 0, "skipped": 0}
+        self.hooks = {}  # endpoint -> (prepare, on_result)
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="uploader", daemon=True)
+            self.thread.start()
+            atexit.register(self.close)
+        return self
+
+    def add_hook(self, endpoint, prepare=None, on_result=None):
+        """Per-endpoint callbacks, run on the uploader thread.
+
+        prepare(records) returns the subset worth sending (it may ask the backend);
+        on_result(records, accepted) runs once the backend accepted or rejected them.
+        """
+        self.hooks[endpoint] = (prepare, on_result)
+        return self
+
+    def submit(self, endpoint, record):
+        """Queue a record for upload; never blocks on the network"""
+        try:
+            self.pending.put_nowait((endpoint, record))
+        except queue.Full:
+            self._spool([(endpoint, record)])
+
+    def close(self):
+        """Persist anything still buffered so it is replayed on next start"""
+        leftover = self._drain(block=False)
+        if leftover:
+            self._spool(leftover)
+
+    # ----- batching -----
+
+    def _drain(self, block=True):
+        batch = []
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.time()
+            try:
+                if block and timeout > 0:
+                    batch.append(self.pending.get(timeout=timeout))
+                else:
+                    batch.append(self.pending.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._drain()
+            try:
+                if self._spool_size() > self._read_offset():
+                    # Keep ordering: new records queue up behind the spooled ones
+                    if batch:
+                        self._spool(batch)
+                    if time.time() >= self.retry_at:
+                        self._replay()
+                elif batch:
+                    undelivered = self._send_runs(batch)
+                    if undelivered:
+                        self._spool(undelivered)
+            except Exception as e:
+                print(f"[UPLOAD] Uploader error: {e}")
+
+    def _send_runs(self, batch):
+        """Send consecutive same-endpoint runs; returns whatever could not be delivered"""
+        start = 0
+        while start < len(batch):
+            endpoint = batch[start][0]
+            end = start
+            while end < len(batch) and batch[end][0] == endpoint:
+                end += 1
+            if not self._send(endpoint, [r for _, r in batch[start:end]]):
+                return batch[start:]
+            start = end
+        return []
+
+    def _send(self, endpoint, records):
+        prepare, on_result = self.hooks.get(endpoint, (None, None))
+        sending = records
+        if prepare is not None:
+            try:
+                sending = prepare(records)
+            except Exception as e:
+                print(f"[UPLOAD] {endpoint} prepare failed, sending all: {e}")
+        accepted = True
+        if sending:
+            accepted = self._post(endpoint, sending)
+            if accepted is None:
+                return False
+        if on_result is not None:
+            on_result(records, accepted)
+        return True
+
+    def _post(self, endpoint, records):
+        """True if accepted, False if rejected, None if the backend is unavailable"""
+        body = gzip.compress("\n".join(json.dumps(r) for r in records).encode())
+        try:
+            res = self.session.post(
+                f"{self.base_url}{endpoint}", data=body, timeout=self.timeout,
+                headers={"Content-Type": "application/x-ndjson", "Content-Encoding": "gzip"}
+            )
+        except requests.RequestException as e:
+            return self._failed(f"{e.__class__.__name__}")
+        if res.status_code == 429 or res.status_code >= 500:
+            return self._failed(f"HTTP {res.status_code}")
+        self.backoff = 0.0
+        if res.status_code >= 400:
+            # Malformed records will never succeed; set them aside rather than block the spool
+            self.stats["rejected"] += len(records)
+            print(f"[UPLOAD] {endpoint} rejected {len(records)} records: HTTP {res.status_code} "
+                  f"{res.text[:200]!r}; kept in {self.rejected_path}")
+            self._dead_letter(endpoint, records, res.status_code)
+            return False
+        self.stats["sent"] += len(records)
+        return True
+
+    def _failed(self, reason):
+        self.backoff = min(max(self.backoff * 2, self.flush_interval), MAX_BACKOFF)
+        self.retry_at = time.time() + self.backoff
+        print(f"[UPLOAD] Backend unavailable ({reason}), spooling; retry in {self.backoff:.0f}s")
+        return None
+
+    def _dead_letter(self, endpoint, records, status):
+        try:
+            if os.path.exists(self.rejected_path) and os.path.getsize(self.rejected_path) >= MAX_REJECTED_BYTES:
+                return
+            with open(self.rejected_path, "a") as f:
+                for record in records:
+                    f.write(json.dumps({"endpoint": endpoint, "status": status, "record": record}) + "\n")
+        except OSError as e:
+            print(f"[UPLOAD] Could not record rejected records: {e}")
+
+    # ----- spool -----
+
+    def _spool(self, batch):
+        data = "".join(json.dumps({"endpoint": endpoint, "record": record}) + "\n"
+                       for endpoint, record in batch).encode()
+        with self.spool_lock:
+            with open(self.spool_path, "ab+") as f:
+                self._trim_torn_tail(f)
+                f.write(data)
+        self.stats["spooled"] += len(batch)
+
+    def _trim_torn_tail(self, f):
+        """Cut a partial last line (from a crash mid-write) so new lines start clean"""
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        end = size
+        while end > 0:
+            start = max(0, end - 4096)
+            f.seek(start)
+            chunk = f.read(end - start)
+            if start + len(chunk) == size and chunk.endswith(b"\n"):
+                return  # already ends on a full line
+            newline = chunk.rfind(b"\n")
+            if newline >= 0:
+                end = start + newline + 1
+                break
+            end = start
+        print(f"[UPLOAD] Dropping {size - end} bytes of a torn spool write")
+        f.truncate(end)
+        f.seek(end)
+
+    def _spool_size(self):
+        try:
+            return os.path.getsize(self.spool_path)
+        except FileNotFoundError:
+            return 0
+
+    def _read_offset(self):
+        try:
+            with open(self.offset_path) as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_offset(self, offset):
+        tmp = self.offset_path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(str(offset))
+        os.replace(tmp, self.offset_path)
+
+    def _replay(self):
+        """Send spooled records in order, committing the offset after each batch"""
+        offset = self._read_offset()
+        with open(self.spool_path) as f:
+            f.seek(offset)
+            while True:
+                lines = []
+                for _ in range(self.batch_size):
+                    line = f.readline()
+                    if not line.endswith("\n"):
+                        break  # EOF (or a torn final write)
+                    lines.append(line)
+                if not lines:
+                    break
+                batch_start = offset
+                entries = []  # (offset just past the line, endpoint, record)
+                for line in lines:
+                    offset += len(line.encode())
+                    try:
+                        entry = json.loads(line)
+                        entries.append((offset, entry["endpoint"], entry["record"]))
+                    except (ValueError, KeyError, TypeError):
+                        # Never retry a line that cannot parse; it would wedge the spool
+                        self.stats["skipped"] += 1
+                        print(f"[UPLOAD] Skipping unreadable spool line at byte {offset - len(line.encode())}")
+                sent = 0
+                while sent < len(entries):
+                    endpoint = entries[sent][1]
+                    end = sent
+                    while end < len(entries) and entries[end][1] == endpoint:
+                        end += 1
+                    if not self._send(endpoint, [e[2] for e in entries[sent:end]]):
+                        self._write_offset(entries[sent - 1][0] if sent else batch_start)
+                        return
+                    self.stats["replayed"] += end - sent
+                    sent = end
+                self._write_offset(offset)
+        with self.spool_lock:
+            if self._spool_size() == offset:
+                # Fully drained: start a fresh spool
+                os.remove(self.spool_path)
+                os.remove(self.offset_path)